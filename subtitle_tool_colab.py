@@ -28,8 +28,10 @@
 # ==============================================================================
 # 1. 環境構築 (両スクリプトの要件を統合)
 # ==============================================================================
-print("--- 1. 統合環境の構築を開始します (初回は数分かかります) ---")
-!apt-get update -y -qq
+import subprocess, sys
+# 環境構築はColabのノートブック上で直接実行したときだけ行う。
+# `python subtitle_tool_colab.py --batch ...` のようなヘッドレス実行やimport時は、構築済みの環境を前提とする
+IN_NOTEBOOK = "ipykernel" in sys.modules
 
 
 
@@ -38,11 +40,9 @@ print("--- 1. 統合環境の構築を開始します (初回は数分かかり
 
 
 
-# 両方のスクリプトで必要なパッケージをすべてインストール
-print("⏳ 必要なシステムパッケージをインストール中...")
-!apt-get install -y -qq ffmpeg mecab mecab-ipadic-utf8 git fontconfig \
-fonts-noto-cjk fonts-noto-cjk-extra \
-fonts-ipafont-gothic fonts-ipafont-mincho
+def setup_shell(cmd: str) -> None:
+ """環境構築用のシェルコマンドを実行する (ノートブックの ! と同じく、失敗しても止めない)"""
+ subprocess.run(cmd, shell=True, check=False)
 
 
 
@@ -51,30 +51,27 @@ fonts-ipafont-gothic fonts-ipafont-mincho
 
 
 
-# フォントキャッシュを強制更新 (重要)
-print("⏳ フォントキャッシュを更新中...")
-!fc-cache -fv > /dev/null
+if IN_NOTEBOOK and __name__ == "__main__":
+ print("--- 1. 統合環境の構築を開始します (初回は数分かかります) ---")
+ setup_shell("apt-get update -y -qq")
 
+ # 両方のスクリプトで必要なパッケージをすべてインストール
+ print("⏳ 必要なシステムパッケージをインストール中...")
+ setup_shell("apt-get install -y -qq ffmpeg mecab mecab-ipadic-utf8 git fontconfig "
+             "fonts-noto-cjk fonts-noto-cjk-extra "
+             "fonts-ipafont-gothic fonts-ipafont-mincho")
 
+ # フォントキャッシュを強制更新 (重要)
+ print("⏳ フォントキャッシュを更新中...")
+ setup_shell("fc-cache -fv > /dev/null")
 
-
-
-
-
-
-# 両方のスクリプトで必要なPythonライブラリをすべてインストール
-print("⏳ 必要なPythonライブラリをインストール中...")
-!pip install -q -U pip wheel
-!pip install -q -U gradio stable-ts pillow numpy opencv-python-headless scikit-learn
-
-
-
-
-
-
-
-
-print("✅ 統合環境の構築が完了しました")
+ # 両方のスクリプトで必要なPythonライブラリをすべてインストール
+ print("⏳ 必要なPythonライブラリをインストール中...")
+ setup_shell(f"{sys.executable} -m pip install -q -U pip wheel")
+ setup_shell(f"{sys.executable} -m pip install -q -U gradio stable-ts faster-whisper pillow numpy opencv-python-headless scikit-learn")
+ print("✅ 統合環境の構築が完了しました")
+else:
+ print("[INFO] ノートブック外で実行されているため、環境構築をスキップします。")
 
 
 
@@ -94,10 +91,13 @@ print("✅ 統合環境の構築が完了しました")
 # ==============================================================================
 # 2. 共通および各機能の関数定義
 # ==============================================================================
-import argparse, json, os, shutil, subprocess, tempfile, textwrap, datetime, sys, re, traceback
+import abc, argparse, atexit, bisect, hashlib, io, json, os, shutil, sqlite3, subprocess, tempfile, textwrap, datetime, sys, re, traceback, threading, time, uuid
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
 from functools import partial
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 
 import numpy as np
 from PIL import Image
@@ -127,21 +127,59 @@ print("--- 2. 関数の定義を開始します ---")
 
 # --- 共通ユーティリティ関数 ---
 # (より詳細なエラー出力を持つ動画字幕付けスクリプトのrun_chkを採用)
-def run_chk(cmd:list[str], **kw) -> None:
- """コマンドを実行しエラーがあれば詳細なログと例外を投げる"""
+# 失敗時の報告用に保持する標準出力/標準エラーの末尾の行数
+SUBPROCESS_TAIL_LINES = 200
+
+
+def parse_ffmpeg_progress(fields: Dict[str, str]) -> Dict[str, float]:
+ """ffmpegの -progress 出力1ブロック分を数値に変換する"""
+ def num(key: str) -> float:
+     try: return float(fields.get(key, "0").rstrip("x"))
+     except ValueError: return 0.0
+ # out_time_ms も実際の単位はマイクロ秒
+ out_time_us = num("out_time_us") or num("out_time_ms")
+ return {"out_time": out_time_us / 1e6, "frame": num("frame"), "fps": num("fps"), "speed": num("speed"),
+         "done": fields.get("progress") == "end"}
+
+
+def run_chk(cmd:list[str], on_progress: Optional[Callable[[Dict[str, float]], None]] = None, **kw) -> None:
+ """コマンドを実行しエラーがあれば詳細なログと例外を投げる。on_progressにはffmpegの進捗を逐次渡す"""
+ if on_progress and cmd and cmd[0] == "ffmpeg" and "-progress" not in cmd:
+     # 進捗をkey=value形式で標準出力へ出させ、標準エラーの進捗行は止める
+     cmd = [cmd[0], "-progress", "pipe:1", "-nostats"] + list(cmd[1:])
  try:
      # Popenを使用して標準出力と標準エラーをリアルタイムでストリーミング
-     process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, encoding='utf-8', **kw)
-     stdout, stderr = process.communicate()
-     if process.returncode != 0:
-         raise subprocess.CalledProcessError(process.returncode, cmd, output=stdout, stderr=stderr)
+     # 出力全体はメモリに溜めず、失敗時の報告に使う末尾だけをリングバッファに残す
+     process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, encoding='utf-8', errors='replace', **kw)
+     stdout_tail, stderr_tail = deque(maxlen=SUBPROCESS_TAIL_LINES), deque(maxlen=SUBPROCESS_TAIL_LINES)
+     drain = threading.Thread(target=stderr_tail.extend, args=(process.stderr,), daemon=True)
+     drain.start()
+     fields: Dict[str, str] = {}
+     for line in process.stdout:
+         key, sep, value = line.strip().partition("=")
+         if not (on_progress and sep):
+             stdout_tail.append(line)
+             continue
+         fields[key] = value
+         if key == "progress":
+             try:
+                 on_progress(parse_ffmpeg_progress(fields))
+             except Exception as e:
+                 # 進捗表示の失敗で変換自体を止めない
+                 print(f"[WARN] 進捗の通知に失敗したため、以降の通知を停止します: {e}")
+                 on_progress = None
+             fields = {}
+     returncode = process.wait()
+     drain.join()
+     if returncode != 0:
+         raise subprocess.CalledProcessError(returncode, cmd, output="".join(stdout_tail), stderr="".join(stderr_tail))
  except subprocess.CalledProcessError as e:
      print("--- SUBPROCESS FAILED ---", file=sys.stderr)
      print(f"COMMAND: {' '.join(map(str, e.cmd))}", file=sys.stderr)
      print(f"RETURN CODE: {e.returncode}", file=sys.stderr)
-     print("--- STDOUT ---", file=sys.stderr)
+     print(f"--- STDOUT (末尾{SUBPROCESS_TAIL_LINES}行まで) ---", file=sys.stderr)
      print(e.stdout, file=sys.stderr)
-     print("--- STDERR ---", file=sys.stderr)
+     print(f"--- STDERR (末尾{SUBPROCESS_TAIL_LINES}行まで) ---", file=sys.stderr)
      print(e.stderr, file=sys.stderr)
      print("-------------------------", file=sys.stderr)
      raise e
@@ -207,6 +245,14 @@ AVAILABLE_FONTS = ["Noto Sans CJK JP", "Noto Serif CJK JP", "IPAGothic", "IPAMin
 PRESET_TYPES = {"podcast", "subtitler"}
 DEFAULT_NOTEBOOK_NAME = "MyNotebook"
 PRESET_ROOT_NAME = "Subtitle_Presets"
+PRESET_INDEX_RECHECK_SEC = 5.0  # この間隔より短い再表示では、Drive上のディレクトリのmtimeも確認しない
+PRESET_REFRESH_DEBOUNCE_SEC = 0.6  # ノートブック名の入力が止まってから一覧を更新するまでの時間
+# "sqlite": ノートブックごとに1つのSQLiteファイル / "files": 従来どおり1プリセット1JSONファイル
+PRESET_BACKEND = "sqlite"
+PRESET_DB_NAME = "presets.sqlite3"
+PRESET_LOCAL_CACHE_DIR = Path.home() / ".cache" / "subtitle_tool" / "presets"
+PRESET_WRITE_BEHIND_SEC = 2.0  # 最後の書き込みからDriveへ反映するまでの時間
+PRESET_BUNDLE_TYPE = "preset_bundle"
 STYLE_FIELD_ORDER = [
     "font", "fs_pct", "txt_col", "txt_alpha",
     "bold", "italic", "underline", "strike",
@@ -216,6 +262,15 @@ STYLE_FIELD_ORDER = [
     "use_bg", "bg_col", "bg_alpha"
 ]
 
+DEFAULT_STYLE_SETTINGS = {
+    "font": "Noto Sans CJK JP", "fs_pct": 7, "txt_col": "#FFFFFF", "txt_alpha": 100,
+    "bold": True, "italic": False, "underline": False, "strike": False,
+    "align": 2, "margin_pct": 15, "wrap": 20, "char_spacing": 0,
+    "speed": 1.0,
+    "use_out": True, "out_w": 1.5, "use_shad": False, "shad_d": 1.0, "out_col": "#404040",
+    "use_bg": False, "bg_col": "#000000", "bg_alpha": 50,
+}
+
 STYLE_VALIDATION_RULES = {
     "font": {"type": str, "choices": AVAILABLE_FONTS},
     "fs_pct": {"type": (int, float), "min": 1, "max": 20},
@@ -291,11 +346,319 @@ def get_preset_directory(notebook_name: str, preset_type: str, create: bool = Tr
     return preset_dir
 
 
-def list_presets(notebook_name: str, preset_type: str) -> List[str]:
-    preset_dir = get_preset_directory(notebook_name, preset_type, create=True)
-    if not preset_dir.exists():
-        return []
-    return sorted([p.name for p in preset_dir.glob("*.json")])
+class PresetIndex:
+    """(ノートブック, 種別) ごとのプリセット一覧のメモリキャッシュ。
+    ディレクトリのmtimeが変わったときだけ一覧を読み直し、自分の書き込みはその場で反映する。
+    PRESET_BACKEND = "files" (1プリセット1JSONファイル) 専用で、"sqlite" では PresetStore が一覧を持つ"""
+
+    def __init__(self):
+        self._entries: Dict[Tuple[str, str], Tuple[Optional[int], Tuple[str, ...], float]] = {}  # (mtime_ns, ファイル名, 確認時刻)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(notebook_name: str, preset_type: str) -> Tuple[str, str]:
+        return sanitize_notebook_name(notebook_name), preset_type
+
+    def names(self, notebook_name: str, preset_type: str, force: bool = False) -> List[str]:
+        key = self._key(notebook_name, preset_type)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry and not force and time.monotonic() - entry[2] < PRESET_INDEX_RECHECK_SEC:
+            return list(entry[1])
+        # 入力途中のノートブック名でDriveにディレクトリを作らないよう、一覧では作成しない
+        preset_dir = get_preset_directory(notebook_name, preset_type, create=False)
+        try:
+            mtime: Optional[int] = preset_dir.stat().st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if entry and entry[0] == mtime:
+            names = entry[1]
+        else:
+            names = tuple(sorted(p.name for p in preset_dir.glob("*.json"))) if mtime is not None else ()
+            print(f"[DEBUG] プリセット一覧を読み込みました: {key[0]}/{preset_type} ({len(names)}件)")
+        with self._lock:
+            self._entries[key] = (mtime, names, time.monotonic())
+        return list(names)
+
+    def add(self, notebook_name: str, preset_type: str, directory: Path, filename: str) -> None:
+        """保存したファイルを一覧に加え、書き込み後のmtimeを記録して次回の読み直しを避ける"""
+        key = self._key(notebook_name, preset_type)
+        mtime = directory.stat().st_mtime_ns
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            names = list(entry[1])
+            if filename not in names:
+                bisect.insort(names, filename)
+            self._entries[key] = (mtime, tuple(names), time.monotonic())
+
+
+PRESET_INDEX = PresetIndex()  # PRESET_BACKEND = "files" のときだけ使われる
+
+
+class PresetStore:
+    """ノートブック1つ分の全プリセットを1つのSQLiteファイルで管理する。
+    読み書きはローカルの作業コピーに対して行い、Driveへは最後の書き込みから少し待って
+    ファイルごと置き換える (一時ファイルに書いてから os.replace)"""
+
+    SCHEMA = """
+CREATE TABLE IF NOT EXISTS presets (
+    type TEXT NOT NULL,
+    name TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    PRIMARY KEY (type, name)
+);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+
+    def __init__(self, notebook_name: str):
+        safe_notebook = sanitize_notebook_name(notebook_name)
+        self.legacy_root = ensure_drive_mounted() / PRESET_ROOT_NAME / safe_notebook
+        self.remote_path = self.legacy_root / PRESET_DB_NAME
+        self.local_path = PRESET_LOCAL_CACHE_DIR / safe_notebook / PRESET_DB_NAME
+        self._lock = threading.RLock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._names: Dict[str, List[str]] = {}
+        self._remote_mtime: Optional[int] = None
+        self._checked_at = 0.0
+        self._generation = 0
+        self._flushed_generation = 0
+        self._timer: Optional[threading.Timer] = None
+        with self._lock:
+            self._pull(force=True)
+            self._migrate_directory_layout()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.local_path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.local_path), check_same_thread=False)
+            self._conn.executescript(self.SCHEMA)
+            self._names = {}
+        return self._conn
+
+    def _close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+            self._names = {}
+
+    @property
+    def _dirty(self) -> bool:
+        return self._generation != self._flushed_generation
+
+    def _pull(self, force: bool = False) -> None:
+        """Drive側のファイルが更新されていれば作業コピーに取り込む (ロックを持って呼ぶ)"""
+        now = time.monotonic()
+        if not force and now - self._checked_at < PRESET_INDEX_RECHECK_SEC:
+            return
+        self._checked_at = now
+        try:
+            mtime = self.remote_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._remote_mtime:
+            return
+        pulled = self.local_path.with_name(f"{self.local_path.name}.pull.tmp")
+        pulled.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(self.remote_path, pulled)
+        if self._dirty:
+            # 未反映の変更があるので上書きせず、Drive側にしか無い行だけを取り込む
+            conn = self._connect()
+            conn.execute("ATTACH DATABASE ? AS remote", (str(pulled),))
+            try:
+                with conn:
+                    # 同じ名前で内容が異なる行は、Drive側を残して手元の行を別名にする
+                    conflicts = conn.execute("SELECT l.type, l.name FROM presets l JOIN remote.presets r USING (type, name) "
+                                             "WHERE l.payload != r.payload").fetchall()
+                    for preset_type, name in conflicts:
+                        taken = {n for (n,) in conn.execute("SELECT name FROM presets WHERE type = ? UNION "
+                                                            "SELECT name FROM remote.presets WHERE type = ?", (preset_type, preset_type))}
+                        new_name, counter = name, 1
+                        while new_name in taken:
+                            new_name = f"{name}({counter})"
+                            counter += 1
+                        conn.execute("UPDATE presets SET name = ? WHERE type = ? AND name = ?", (new_name, preset_type, name))
+                        print(f"[INFO] 他のセッションと名前が重なったプリセットを {new_name} に改名しました。")
+                    conn.execute("INSERT OR IGNORE INTO presets SELECT * FROM remote.presets")
+            finally:
+                conn.execute("DETACH DATABASE remote")
+            pulled.unlink()
+            self._names = {}
+        else:
+            self._close()
+            os.replace(pulled, self.local_path)
+        self._remote_mtime = mtime
+        print(f"[DEBUG] Driveのプリセットを読み込みました: {self.remote_path}")
+
+    def _migrate_directory_layout(self) -> None:
+        """従来の <ノートブック>/<種別>/*.json を一度だけ取り込む (元のファイルは残す)"""
+        legacy_dirs = [(preset_type, self.legacy_root / preset_type) for preset_type in sorted(PRESET_TYPES)]
+        legacy_dirs = [(preset_type, d) for preset_type, d in legacy_dirs if d.is_dir()]
+        if not legacy_dirs:
+            return
+        conn = self._connect()
+        if conn.execute("SELECT 1 FROM meta WHERE key = 'migrated_from_directories'").fetchone():
+            return
+        rows = []
+        for preset_type, directory in legacy_dirs:
+            for path in sorted(directory.glob("*.json")):
+                try:
+                    with path.open("r", encoding="utf-8") as f:
+                        payload = json.load(f)
+                except (OSError, ValueError) as e:
+                    print(f"[WARN] プリセットを移行できませんでした: {path}: {e}")
+                    continue
+                if payload.get("type") == preset_type and isinstance(payload.get("settings"), dict):
+                    rows.append((preset_type, path.stem, payload.get("created_at") or "", json.dumps(payload, ensure_ascii=False)))
+        with conn:
+            conn.executemany("INSERT OR IGNORE INTO presets VALUES (?, ?, ?, ?)", rows)
+            conn.execute("INSERT OR REPLACE INTO meta VALUES ('migrated_from_directories', ?)", (datetime.datetime.utcnow().isoformat(),))
+        self._names = {}
+        self._schedule_flush()
+        print(f"[INFO] 従来形式のプリセット{len(rows)}件を {self.remote_path.name} に移行しました。")
+
+    def _schedule_flush(self) -> None:
+        self._generation += 1
+        if self._timer is None:
+            self._timer = threading.Timer(PRESET_WRITE_BEHIND_SEC, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _retry_flush(self, delay: float) -> None:
+        with self._lock:
+            if self._timer is None:
+                self._timer = threading.Timer(delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _current_remote_mtime(self) -> Optional[int]:
+        try:
+            return self.remote_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def flush(self) -> None:
+        """未反映の変更があれば、Drive側の変更を取り込んだうえで作業コピーのスナップショットに置き換える"""
+        with self._lock:
+            self._timer = None
+            if not self._dirty or self._conn is None:
+                return
+            # 他のセッションが書いた行を消さないよう、置き換える直前にDrive側を取り込む
+            self._pull(force=True)
+            expected_mtime = self._current_remote_mtime()
+            generation = self._generation
+            snapshot = self.local_path.with_name(f"{self.local_path.name}.snapshot.tmp")
+            dst = sqlite3.connect(str(snapshot))
+            try:
+                self._conn.backup(dst)
+            finally:
+                dst.close()
+        # Driveへのコピーはロックの外で行い、その間の読み込みを止めない
+        tmp_remote = self.remote_path.with_name(f"{self.remote_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            self.remote_path.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(snapshot, tmp_remote)
+            if self._current_remote_mtime() != expected_mtime:
+                # コピー中に別のセッションが保存したので、もう一度取り込んでから書き直す
+                print("[DEBUG] Drive上のプリセットが更新されたため、取り込み直してから保存します。")
+                tmp_remote.unlink(missing_ok=True)
+                self._retry_flush(0.1)
+                return
+            os.replace(tmp_remote, self.remote_path)
+            mtime = self.remote_path.stat().st_mtime_ns
+        except OSError as e:
+            print(f"[WARN] プリセットをDriveへ保存できませんでした (再試行します): {e}")
+            tmp_remote.unlink(missing_ok=True)
+            self._retry_flush(PRESET_WRITE_BEHIND_SEC * 5)
+            return
+        finally:
+            snapshot.unlink(missing_ok=True)
+        with self._lock:
+            self._remote_mtime = mtime
+            self._flushed_generation = max(self._flushed_generation, generation)
+        print(f"[DEBUG] プリセットをDriveへ保存しました: {self.remote_path}")
+
+    def names(self, preset_type: str, force: bool = False) -> List[str]:
+        with self._lock:
+            self._pull(force)
+            if preset_type not in self._names:
+                if self._conn is None and not self.local_path.exists():
+                    return []
+                rows = self._connect().execute("SELECT name FROM presets WHERE type = ? ORDER BY name", (preset_type,))
+                self._names[preset_type] = [name for (name,) in rows]
+            return list(self._names[preset_type])
+
+    def _insert(self, conn: sqlite3.Connection, preset_type: str, base_name: str, payload: Dict[str, Any], taken: set) -> str:
+        safe_base = sanitize_filename(base_name)
+        name, counter = safe_base, 1
+        while name in taken:
+            name = f"{safe_base}({counter})"
+            counter += 1
+        conn.execute("INSERT INTO presets VALUES (?, ?, ?, ?)",
+                     (preset_type, name, payload.get("created_at") or "", json.dumps(payload, ensure_ascii=False)))
+        taken.add(name)
+        return name
+
+    def save_many(self, preset_type: str, items: List[Tuple[str, Dict[str, Any]]]) -> List[str]:
+        """(名前, ペイロード) の一覧を1つのトランザクションで保存し、重複を避けて付けた名前を返す"""
+        with self._lock:
+            self._pull()
+            taken = set(self.names(preset_type))
+            conn = self._connect()
+            with conn:
+                saved = [self._insert(conn, preset_type, name, payload, taken) for name, payload in items]
+            self._names[preset_type] = sorted(taken)
+            self._schedule_flush()
+        return saved
+
+    def load(self, preset_type: str, name: str) -> Dict[str, Any]:
+        with self._lock:
+            self._pull()
+            row = None
+            if self._conn is not None or self.local_path.exists():
+                row = self._connect().execute("SELECT payload FROM presets WHERE type = ? AND name = ?", (preset_type, name)).fetchone()
+        if row is None:
+            raise FileNotFoundError("プリセットが見つかりません。")
+        return json.loads(row[0])
+
+    def export(self, preset_type: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            self._pull()
+            if self._conn is None and not self.local_path.exists():
+                return []
+            rows = self._connect().execute("SELECT name, payload FROM presets WHERE type = ? ORDER BY name", (preset_type,)).fetchall()
+        return [dict(json.loads(payload), name=name) for name, payload in rows]
+
+
+_preset_stores: Dict[str, PresetStore] = {}
+_preset_stores_lock = threading.Lock()
+
+
+def get_preset_store(notebook_name: str) -> PresetStore:
+    key = sanitize_notebook_name(notebook_name)
+    with _preset_stores_lock:
+        store = _preset_stores.get(key)
+        if store is None:
+            store = _preset_stores[key] = PresetStore(key)
+    return store
+
+
+@atexit.register
+def flush_preset_stores() -> None:
+    """未反映のプリセットをすべてDriveへ書き出す"""
+    with _preset_stores_lock:
+        stores = list(_preset_stores.values())
+    for store in stores:
+        store.flush()
+
+
+def list_presets(notebook_name: str, preset_type: str, force: bool = False) -> List[str]:
+    """プリセット名の一覧を返す (キャッシュ済みならDriveにアクセスしない)"""
+    if PRESET_BACKEND == "sqlite":
+        return get_preset_store(notebook_name).names(preset_type, force)
+    return PRESET_INDEX.names(notebook_name, preset_type, force)
 
 
 def collect_style_settings(values: Tuple[Any, ...]) -> Dict[str, Any]:
@@ -348,11 +711,13 @@ def validate_style_settings(settings: Dict[str, Any], preset_type: str) -> Tuple
     return True, None
 
 
-def _write_preset_file(directory: Path, base_name: str, payload: Dict[str, Any]) -> Path:
+def _write_preset_file(directory: Path, base_name: str, payload: Dict[str, Any], existing: Optional[List[str]] = None) -> Path:
     safe_base = sanitize_filename(base_name)
     candidate = directory / f"{safe_base}.json"
     counter = 1
-    while candidate.exists():
+    # 既知の一覧で重複を避けてから、念のため実ファイルも確認する
+    taken = set(existing or ())
+    while candidate.name in taken or candidate.exists():
         candidate = directory / f"{safe_base}({counter}).json"
         counter += 1
     with candidate.open("w", encoding="utf-8") as f:
@@ -360,28 +725,51 @@ def _write_preset_file(directory: Path, base_name: str, payload: Dict[str, Any])
     return candidate
 
 
+def save_presets_to_drive(notebook_name: str, preset_type: str, items: List[Tuple[str, Dict[str, Any]]]) -> List[str]:
+    """検証済みの (プリセット名, 設定) の一覧をまとめて保存し、保存した名前を返す"""
+    created_at = datetime.datetime.utcnow().isoformat()
+    payloads = [(name or preset_type, {"type": preset_type, "name": name, "created_at": created_at, "settings": settings}) for name, settings in items]
+    if PRESET_BACKEND == "sqlite":
+        return get_preset_store(notebook_name).save_many(preset_type, payloads)
+    directory = get_preset_directory(notebook_name, preset_type, create=True)
+    saved = []
+    for name, payload in payloads:
+        saved_path = _write_preset_file(directory, name, payload, list_presets(notebook_name, preset_type))
+        PRESET_INDEX.add(notebook_name, preset_type, directory, saved_path.name)
+        saved.append(saved_path.name)
+    return saved
+
+
 def save_preset_to_drive(notebook_name: str, preset_name: str, preset_type: str, settings: Dict[str, Any]) -> Tuple[bool, str, Optional[str]]:
     ok, message = validate_style_settings(settings, preset_type)
     if not ok:
         return False, message or "設定が不正です。", None
-    directory = get_preset_directory(notebook_name, preset_type, create=True)
-    payload = {
-        "type": preset_type,
-        "name": preset_name,
-        "created_at": datetime.datetime.utcnow().isoformat(),
-        "settings": settings,
-    }
-    saved_path = _write_preset_file(directory, preset_name or preset_type, payload)
-    return True, "プリセットを保存しました。", saved_path.name
+    saved_name = save_presets_to_drive(notebook_name, preset_type, [(preset_name, settings)])[0]
+    return True, "プリセットを保存しました。", saved_name
+
+
+def export_presets(notebook_name: str, preset_type: str) -> List[Dict[str, Any]]:
+    """指定種別の全プリセットのペイロードを返す"""
+    if PRESET_BACKEND == "sqlite":
+        return get_preset_store(notebook_name).export(preset_type)
+    directory = get_preset_directory(notebook_name, preset_type, create=False)
+    payloads = []
+    for filename in list_presets(notebook_name, preset_type):
+        with (directory / filename).open("r", encoding="utf-8") as f:
+            payloads.append(json.load(f))
+    return payloads
 
 
 def load_preset_from_drive(notebook_name: str, filename: str, preset_type: str) -> Dict[str, Any]:
-    directory = get_preset_directory(notebook_name, preset_type, create=True)
-    preset_path = directory / filename
-    if not preset_path.exists():
-        raise FileNotFoundError("プリセットファイルが見つかりません。")
-    with preset_path.open("r", encoding="utf-8") as f:
-        payload = json.load(f)
+    if PRESET_BACKEND == "sqlite":
+        payload = get_preset_store(notebook_name).load(preset_type, filename)
+    else:
+        directory = get_preset_directory(notebook_name, preset_type, create=True)
+        preset_path = directory / filename
+        if not preset_path.exists():
+            raise FileNotFoundError("プリセットファイルが見つかりません。")
+        with preset_path.open("r", encoding="utf-8") as f:
+            payload = json.load(f)
     if payload.get("type") != preset_type:
         raise ValueError("プリセットの種類が一致しません。")
     settings = payload.get("settings")
@@ -407,8 +795,8 @@ def handle_preset_save(notebook_name: str, preset_name: str, preset_type: str, *
     return dropdown_update, status, gr.update(value=clear_name)
 
 
-def handle_preset_refresh(notebook_name: str, preset_type: str):
-    choices = list_presets(notebook_name, preset_type)
+def handle_preset_refresh(notebook_name: str, preset_type: str, force: bool = False):
+    choices = list_presets(notebook_name, preset_type, force)
     default = choices[0] if choices else None
     return gr.Dropdown.update(choices=choices, value=default)
 
@@ -422,34 +810,2625 @@ def handle_preset_load(notebook_name: str, filename: str, preset_type: str):
     return (*values, status)
 
 
-def handle_preset_import(uploaded_file, notebook_name: str, preset_type: str):
-    if uploaded_file is None:
+def _read_preset_import_files(uploaded_files: Any) -> Tuple[List[Tuple[str, Dict[str, Any]]], List[str]]:
+    """アップロードされたJSON (単体のプリセットまたは一括エクスポート) を (既定の名前, ペイロード) の一覧にする。
+    読めないファイルや形式の違う項目はスキップし、理由をエラー一覧に入れる"""
+    files = uploaded_files if isinstance(uploaded_files, list) else [uploaded_files]
+    items, errors = [], []
+    for file_obj in files:
+        path = _file_path(file_obj)
+        stem = Path(path).stem
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                payload = json.load(f)
+        except (OSError, ValueError) as e:
+            errors.append(f"{Path(path).name}: JSONを読み込めません ({e})")
+            continue
+        if not isinstance(payload, dict):
+            errors.append(f"{Path(path).name}: プリセットの形式ではありません。")
+            continue
+        if payload.get("type") != PRESET_BUNDLE_TYPE:
+            items.append((payload.get("name") or stem, payload))
+            continue
+        entries = payload.get("presets")
+        if not isinstance(entries, list):
+            errors.append(f"{Path(path).name}: presets が一覧ではありません。")
+            continue
+        for index, entry in enumerate(entries, start=1):
+            if isinstance(entry, dict):
+                items.append((entry.get("name") or f"{stem}_{index}", entry))
+            else:
+                errors.append(f"{Path(path).name} の{index}件目: プリセットの形式ではありません。")
+    return items, errors
+
+
+def handle_preset_import(uploaded_files, notebook_name: str, preset_type: str):
+    def failure(message: str):
         choices = list_presets(notebook_name, preset_type)
         default = choices[0] if choices else None
-        return gr.Dropdown.update(choices=choices, value=default), "❌ インポートするJSONを選択してください。", uploaded_file
+        return gr.Dropdown.update(choices=choices, value=default), message, uploaded_files
+
+    if not uploaded_files:
+        return failure("❌ インポートするJSONを選択してください。")
+    items, errors = _read_preset_import_files(uploaded_files)
+    valid = []
+    for name, payload in items:
+        if payload.get("type") != preset_type:
+            errors.append(f"{name}: プリセットの種類が現在のタブと一致しません。")
+            continue
+        settings = payload.get("settings")
+        if not isinstance(settings, dict):
+            errors.append(f"{name}: settings がありません。")
+            continue
+        ok, message = validate_style_settings(settings, preset_type)
+        if not ok:
+            errors.append(f"{name}: {message}")
+            continue
+        valid.append((name, settings))
+    if not valid:
+        return failure(f"❌ インポートに失敗しました: {errors[0] if errors else 'プリセットが含まれていません。'}")
+    saved_names = save_presets_to_drive(notebook_name, preset_type, valid)
+    choices = list_presets(notebook_name, preset_type)
+    dropdown_update = gr.Dropdown.update(choices=choices, value=saved_names[-1])
+    status = f"✅ プリセットを保存しました。 ({saved_names[0]})" if len(saved_names) == 1 else f"✅ {len(saved_names)}件のプリセットを保存しました。"
+    if errors:
+        status += f" ⚠️ {len(errors)}件は不正なためスキップしました: " + " / ".join(errors[:3])
+    return dropdown_update, status, None
+
+
+def handle_preset_export(notebook_name: str, preset_type: str):
+    """指定種別の全プリセットを1つのJSONにまとめてダウンロード用に返す"""
+    payloads = export_presets(notebook_name, preset_type)
+    if not payloads:
+        return None, "❌ エクスポートするプリセットがありません。"
+    bundle = {
+        "type": PRESET_BUNDLE_TYPE,
+        "notebook": sanitize_notebook_name(notebook_name),
+        "preset_type": preset_type,
+        "exported_at": datetime.datetime.utcnow().isoformat(),
+        "presets": payloads,
+    }
+    out_path = SCRATCH.path("exports", f"{sanitize_notebook_name(notebook_name)}_{preset_type}_presets.json")
+    tmp_path = ScratchManager.tmp_path(out_path)
+    tmp_path.write_text(json.dumps(bundle, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(tmp_path, out_path)
+    return SCRATCH.add(out_path), f"✅ {len(payloads)}件のプリセットをエクスポートしました。"
+
+
+# --- ASSファイルの生成 ---
+# 両機能のASS生成をここに集約する。イベント行は一定件数ごとにまとめて書き出し、
+# タイムコードはNumPyで一括計算する (出力は tc() を1件ずつ呼んだ場合と同一)。
+ASS_WRITE_CHUNK = 4096
+SUBTITLE_MIN_DURATION_SEC = 0.0  # 0より大きければ短すぎる字幕をこの長さまで延ばす (出力時間基準)
+SUBTITLE_MIN_GAP_SEC = 0.0       # 0より大きければ次の字幕との間にこの秒数の隙間を空ける
+# 既定は従来どおり wrap 文字ごとに textwrap で折り返す。"pixel" にすると wrap は1行の最大文字数になり、
+# それより手前でも字形の送り幅が安全領域 (画面幅 - 左右マージン - 縁取り・影) を超えれば改行する
+WRAP_ENGINE = "chars"
+ASS_SIDE_MARGIN_PX = 10  # Style行の MarginL / MarginR
+
+
+def tc_bulk(seconds: np.ndarray) -> List[str]:
+    """秒数の配列をASS形式のタイムコードの一覧に変換する"""
+    whole = np.trunc(seconds)
+    centis = np.trunc((seconds - whole) * 100).astype(np.int64)
+    h, m = np.divmod(whole.astype(np.int64), 3600)
+    m, s = np.divmod(m, 60)
+    return [f"{a:01d}:{b:02d}:{c:02d}.{d:02d}" for a, b, c, d in zip(h.tolist(), m.tolist(), s.tolist(), centis.tolist())]
+
+
+class SegmentTable:
+    """字幕セグメントの列指向表現。開始・終了はfloat64配列、テキストは文字列のリストで持つ"""
+
+    __slots__ = ("start", "end", "text")
+
+    def __init__(self, start: Any, end: Any, text: List[str]):
+        self.start = np.asarray(start, dtype=np.float64)
+        self.end = np.asarray(end, dtype=np.float64)
+        self.text = list(text)
+        if not (len(self.start) == len(self.end) == len(self.text)):
+            raise ValueError("SegmentTable: start/end/text の長さが一致しません")
+
+    @classmethod
+    def from_segments(cls, segs: Any) -> "SegmentTable":
+        """dictのリスト (stable-tsの segments 形式) から作る。SegmentTableならそのまま返す"""
+        if isinstance(segs, cls):
+            return segs
+        return cls([s["start"] for s in segs], [s["end"] for s in segs], [s["text"] for s in segs])
+
+    @classmethod
+    def from_json(cls, path: str, words: bool = False) -> "SegmentTable":
+        """save_as_json の出力を読み込む。words=True なら単語単位の表にする"""
+        with open(path, "r", encoding="utf-8") as f:
+            segments = json.load(f)["segments"]
+        if words:
+            items = [w for s in segments for w in (s.get("words") or ())]
+            return cls([w["start"] for w in items], [w["end"] for w in items], [w["word"] for w in items])
+        return cls.from_segments(segments)
+
+    def __len__(self) -> int:
+        return len(self.text)
+
+    def __getitem__(self, index: Any) -> Any:
+        if isinstance(index, slice):
+            return SegmentTable(self.start[index], self.end[index], self.text[index])
+        return {"start": float(self.start[index]), "end": float(self.end[index]), "text": self.text[index]}
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def take(self, mask: np.ndarray) -> "SegmentTable":
+        """真偽値マスクまたはインデックス配列で行を抽出する"""
+        idx = np.flatnonzero(mask) if mask.dtype == bool else mask
+        return SegmentTable(self.start[idx], self.end[idx], [self.text[i] for i in idx.tolist()])
+
+    def drop_empty(self) -> "SegmentTable":
+        """空白だけのテキストの行を除く"""
+        keep = np.fromiter((bool(t.strip()) for t in self.text), dtype=bool, count=len(self.text))
+        return self if keep.all() else self.take(keep)
+
+    def scaled(self, speed: float) -> "SegmentTable":
+        """再生速度に合わせて時刻を 1/speed 倍する"""
+        speed = float(speed)
+        if speed == 1.0:
+            return self
+        return SegmentTable(self.start / speed, self.end / speed, self.text)
+
+    def fix_timing(self, min_duration: float = 0.0, min_gap: float = 0.0) -> "SegmentTable":
+        """最短表示時間まで終了を延ばし、次の字幕の開始 - min_gap を超えないよう詰める (どちらも0なら何もしない)"""
+        if min_duration <= 0 and min_gap <= 0:
+            return self
+        end = np.maximum(self.end, self.start + min_duration) if min_duration > 0 else self.end.copy()
+        if len(end) > 1:
+            # 開始順に並んでいる前提で、各行の上限は「次の行の開始 - min_gap」
+            end[:-1] = np.minimum(end[:-1], self.start[1:] - min_gap)
+        return SegmentTable(self.start, np.maximum(end, self.start), self.text)
+
+    def timecodes(self) -> Tuple[List[str], List[str]]:
+        """開始・終了のASSタイムコードを一括で返す"""
+        return tc_bulk(self.start), tc_bulk(self.end)
+
+    def to_segments(self) -> List[Dict[str, Any]]:
+        return list(self)
+
+
+def build_ass_header(
+    w, h,
+    font, fs_pct, txt_col, txt_alpha,
+    bold, italic, ul, strike,
+    align, margin_pct, wrap, char_spacing,
+    use_out, out_w, use_shad, shad_d, out_col,
+    use_bg, bg_col, bg_alpha
+) -> str:
+    """スタイル設定から [Script Info] から [Events] の Format 行までを生成する"""
+    fs = int(h * (fs_pct / 100))
+    mv = int(h * (margin_pct / 100))
+    prim_c = hex_to_ass(txt_col, txt_alpha)
+    if use_bg:
+        border_style = 3
+        out_c_ass = hex_to_ass(bg_col, bg_alpha)
+        back_c = "&HFF000000"
+    else:
+        border_style = 1
+        out_c_ass = hex_to_ass(out_col, 100)
+        back_c = hex_to_ass(out_col, 50) if use_shad else "&HFF000000"
+    bold_f, italic_f = ("-1" if bold else "0"), ("-1" if italic else "0")
+    ul_f, strike_f = ("-1" if ul else "0"), ("-1" if strike else "0")
+    # 座布団(use_bg)が有効な場合は、縁取り(use_out)の状態に関わらず '太さ'(out_w) をOutline値として使う
+    final_out_w = out_w if (use_bg or use_out) else 0
+    final_shad_d = shad_d if use_shad else 0
+    return textwrap.dedent(f"""
+[Script Info]
+ScriptType: v4.00+
+PlayResX: {w}
+PlayResY: {h}
+[V4+ Styles]
+Format: Name,Fontname,Fontsize,PrimaryColour,SecondaryColour,OutlineColour,BackColour,Bold,Italic,Underline,StrikeOut,ScaleX,ScaleY,Spacing,Angle,BorderStyle,Outline,Shadow,Alignment,MarginL,MarginR,MarginV,Encoding
+Style: DEF,{font},{fs},{prim_c},{prim_c},{out_c_ass},{back_c},{bold_f},{italic_f},{ul_f},{strike_f},100,100,{char_spacing},0,{border_style},{final_out_w},{final_shad_d},{align},{ASS_SIDE_MARGIN_PX},{ASS_SIDE_MARGIN_PX},{mv},1
+[Events]
+Format: Layer,Start,End,Style,Name,MarginL,MarginR,MarginV,Effect,Text
+""").strip()
+
+
+# 行頭に置かない文字 (閉じ括弧・句読点・小書き仮名など) と行末に置かない文字 (開き括弧)
+_WRAP_NO_LINE_START = set("、。，．,.:;!?！？)）]］}｝」』】〕〉》〙〗ー～…‥・ぁぃぅぇぉっゃゅょゎゕゖァィゥェォッャュョヮヵヶ々ゝゞヽヾ")
+_WRAP_NO_LINE_END_CHARS = "(（[［{｛「『【〔〈《〘〖"
+_WRAP_NO_LINE_END = set(_WRAP_NO_LINE_END_CHARS)
+_WRAP_SPACE_CODES = np.array([ord(ch) for ch in " \t\r\f\v\u00a0\u3000"], dtype=np.uint32)
+_WRAP_CHAR_CLASS_RE = re.compile(r"[\u3041-\u309f]+|[\u30a0-\u30ff]+|[\u4e00-\u9fff\u3400-\u4dbf々〆]+|[A-Za-z0-9\uff10-\uff5a]+|\s+|.", re.S)
+_glyph_metrics_memo: Dict[Tuple[str, bool, bool, float], "GlyphMetrics"] = {}
+_glyph_metrics_lock = threading.Lock()
+_mecab_available: Optional[bool] = None
+_mecab_lock = threading.Lock()
+
+
+class GlyphMetrics:
+    """1つのフォント・サイズについて文字ごとの送り幅 (px) をキャッシュする"""
+
+    # libassはヒンティングなしの送り幅で字を並べる。Pillowの getlength はサイズごとにヒンティングで
+    # 丸めた送り幅を返し、30文字で ±1% ほどずれるため、大きなサイズで測って縮尺する
+    REFERENCE_SIZE = 1000
+
+    def __init__(self, font: Any):
+        from PIL import ImageFont
+        self.font = font
+        self._reference = ImageFont.truetype(font.path, self.REFERENCE_SIZE, index=font.index)
+        self._scale = font.size / self.REFERENCE_SIZE
+        self._advances: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def advances(self, text: str) -> np.ndarray:
+        """text の各文字の送り幅の配列を返す"""
+        codes, inverse = np.unique(np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32), return_inverse=True)
+        cache = self._advances
+        chars = [chr(c) for c in codes.tolist()]
+        missing = [ch for ch in chars if ch not in cache]
+        if missing:
+            with self._lock:
+                for ch in missing:
+                    cache[ch] = float(self._reference.getlength(ch)) * self._scale
+        return np.array([cache[ch] for ch in chars], dtype=np.float64)[inverse.reshape(-1)]
+
+
+def get_glyph_metrics(family: str, bold: bool, italic: bool, fs: float) -> GlyphMetrics:
+    """(フォント, 太字, 斜体, Fontsize) ごとの GlyphMetrics を返す"""
+    key = (family, bool(bold), bool(italic), round(float(fs), 2))
+    with _glyph_metrics_lock:
+        metrics = _glyph_metrics_memo.get(key)
+    if metrics is None:
+        metrics = GlyphMetrics(load_ass_font(family, bold, italic, fs))
+        with _glyph_metrics_lock:
+            metrics = _glyph_metrics_memo.setdefault(key, metrics)
+    return metrics
+
+
+def _split_by_char_class(text: str) -> List[str]:
+    return _WRAP_CHAR_CLASS_RE.findall(text)
+
+
+def _run_mecab(joined: str) -> str:
+    # %M は直前の空白を含む表層形なので、タブ区切りで連結すると元のテキストに戻る
+    return subprocess.run(["mecab", "-F", "%M\\t", "-E", "\\n"], input=joined,
+                          capture_output=True, text=True, encoding="utf-8", check=True).stdout
+
+
+def mecab_available() -> bool:
+    """mecabコマンドが使えるかを最初の1回だけ確かめる (バッチの並列ワーカーから同時に呼ばれる)"""
+    global _mecab_available
+    with _mecab_lock:
+        if _mecab_available is None:
+            try:
+                _run_mecab("テスト\n")
+                _mecab_available = True
+            except (OSError, subprocess.CalledProcessError) as e:
+                print(f"[WARN] MeCabを実行できないため、文字種の境界で折り返します: {e}")
+                _mecab_available = False
+        return _mecab_available
+
+
+def split_morphemes(texts: List[str]) -> List[List[str]]:
+    """各テキストをMeCabの形態素境界で分割する (1回のmecab呼び出しで全件)。空白は直後のトークンに含まれる"""
+    if not texts:
+        return []
+    tokenized: Optional[List[str]] = None
+    if mecab_available():
+        try:
+            tokenized = _run_mecab("".join(t.replace("\n", " ") + "\n" for t in texts)).split("\n")[:len(texts)]
+        except (OSError, subprocess.CalledProcessError) as e:
+            print(f"[WARN] MeCabの実行に失敗したため、この字幕は文字種の境界で折り返します: {e}")
+    results = []
+    for i, text in enumerate(texts):
+        pieces = tokenized[i].split("\t")[:-1] if tokenized is not None and i < len(tokenized) else []
+        rest = text[len("".join(pieces)):]
+        if pieces and not rest.strip():
+            pieces[-1] += rest  # 末尾の空白はmecabの出力に現れない
+        if "".join(pieces) != text:
+            pieces = _split_by_char_class(text)
+        results.append(pieces)
+    return results
+
+
+def _apply_kinsoku(tokens: List[str]) -> List[str]:
+    """行頭禁則の文字は直前のトークンへ、行末禁則の文字は直後のトークンへ結合する"""
+    merged: List[str] = []
+    carry = ""
+    open_end = False  # merged[-1] が開き括弧で終わっているか
+    for token in tokens:
+        if carry:
+            token, carry = carry + token, ""
+        body = token.strip()
+        if merged and (body[:1] in _WRAP_NO_LINE_START or open_end):
+            merged[-1] += token
+        elif body and not body.strip(_WRAP_NO_LINE_END_CHARS):
+            carry = token
+            continue
+        else:
+            merged.append(token)
+        if body:
+            open_end = body[-1] in _WRAP_NO_LINE_END
+    if carry:
+        merged.append(carry)
+    return merged
+
+
+class LineWrapper:
+    """グリフの送り幅を使い、MeCabの形態素境界で字幕を安全領域の幅に収まるよう改行する"""
+
+    def __init__(self, metrics: GlyphMetrics, max_width: float, max_chars: int, spacing: float = 0.0):
+        self.metrics = metrics
+        self.max_width = max(1.0, float(max_width))
+        self.max_chars = max(1, int(max_chars))
+        self.spacing = float(spacing)
+
+    def wrap_many(self, texts: List[str]) -> List[str]:
+        """テキストの一覧をASSの \\N 区切りに折り返して返す (はみ出す段落だけMeCabに渡す)"""
+        paragraphs = [text.split("\n") for text in texts]
+        unique = list(dict.fromkeys(p for paras in paragraphs for p in paras))
+        joined = "".join(unique)
+        n = len(joined)
+        starts = np.cumsum([0] + [len(p) for p in unique]).tolist()
+        # 全段落をつないだ文字列で、累積幅と「各位置から見た直前/直後の空白以外の文字位置」を一括で求める
+        # (行頭・行末の空白は幅に数えない)
+        cum = np.concatenate(([0.0], np.cumsum(self.metrics.advances(joined) + self.spacing))).tolist()
+        space = np.isin(np.frombuffer(joined.encode("utf-32-le"), dtype=np.uint32), _WRAP_SPACE_CODES)
+        pos = np.arange(n)
+        ink_end = np.concatenate(([0], np.maximum.accumulate(np.where(space, 0, pos + 1)))).tolist() if n else [0]
+        ink_start = (np.minimum.accumulate(np.where(space, n, pos)[::-1])[::-1].tolist() if n else []) + [n]
+        W, C = self.max_width, self.max_chars
+
+        def fits(a: int, b: int) -> bool:
+            a, e = ink_start[a], ink_end[b]
+            return e <= a or (cum[e] - cum[a] <= W and e - a <= C)
+
+        pending = [i for i, p in enumerate(unique) if not fits(starts[i], starts[i + 1])]
+        broken: Dict[int, List[str]] = {}
+        for i, tokens in zip(pending, split_morphemes([unique[i] for i in pending])):
+            bounds = [starts[i]]
+            for token in _apply_kinsoku(tokens):
+                t0, t1 = bounds[-1], bounds[-1] + len(token)
+                if not fits(t0, t1):
+                    bounds.extend(range(t0 + 1, t1))  # 1トークンで収まらない場合は文字単位で区切る
+                bounds.append(t1)
+            ends = [max(ink_end[b], bounds[0]) for b in bounds]
+            end_w = [cum[e] for e in ends]
+            lines, k, last = [], 0, len(bounds) - 1
+            while k < last:
+                a = ink_start[bounds[k]]
+                if a >= bounds[-1]:
+                    break
+                j = min(bisect.bisect_right(end_w, cum[a] + W, k + 1), bisect.bisect_right(ends, a + C, k + 1)) - 1
+                j = max(j, k + 1)
+                if ends[j] > a:
+                    lines.append(joined[a:ends[j]])
+                k = j
+            broken[i] = lines
+        index = {p: i for i, p in enumerate(unique)}
+        wrapped = []
+        for paras in paragraphs:
+            if len(paras) == 1:
+                i = index[paras[0]]
+                wrapped.append(r"\N".join(broken[i]) if i in broken else paras[0])
+                continue
+            lines: List[str] = []
+            for p in paras:
+                i = index[p]
+                lines.extend(broken[i] if i in broken else [p.strip()] if p.strip() else [])
+            wrapped.append(r"\N".join(lines))
+        return wrapped
+
+
+def make_line_wrapper(
+    w, h,
+    font, fs_pct, txt_col, txt_alpha,
+    bold, italic, ul, strike,
+    align, margin_pct, wrap, char_spacing,
+    use_out, out_w, use_shad, shad_d, out_col,
+    use_bg, bg_col, bg_alpha,
+    engine: Optional[str] = None
+) -> Optional[LineWrapper]:
+    """スタイル設定から LineWrapper を作る。折り返しOFFまたは文字数エンジンの場合は None"""
+    if int(wrap) <= 0 or (engine or WRAP_ENGINE) != "pixel":
+        return None
+    fs = int(h * (fs_pct / 100))
+    # 縁取り・座布団は文字の外側へ、影は右へはみ出すので、その分だけ安全領域を狭める
+    border = float(out_w) if (use_bg or use_out) else 0.0
+    shadow = float(shad_d) if use_shad else 0.0
+    max_width = w - 2 * ASS_SIDE_MARGIN_PX - 2 * border - shadow
     try:
-        with open(uploaded_file.name, "r", encoding="utf-8") as f:
-            payload = json.load(f)
+        metrics = get_glyph_metrics(font, bold, italic, fs)
     except Exception as e:
-        choices = list_presets(notebook_name, preset_type)
-        default = choices[0] if choices else None
-        return gr.Dropdown.update(choices=choices, value=default), f"❌ JSONの読み込みに失敗しました: {e}", uploaded_file
-    imported_type = payload.get("type")
-    if imported_type != preset_type:
-        choices = list_presets(notebook_name, preset_type)
-        default = choices[0] if choices else None
-        return gr.Dropdown.update(choices=choices, value=default), "❌ プリセットの種類が現在のタブと一致しません。", uploaded_file
-    settings = payload.get("settings")
-    ok, message = validate_style_settings(settings or {}, preset_type)
-    if not ok:
-        choices = list_presets(notebook_name, preset_type)
-        default = choices[0] if choices else None
-        return gr.Dropdown.update(choices=choices, value=default), f"❌ インポートに失敗しました: {message}", uploaded_file
-    preset_name = payload.get("name") or Path(uploaded_file.name).stem
-    _, msg, saved_name = save_preset_to_drive(notebook_name, preset_name, preset_type, settings)
-    choices = list_presets(notebook_name, preset_type)
-    dropdown_update = gr.Dropdown.update(choices=choices, value=saved_name)
-    return dropdown_update, f"✅ {msg} ({saved_name})", None
+        print(f"[WARN] フォント '{font}' の字形情報を取得できないため、文字数で折り返します: {e}")
+        return None
+    return LineWrapper(metrics, max_width, int(wrap), float(char_spacing))
+
+
+def self_test_wrap_widths() -> List[str]:
+    """AVAILABLE_FONTS のそれぞれで幅基準の折り返しを行い、各行の実測幅 (縁取り・影を含む) が
+    PlayResX から左右マージンを除いた安全領域に収まるかを検査し、失敗の説明を返す"""
+    from PIL import ImageFont
+    texts = [
+        "今日はポッドキャストの新しいエピソードをお届けします。ゲストには東京からお越しいただきました。",
+        "「括弧」や、句読点。を含む全角のテキストと half-width English words が混ざった字幕の例です",
+        "Supercalifragilisticexpialidocious is a rather long English word, isn't it? AVAVAVAVAVAV",
+        "ＷＷＷＷＷＷＷＷＷＷＷＷＷＷＷＷＷＷＷＷＷＷＷＷＷＷＷＷＷＷＷＷＷＷＷＷＷＷＷＷ",
+    ]
+    # (PlayResX, PlayResY, 既定スタイルからの変更)。文字数の上限より先に幅で改行されるよう wrap は大きくする
+    cases = [
+        (1920, 1080, {"wrap": 80}),
+        (1920, 1080, {"wrap": 80, "fs_pct": 12, "bold": False, "char_spacing": 4}),
+        (1080, 1920, {"wrap": 80, "fs_pct": 5, "use_bg": True, "out_w": 6, "use_shad": True, "shad_d": 4}),
+    ]
+    failures = []
+    for font in AVAILABLE_FONTS:
+        if not font_family_installed(font):
+            failures.append(f"{font}: フォントが見つかりません")
+            continue
+        for w, h, overrides in cases:
+            settings = {**DEFAULT_STYLE_SETTINGS, "font": font, **overrides}
+            style = [settings[key] for key in STYLE_FIELD_ORDER if key != "speed"]
+            wrapper = make_line_wrapper(w, h, *style, engine="pixel")
+            if wrapper is None:
+                failures.append(f"{font}: 幅基準の折り返しを準備できません")
+                break
+            # 折り返しとは別に、行全体を大きなサイズで測って縮尺する (libassと同じくヒンティングなし)
+            path, index = resolve_font_file(font, settings["bold"], settings["italic"])
+            reference = ImageFont.truetype(path, GlyphMetrics.REFERENCE_SIZE, index=index)
+            scale = wrapper.metrics.font.size / GlyphMetrics.REFERENCE_SIZE
+            border = float(settings["out_w"]) if (settings["use_bg"] or settings["use_out"]) else 0.0
+            shadow = float(settings["shad_d"]) if settings["use_shad"] else 0.0
+            safe_width = w - 2 * ASS_SIDE_MARGIN_PX
+            for text, wrapped in zip(texts, wrapper.wrap_many(texts)):
+                lines = wrapped.split(r"\N")
+                if "".join(lines).replace(" ", "") != text.replace(" ", ""):
+                    failures.append(f"{font} {w}x{h}: 折り返しで文字が変わりました: {wrapped}")
+                for line in lines:
+                    width = (reference.getlength(line) * scale + settings["char_spacing"] * len(line)
+                             + 2 * border + shadow)
+                    if width > safe_width:
+                        failures.append(f"{font} {w}x{h}: 行幅 {width:.1f}px > 安全領域 {safe_width}px: {line}")
+    return failures
+
+
+def write_ass_events(out, segs, wrap, speed=1.0, flatten_text: bool = False, wrapper: Optional[LineWrapper] = None) -> int:
+    """セグメント (SegmentTable または dictのリスト) をDialogue行として out に書き出し、件数を返す。
+    wrapper があれば幅基準で、なければ wrap 文字数で折り返す"""
+    speed = float(speed)
+    if speed != 1.0:
+        print(f"[DEBUG] 字幕タイミングを再生速度 {speed}x に合わせて調整します。")
+    table = SegmentTable.from_segments(segs).scaled(speed).fix_timing(SUBTITLE_MIN_DURATION_SEC, SUBTITLE_MIN_GAP_SEC)
+    wrap = int(wrap)
+    for offset in range(0, len(table), ASS_WRITE_CHUNK):
+        chunk = table[offset:offset + ASS_WRITE_CHUNK]
+        starts, ends = chunk.timecodes()
+        texts = [text.strip().replace("\n", " ") for text in chunk.text] if flatten_text else chunk.text
+        if wrapper is not None:
+            texts = wrapper.wrap_many(texts)
+        elif wrap > 0:
+            texts = [r"\N".join(textwrap.wrap(text, wrap)) if len(text) > wrap else text for text in texts]
+        lines = []
+        for text, start, end in zip(texts, starts, ends):
+            lines.append(f"Dialogue: 0,{start},{end},DEF,,0,0,0,,{text}\n")  # MarginVを0に固定
+        out.write("".join(lines))
+    return len(table)
+
+
+def write_ass_document(out, segs, w, h, *style, speed=1.0, flatten_text: bool = False) -> None:
+    """ヘッダーとイベントをまとめて out に書き出す。style は build_ass_header と同じ並び"""
+    out.write(build_ass_header(w, h, *style) + "\n")
+    count = write_ass_events(out, segs, style[10], speed, flatten_text, wrapper=make_line_wrapper(w, h, *style))
+    print(f"[DEBUG] ASSを生成しました: {count}イベント ({w}x{h}, 速度 {speed}x)")
+
+
+# 共通化する前の podcast_build_ass_text / subtitler_create_ass_content が出力したASSを固定したもの。
+# 空のテキスト (長さ0)、整数の時刻、改行と前後の空白、折り返し、1時間超えを含む
+ASS_FROZEN_SEGMENTS = [
+    {"start": 0.0, "end": 1.5, "text": "こんにちは"},
+    {"start": 1.5, "end": 4.24, "text": "これは二十文字を超える長い字幕なので折り返しの対象になります"},
+    {"start": 4.24, "end": 4.24, "text": ""},
+    {"start": 5, "end": 7, "text": "整数の時刻\n二行目のテキスト"},
+    {"start": 7.333, "end": 3661.999, "text": "  前後に空白  "},
+    {"start": 3661.999, "end": 3723.005, "text": "English words wrap at spaces when the line gets longer"},
+]
+ASS_FROZEN_HEADER = (
+    "[Script Info]\nScriptType: v4.00+\nPlayResX: {w}\nPlayResY: {h}\n[V4+ Styles]\n"
+    "Format: Name,Fontname,Fontsize,PrimaryColour,SecondaryColour,OutlineColour,BackColour,Bold,Italic,Underline,StrikeOut,"
+    "ScaleX,ScaleY,Spacing,Angle,BorderStyle,Outline,Shadow,Alignment,MarginL,MarginR,MarginV,Encoding\n"
+    "{style}\n[Events]\nFormat: Layer,Start,End,Style,Name,MarginL,MarginR,MarginV,Effect,Text\n"
+)
+# (PlayResX, PlayResY, 既定スタイルからの変更, 速度, Style行)
+ASS_FROZEN_STYLES = [
+    (1920, 1080, {}, 1.0,
+     "Style: DEF,Noto Sans CJK JP,75,&H00FFFFFF,&H00FFFFFF,&H00404040,&HFF000000,-1,0,0,0,100,100,0,0,1,1.5,0,2,10,10,162,1"),
+    (1920, 1080, {}, 1.5,
+     "Style: DEF,Noto Sans CJK JP,75,&H00FFFFFF,&H00FFFFFF,&H00404040,&HFF000000,-1,0,0,0,100,100,0,0,1,1.5,0,2,10,10,162,1"),
+    (1280, 720, {"use_bg": True, "bg_alpha": 60, "use_shad": True, "shad_d": 2, "italic": True, "txt_alpha": 80,
+                 "char_spacing": 3, "align": 8}, 1.0,
+     "Style: DEF,Noto Sans CJK JP,50,&H33FFFFFF,&H33FFFFFF,&H66000000,&HFF000000,-1,-1,0,0,100,100,3,0,3,1.5,2,8,10,10,108,1"),
+]
+ASS_FROZEN_EVENTS = {
+    ("podcast", 1.0): [
+        "Dialogue: 0,0:00:00.00,0:00:01.50,DEF,,0,0,0,,こんにちは",
+        "Dialogue: 0,0:00:01.50,0:00:04.24,DEF,,0,0,0,,これは二十文字を超える長い字幕なので折り\\N返しの対象になります",
+        "Dialogue: 0,0:00:04.24,0:00:04.24,DEF,,0,0,0,,",
+        "Dialogue: 0,0:00:05.00,0:00:07.00,DEF,,0,0,0,,整数の時刻\n二行目のテキスト",
+        "Dialogue: 0,0:00:07.33,1:01:01.99,DEF,,0,0,0,,  前後に空白  ",
+        "Dialogue: 0,1:01:01.99,1:02:03.00,DEF,,0,0,0,,English words wrap\\Nat spaces when the\\Nline gets longer",
+    ],
+    ("podcast", 1.5): [
+        "Dialogue: 0,0:00:00.00,0:00:01.00,DEF,,0,0,0,,こんにちは",
+        "Dialogue: 0,0:00:01.00,0:00:02.82,DEF,,0,0,0,,これは二十文字を超える長い字幕なので折り\\N返しの対象になります",
+        "Dialogue: 0,0:00:02.82,0:00:02.82,DEF,,0,0,0,,",
+        "Dialogue: 0,0:00:03.33,0:00:04.66,DEF,,0,0,0,,整数の時刻\n二行目のテキスト",
+        "Dialogue: 0,0:00:04.88,0:40:41.33,DEF,,0,0,0,,  前後に空白  ",
+        "Dialogue: 0,0:40:41.33,0:41:22.00,DEF,,0,0,0,,English words wrap\\Nat spaces when the\\Nline gets longer",
+    ],
+    ("subtitler", 1.0): [
+        "Dialogue: 0,0:00:00.00,0:00:01.50,DEF,,0,0,0,,こんにちは",
+        "Dialogue: 0,0:00:01.50,0:00:04.24,DEF,,0,0,0,,これは二十文字を超える長い字幕なので折り\\N返しの対象になります",
+        "Dialogue: 0,0:00:04.24,0:00:04.24,DEF,,0,0,0,,",
+        "Dialogue: 0,0:00:05.00,0:00:07.00,DEF,,0,0,0,,整数の時刻 二行目のテキスト",
+        "Dialogue: 0,0:00:07.33,1:01:01.99,DEF,,0,0,0,,前後に空白",
+        "Dialogue: 0,1:01:01.99,1:02:03.00,DEF,,0,0,0,,English words wrap\\Nat spaces when the\\Nline gets longer",
+    ],
+    ("subtitler", 1.5): [
+        "Dialogue: 0,0:00:00.00,0:00:01.00,DEF,,0,0,0,,こんにちは",
+        "Dialogue: 0,0:00:01.00,0:00:02.82,DEF,,0,0,0,,これは二十文字を超える長い字幕なので折り\\N返しの対象になります",
+        "Dialogue: 0,0:00:02.82,0:00:02.82,DEF,,0,0,0,,",
+        "Dialogue: 0,0:00:03.33,0:00:04.66,DEF,,0,0,0,,整数の時刻 二行目のテキスト",
+        "Dialogue: 0,0:00:04.88,0:40:41.33,DEF,,0,0,0,,前後に空白",
+        "Dialogue: 0,0:40:41.33,0:41:22.00,DEF,,0,0,0,,English words wrap\\Nat spaces when the\\Nline gets longer",
+    ],
+}
+
+
+def self_test_ass_writer() -> List[str]:
+    """両機能のASS生成が、共通化する前の出力 (ASS_FROZEN_*) とバイト単位で一致するかを検査し、失敗の説明を返す"""
+    if WRAP_ENGINE != "chars" or SUBTITLE_MIN_DURATION_SEC > 0 or SUBTITLE_MIN_GAP_SEC > 0:
+        return ["折り返し・最短表示時間・字幕の間隔が既定値でないため、以前の出力とは比較できません"]
+    builders = {"podcast": podcast_build_ass_text, "subtitler": subtitler_create_ass_content}
+    failures = []
+    for name, build in builders.items():
+        for w, h, overrides, speed, style_line in ASS_FROZEN_STYLES:
+            settings = {**DEFAULT_STYLE_SETTINGS, **overrides}
+            style = [settings[key] for key in STYLE_FIELD_ORDER if key != "speed"]
+            expected = (ASS_FROZEN_HEADER.format(w=w, h=h, style=style_line)
+                        + "".join(line + "\n" for line in ASS_FROZEN_EVENTS[(name, speed)]))
+            actual = build([dict(seg) for seg in ASS_FROZEN_SEGMENTS], w, h, *style, speed=speed)
+            if actual != expected:
+                want, got = expected.split("\n"), actual.split("\n")
+                k = next((i for i, (a, b) in enumerate(zip(want, got)) if a != b), min(len(want), len(got)))
+                failures.append(f"{name} {w}x{h} 速度{speed}x の{k + 1}行目: 期待 {want[k:k + 1]} / 実際 {got[k:k + 1]}")
+    return failures
+
+
+def self_test_segment_table() -> List[str]:
+    """SegmentTable の drop_empty / scaled / fix_timing / timecodes が、以前のdictごとの処理と
+    同じ値になるかを境界の入力 (重なり・長さ0・空白だけ・音声の末尾で終わる最終行) で検査し、失敗の説明を返す"""
+    duration = 12.345
+    segs = [
+        {"start": 0.0, "end": 2.0, "text": "最初の行"},
+        {"start": 1.5, "end": 3.0, "text": "前の行と重なる"},
+        {"start": 3.0, "end": 3.0, "text": "長さ0"},
+        {"start": 3.0, "end": 3.2, "text": "  "},
+        {"start": 3.2, "end": 3.25, "text": "短い"},
+        {"start": 3.1, "end": 5.0, "text": "\n"},
+        {"start": 5.0, "end": 4.9, "text": "終了が開始より前"},
+        {"start": 10.0, "end": duration, "text": "音声の末尾まで"},
+    ]
+
+    def fix_timing_per_dict(rows: List[Dict[str, Any]], min_duration: float, min_gap: float) -> List[Dict[str, Any]]:
+        if min_duration <= 0 and min_gap <= 0:
+            return rows
+        fixed = []
+        for i, row in enumerate(rows):
+            end = max(row["end"], row["start"] + min_duration) if min_duration > 0 else row["end"]
+            if i + 1 < len(rows):
+                end = min(end, rows[i + 1]["start"] - min_gap)
+            fixed.append(dict(row, end=max(end, row["start"])))
+        return fixed
+
+    failures = []
+    # 以前の cached_align は json の segments から空白だけの行をこう除いていた
+    kept = [seg for seg in segs if seg["text"].strip()]
+    table = SegmentTable.from_segments(segs).drop_empty()
+    if table.to_segments() != kept:
+        failures.append(f"drop_empty: {table.text} != {[seg['text'] for seg in kept]}")
+    for speed in (1.0, 1.5, 0.8):
+        scaled = [dict(seg, start=seg["start"] / speed, end=seg["end"] / speed) for seg in kept]
+        for min_duration, min_gap in ((0.0, 0.0), (0.5, 0.0), (0.0, 0.1), (1.0, 0.2)):
+            expected = fix_timing_per_dict(scaled, min_duration, min_gap)
+            actual = table.scaled(speed).fix_timing(min_duration, min_gap)
+            label = f"速度{speed}x 最短{min_duration}s 間隔{min_gap}s"
+            if actual.to_segments() != expected:
+                failures.append(f"{label}: {actual.to_segments()} != {expected}")
+            if actual.timecodes() != ([tc(seg["start"]) for seg in expected], [tc(seg["end"]) for seg in expected]):
+                failures.append(f"{label}: タイムコードが tc() と一致しません")
+    return failures
+
+
+# --- アラインメントモデルの共有キャッシュ ---
+# ジョブ・タブをまたいでロード済みモデルを再利用し、LRU/RAM予算で追い出し、
+# 一定時間使われなかったモデルはアンロードしてColabのメモリを解放する。
+ALIGN_BACKEND = "stable-ts"  # 既定のアラインメント方式 (ALIGNER_BACKENDS のキー)
+ALIGN_MODEL_NAME = "small"
+ALIGN_MODEL_SIZES = ["tiny", "base", "small", "medium", "large-v3"]
+ALIGN_THREADS = 0  # 0ならジョブスケジューラの割り当て (CPU数 ÷ アラインメント同時実行数) に従う
+STUB_ALIGN_MODEL_NAME = "stub"  # モデルを使わずに台本を均等配置する (ベンチマーク用)
+# True にするとGPUではstable-tsのモデルの重みをfloat16にする (VRAMが約半分になり少し速い)。
+# 重みが丸められるため単語の時刻がfloat32と数十ミリ秒ずれることがあり、既定では使わない
+ALIGN_GPU_FP16 = False
+MODEL_CACHE_MAX_MODELS = 2
+MODEL_CACHE_RAM_BUDGET_MB = 4096
+MODEL_IDLE_UNLOAD_SEC = 600
+
+
+class _ModelEntry:
+    def __init__(self, model: Any, size_mb: float):
+        self.model = model
+        self.size_mb = size_mb
+        self.in_use = 0
+        self.last_used = time.monotonic()
+        self.run_lock = threading.Lock()
+
+
+_ModelKey = Tuple[str, str, str, str, int]
+
+
+class ModelRegistry:
+    """(方式, モデル名, デバイス, 計算精度, ロード時のスレッド数) をキーにロード済みモデルを保持するプロセス共通レジストリ"""
+
+    def __init__(self, max_models: int, ram_budget_mb: float, idle_unload_sec: float):
+        self.max_models = max_models
+        self.ram_budget_mb = ram_budget_mb
+        self.idle_unload_sec = idle_unload_sec
+        self._entries: "OrderedDict[_ModelKey, _ModelEntry]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._load_locks: Dict[_ModelKey, threading.Lock] = {}
+        self._reaper: Optional[threading.Thread] = None
+
+    @staticmethod
+    def default_device() -> str:
+        try:
+            import torch
+            return "cuda" if torch.cuda.is_available() else "cpu"
+        except ImportError:
+            return "cpu"
+
+    @staticmethod
+    def _estimate_size_mb(model: Any) -> float:
+        try:
+            return sum(p.numel() * p.element_size() for p in model.parameters()) / (1024 * 1024)
+        except Exception:
+            return 0.0
+
+    def _load(self, key: _ModelKey) -> Any:
+        backend, name, device, compute_type, threads = key
+        print(f"[INFO] アラインメントモデルをロードします: {name} ({backend}, {device}, {compute_type})")
+        started = time.monotonic()
+        model = get_aligner_backend(backend).load(name, device, compute_type, threads)
+        print(f"[INFO] モデルのロードが完了しました ({time.monotonic() - started:.1f}s)")
+        return model
+
+    def _evict_locked(self, incoming_mb: Optional[float] = None) -> None:
+        """使用中でないモデルをLRU順に追い出し、件数とRAM予算に収める"""
+        incoming_count = 0 if incoming_mb is None else 1
+        def over_budget() -> bool:
+            total = sum(e.size_mb for e in self._entries.values()) + (incoming_mb or 0.0)
+            return len(self._entries) + incoming_count > self.max_models or total > self.ram_budget_mb
+        for key in list(self._entries.keys()):
+            if not over_budget():
+                break
+            if self._entries[key].in_use:
+                continue
+            self._drop_locked(key, "LRU/RAM予算")
+
+    def _drop_locked(self, key: _ModelKey, reason: str) -> None:
+        entry = self._entries.pop(key)
+        print(f"[INFO] アラインメントモデルをアンロードします: {key} ({reason}, {entry.size_mb:.0f}MB)")
+        entry.model = None
+        try:
+            import gc
+            gc.collect()
+            import torch
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        except ImportError:
+            pass
+
+    def acquire(self, name: str = ALIGN_MODEL_NAME, device: Optional[str] = None, compute_type: Optional[str] = None,
+                backend: Optional[str] = None, threads: int = 0) -> Any:
+        """モデルを取得する (未ロードならロード)。使用後は release() を呼ぶこと"""
+        aligner = get_aligner_backend(backend)
+        device = device or self.default_device()
+        compute_type = compute_type or aligner.compute_type(device)
+        key = (aligner.name, name, device, compute_type, threads if aligner.threads_at_load else 0)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                entry.in_use += 1
+                entry.last_used = time.monotonic()
+                print(f"[DEBUG] キャッシュ済みモデルを再利用します: {key}")
+                return entry.model
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+        # 同じモデルの同時ロードを防ぎつつ、別モデルのロードはブロックしない
+        with load_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    entry.in_use += 1
+                    entry.last_used = time.monotonic()
+                    return entry.model
+            model = self._load(key)
+            with self._lock:
+                entry = _ModelEntry(model, aligner.estimate_size_mb(model, name))
+                self._evict_locked(entry.size_mb)
+                entry.in_use = 1
+                self._entries[key] = entry
+                self._ensure_reaper()
+                return model
+
+    def release(self, model: Any) -> None:
+        with self._lock:
+            for entry in self._entries.values():
+                if entry.model is model:
+                    entry.in_use = max(0, entry.in_use - 1)
+                    entry.last_used = time.monotonic()
+                    break
+            self._evict_locked()
+
+    def run_lock(self, model: Any) -> threading.Lock:
+        """同じモデルへの推論を直列化するためのロックを返す (スレッド並列のバッチ処理用)"""
+        with self._lock:
+            for entry in self._entries.values():
+                if entry.model is model:
+                    return entry.run_lock
+        return threading.Lock()
+
+    def unload_idle(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if not entry.in_use and now - entry.last_used >= self.idle_unload_sec:
+                    self._drop_locked(key, f"{self.idle_unload_sec:.0f}秒間未使用")
+
+    def clear(self) -> None:
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if not entry.in_use:
+                    self._drop_locked(key, "明示的なクリア")
+
+    def _ensure_reaper(self) -> None:
+        if self.idle_unload_sec <= 0 or (self._reaper and self._reaper.is_alive()):
+            return
+        def reap():
+            while True:
+                time.sleep(max(5.0, self.idle_unload_sec / 4))
+                self.unload_idle()
+                with self._lock:
+                    if not self._entries:
+                        self._reaper = None
+                        return
+        self._reaper = threading.Thread(target=reap, name="model-idle-reaper", daemon=True)
+        self._reaper.start()
+
+
+MODEL_REGISTRY = ModelRegistry(MODEL_CACHE_MAX_MODELS, MODEL_CACHE_RAM_BUDGET_MB, MODEL_IDLE_UNLOAD_SEC)
+
+
+@contextmanager
+def borrow_alignment_model(name: str = ALIGN_MODEL_NAME, device: Optional[str] = None, compute_type: Optional[str] = None,
+                           backend: Optional[str] = None, threads: int = 0):
+    """with文でレジストリからモデルを借り、終了時に返却する"""
+    model = MODEL_REGISTRY.acquire(name, device, compute_type, backend, threads)
+    try:
+        yield model
+    finally:
+        MODEL_REGISTRY.release(model)
+
+
+# --- アラインメント方式 ---
+# 両パイプラインは AlignerBackend 経由でアラインメントし、方式・モデルサイズ・スレッド数をジョブごとに選べる。
+# description は速度と精度の目安としてUIに表示する。
+class AlignerBackend(abc.ABC):
+    """アラインメント方式の共通インターフェース。align() は save_as_json() を持つ結果を返す"""
+    name = ""
+    label = ""
+    description = ""
+    uses_model = True
+    threads_at_load = False  # True ならスレッド数はロード時に決まり、レジストリのキーに含める
+
+    def available(self) -> bool:
+        """必要なライブラリが入っているか (入っていない方式はUIに出さない)"""
+        return True
+
+    def compute_type(self, device: str) -> str:
+        return "float16" if device == "cuda" and ALIGN_GPU_FP16 else "float32"
+
+    @abc.abstractmethod
+    def load(self, model_name: str, device: str, compute_type: str, threads: int) -> Any:
+        """model_name のモデルを読み込んで返す (align_loaded() に渡される)"""
+
+    def estimate_size_mb(self, model: Any, model_name: str) -> float:
+        return ModelRegistry._estimate_size_mb(model)
+
+    def cache_tag(self, model_name: str) -> str:
+        """アラインメントキャッシュのキーに使う名前"""
+        return f"{self.name}:{model_name}"
+
+    def align_loaded(self, model: Any, audio: Any, text: str, language: str, **options: Any) -> Any:
+        return model.align(audio, text, language=language, **options)
+
+    def transcribe_loaded(self, model: Any, audio: Any, language: str) -> List[Dict[str, Any]]:
+        """書き起こしのセグメント (単語の時刻付き) を返す (長時間モードで台本を割り振るのに使う)"""
+        transcribe = getattr(model, "transcribe_stable", None) or model.transcribe
+        return transcribe(audio, language=language).to_dict()["segments"]
+
+    def align(self, audio: Any, text: str, model_name: str, language: str = "ja", threads: int = 0, **options: Any) -> Any:
+        """レジストリからモデルを借りてアラインメントする"""
+        with borrow_alignment_model(model_name, backend=self.name, threads=threads) as model, MODEL_REGISTRY.run_lock(model):
+            return self.align_loaded(model, audio, text, language, **options)
+
+
+class StableTsBackend(AlignerBackend):
+    name = "stable-ts"
+    label = "stable-ts (標準)"
+    description = "PyTorch版Whisper (float32。ALIGN_GPU_FP16 でGPUのみfloat16)。タイミング精度は最も高いが、CPUのみの環境では遅い。"
+
+    def load(self, model_name: str, device: str, compute_type: str, threads: int) -> Any:
+        import stable_whisper
+        model = stable_whisper.load_model(model_name, device=device)
+        if compute_type == "float16" and device == "cuda":
+            model = model.half()
+        return model
+
+    def cache_tag(self, model_name: str) -> str:
+        # 方式を導入する前のキャッシュをそのまま使えるようにする。float16の結果はfloat32と混ぜない
+        if ALIGN_GPU_FP16 and self.compute_type(ModelRegistry.default_device()) == "float16":
+            return f"{model_name}:fp16"
+        return model_name
+
+    def align(self, audio: Any, text: str, model_name: str, language: str = "ja", threads: int = 0, **options: Any) -> Any:
+        if threads:
+            apply_torch_thread_budget(threads)
+        return super().align(audio, text, model_name, language, threads, **options)
+
+
+class FasterWhisperInt8Backend(AlignerBackend):
+    name = "faster-whisper-int8"
+    label = "faster-whisper int8 (CPU高速)"
+    description = ("CTranslate2のint8量子化モデル。CPUでは標準の数倍速くメモリも少ないが、"
+                   "量子化のため単語の境界が数十ミリ秒ずれることがある。")
+    threads_at_load = True
+    # 重みの実測サイズを取れないため、int8でのおおよその大きさでRAM予算を計算する
+    SIZE_HINT_MB = {"tiny": 45, "base": 80, "small": 250, "medium": 780, "large-v3": 1600}
+
+    def available(self) -> bool:
+        import importlib.util
+        return importlib.util.find_spec("faster_whisper") is not None
+
+    def compute_type(self, device: str) -> str:
+        return "int8_float16" if device == "cuda" else "int8"
+
+    def load(self, model_name: str, device: str, compute_type: str, threads: int) -> Any:
+        import stable_whisper
+        return stable_whisper.load_faster_whisper(model_name, device=device, compute_type=compute_type,
+                                                  cpu_threads=threads or JOB_SCHEDULER.threads_for("align"))
+
+    def estimate_size_mb(self, model: Any, model_name: str) -> float:
+        return float(self.SIZE_HINT_MB.get(model_name, 0))
+
+
+class StubAlignerBackend(AlignerBackend):
+    name = STUB_ALIGN_MODEL_NAME
+    label = "スタブ (テスト用)"
+    description = "モデルを使わず、台本の各行を文字数に比例して並べる。一瞬で終わり結果は常に同じだが、時刻は目安にすぎない。"
+    uses_model = False
+
+    def load(self, model_name: str, device: str, compute_type: str, threads: int) -> Any:
+        return self  # 読み込むモデルはないため、レジストリ経由で借りた場合も自身を「モデル」として扱う
+
+    def estimate_size_mb(self, model: Any, model_name: str) -> float:
+        return 0.0
+
+    def cache_tag(self, model_name: str) -> str:
+        return STUB_ALIGN_MODEL_NAME
+
+    def align_loaded(self, model: Any, audio: Any, text: str, language: str, **options: Any) -> Any:
+        return StubAlignmentResult(audio, text)
+
+    def align(self, audio: Any, text: str, model_name: str, language: str = "ja", threads: int = 0, **options: Any) -> Any:
+        return StubAlignmentResult(audio, text)
+
+
+ALIGNER_BACKENDS: Dict[str, AlignerBackend] = {
+    backend.name: backend for backend in (StableTsBackend(), FasterWhisperInt8Backend(), StubAlignerBackend())
+}
+
+
+def get_aligner_backend(name: Optional[str] = None) -> AlignerBackend:
+    backend = ALIGNER_BACKENDS.get(name or ALIGN_BACKEND)
+    if backend is None:
+        raise ValueError(f"不明なアラインメント方式です: {name} (選択肢: {', '.join(ALIGNER_BACKENDS)})")
+    if not backend.available():
+        raise ValueError(f"アラインメント方式 {backend.name} に必要なライブラリがインストールされていません。")
+    return backend
+
+
+def available_aligner_backends() -> List[AlignerBackend]:
+    return [backend for backend in ALIGNER_BACKENDS.values() if backend.available()]
+
+
+def resolve_aligner(backend: Optional[str], model_name: Optional[str]) -> Tuple[AlignerBackend, str]:
+    """未指定の方式・モデルを既定値で補う (モデル名 stub はスタブ方式として扱う)"""
+    model_name = model_name or ALIGN_MODEL_NAME
+    return get_aligner_backend(STUB_ALIGN_MODEL_NAME if model_name == STUB_ALIGN_MODEL_NAME else backend), model_name
+
+
+def parse_aligner_spec(spec: Optional[str]) -> Tuple[str, str]:
+    """"方式:モデル" / "モデル" / "stub" の形式の指定を (方式, モデル名) に分解する"""
+    spec = (spec or "").strip()
+    if spec == STUB_ALIGN_MODEL_NAME:
+        return STUB_ALIGN_MODEL_NAME, STUB_ALIGN_MODEL_NAME
+    backend, _, model_name = spec.rpartition(":")
+    return get_aligner_backend(backend or None).name, model_name or ALIGN_MODEL_NAME
+
+
+# --- メディア情報の取得 ---
+# ffprobe はファイルごとに1回だけ実行し、(パス, サイズ, mtime) をキーにメモ化する。
+# キーフレーム一覧は全パケットを読むため、必要になった時点で1回だけ取得する。
+MEDIA_PROBE_MEMORY_ITEMS = 64
+
+
+@dataclass
+class MediaInfo:
+    """ffprobe で取得したメディア情報"""
+    path: str
+    width: int = 0
+    height: int = 0
+    duration: Optional[float] = None
+    fps: Optional[float] = None
+    rotation: int = 0
+    video_codec: Optional[str] = None
+    audio_codec: Optional[str] = None
+    start_time: float = 0.0  # 映像ストリームの先頭時刻。-ss はこれを0とした相対時刻で指定する
+    _frames: Optional[List[float]] = field(default=None, repr=False)
+    _keyframes: Optional[List[float]] = field(default=None, repr=False)
+
+    @property
+    def has_video(self) -> bool:
+        return self.video_codec is not None
+
+    @property
+    def has_audio(self) -> bool:
+        return self.audio_codec is not None
+
+    @property
+    def display_size(self) -> Tuple[int, int]:
+        """回転メタデータを反映した表示サイズ(W,H)。FFmpegは自動回転後のフレームに字幕を描画する"""
+        return (self.height, self.width) if self.rotation % 180 else (self.width, self.height)
+
+    def _read_packets(self) -> None:
+        out = subprocess.check_output(["ffprobe","-v","error","-select_streams","v:0",
+                                       "-show_entries","packet=pts_time,flags","-of","csv=p=0", self.path])
+        frames, keyframes = set(), set()
+        for line in out.decode("utf-8").splitlines():
+            pts, _, flags = line.strip().partition(",")
+            try:
+                t = float(pts) - self.start_time
+            except ValueError:
+                continue
+            frames.add(t)
+            if "K" in flags:
+                keyframes.add(t)
+        self._frames, self._keyframes = sorted(frames), sorted(keyframes)
+
+    def frame_times(self) -> List[float]:
+        """映像ストリームの全フレームの表示時刻(秒, start_time起点)を昇順で返す (初回のみ取得)"""
+        if self._frames is None:
+            self._read_packets()
+        return self._frames
+
+    def keyframe_times(self) -> List[float]:
+        """映像ストリームのキーフレーム時刻(秒, start_time起点)を昇順で返す (初回のみ取得)"""
+        if self._keyframes is None:
+            self._read_packets()
+        return self._keyframes
+
+
+_media_probe_memo: "OrderedDict[Tuple[str, int, int], MediaInfo]" = OrderedDict()
+_media_probe_lock = threading.Lock()
+
+
+def _parse_frame_rate(value: Optional[str]) -> Optional[float]:
+    try:
+        num, _, den = (value or "").partition("/")
+        rate = float(num) / float(den or 1)
+        return rate if rate > 0 else None
+    except (ValueError, ZeroDivisionError):
+        return None
+
+
+def _parse_rotation(stream: Dict[str, Any]) -> int:
+    for side_data in stream.get("side_data_list") or []:
+        if "rotation" in side_data:
+            return int(float(side_data["rotation"])) % 360
+    try:
+        return int(float((stream.get("tags") or {}).get("rotate", 0))) % 360
+    except ValueError:
+        return 0
+
+
+def probe_media(path: str) -> MediaInfo:
+    """メディアのサイズ・長さ・fps・回転・コーデックを1回のffprobeで取得する (メモ化)"""
+    st = os.stat(path)
+    memo_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    with _media_probe_lock:
+        info = _media_probe_memo.get(memo_key)
+        if info:
+            _media_probe_memo.move_to_end(memo_key)
+            return info
+    out = subprocess.check_output(["ffprobe","-v","error","-show_entries",
+                                   "format=duration,start_time:stream=codec_type,codec_name,width,height,avg_frame_rate,r_frame_rate,start_time"
+                                   ":stream_tags=rotate:stream_side_data=rotation","-of","json", path])
+    data = json.loads(out.decode("utf-8"))
+    info = MediaInfo(path=path)
+    try:
+        info.duration = float(data.get("format", {}).get("duration"))
+    except (TypeError, ValueError):
+        pass
+    for stream in data.get("streams", []):
+        if stream.get("codec_type") == "video" and info.video_codec is None:
+            info.video_codec = stream.get("codec_name")
+            info.width, info.height = int(stream.get("width") or 0), int(stream.get("height") or 0)
+            info.fps = _parse_frame_rate(stream.get("avg_frame_rate")) or _parse_frame_rate(stream.get("r_frame_rate"))
+            info.rotation = _parse_rotation(stream)
+            try:
+                info.start_time = float(stream.get("start_time") or data.get("format", {}).get("start_time") or 0.0)
+            except (TypeError, ValueError):
+                pass
+        elif stream.get("codec_type") == "audio" and info.audio_codec is None:
+            info.audio_codec = stream.get("codec_name")
+    print(f"[DEBUG] メディア情報を取得: {path} ({info.width}x{info.height}, {info.duration}s, 映像={info.video_codec}, 音声={info.audio_codec})")
+    with _media_probe_lock:
+        _media_probe_memo[memo_key] = info
+        while len(_media_probe_memo) > MEDIA_PROBE_MEMORY_ITEMS:
+            _media_probe_memo.popitem(last=False)
+    return info
+
+
+def probe_display_size(path: str, default: Tuple[int, int] = (1920, 1080)) -> Tuple[int, int]:
+    """表示サイズ(W,H)を返す。取得できない場合は警告を出して既定値を返す"""
+    try:
+        w, h = probe_media(path).display_size
+        if w > 0 and h > 0:
+            return w, h
+        print(f"[WARN] 映像ストリームのサイズが取得できません: {path}。{default[0]}x{default[1]} として扱います。")
+    except Exception as e:
+        print(f"[WARN] メディア情報の取得に失敗しました: {path} ({e})。{default[0]}x{default[1]} として扱います。")
+    return default
+
+
+# --- 音声のPCMデコード ---
+# ffmpegの標準出力から16kHzモノラルのfloat32 PCMを直接NumPy配列に読み込み、
+# 一時WAVの書き出し・読み直しとWhisper側での再デコードを省く。
+ALIGN_SAMPLE_RATE = 16000
+PCM_CHUNK_SEC = 30  # 長さが分からない・見積もりより長いときに配列を伸ばす単位
+PCM_SLACK_SEC = 1.0  # コンテナの長さの誤差に備えて見積もりに足す秒数
+
+
+def decode_audio_pcm(path: str, sample_rate: int = ALIGN_SAMPLE_RATE) -> np.ndarray:
+    """メディアの音声をモノラルfloat32 PCMとしてデコードする"""
+    cmd = ["ffmpeg","-nostdin","-i",path,"-vn","-ac","1","-ar",str(sample_rate),
+           "-f","f32le","-acodec","pcm_f32le","-loglevel","error","pipe:1"]
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stderr_chunks: List[bytes] = []
+    drain = threading.Thread(target=lambda: stderr_chunks.append(process.stderr.read()), daemon=True)
+    drain.start()
+    # 長さから見積もった1つの配列に直接読み込む。区切って読んだものを連結すると、連結の間だけ
+    # 音声全体の2倍のメモリを使うため。見積もりとの差は resize (realloc) で詰める・伸ばす
+    duration = probe_media(path).duration or 0.0
+    chunk_samples = sample_rate * PCM_CHUNK_SEC
+    pcm = np.empty(int((duration + PCM_SLACK_SEC) * sample_rate) if duration else chunk_samples, dtype=np.float32)
+    filled = 0
+    while True:
+        view = memoryview(pcm).cast("B")
+        while filled < len(view):
+            n = process.stdout.readinto(view[filled:])
+            if not n:
+                break
+            filled += n
+        view.release()
+        if filled < pcm.nbytes:
+            break
+        pcm.resize(len(pcm) + max(chunk_samples, len(pcm) // 4), refcheck=False)
+    process.stdout.close()
+    returncode = process.wait()
+    drain.join()
+    if returncode != 0:
+        stderr = b"".join(stderr_chunks).decode("utf-8", errors="replace")
+        print("--- SUBPROCESS FAILED ---", file=sys.stderr)
+        print(f"COMMAND: {' '.join(cmd)}", file=sys.stderr)
+        print(f"RETURN CODE: {returncode}", file=sys.stderr)
+        print("--- STDERR ---", file=sys.stderr)
+        print(stderr, file=sys.stderr)
+        raise subprocess.CalledProcessError(returncode, cmd, stderr=stderr)
+    if filled < 4:
+        raise ValueError(f"音声ストリームをデコードできませんでした: {path}")
+    pcm.resize(filled // 4, refcheck=False)
+    return pcm
+
+
+# --- アラインメント結果のキャッシュ ---
+# (音声の内容ハッシュ, 正規化した台本のハッシュ, モデル, 言語) をキーに align.json を保存し、
+# スタイルだけを変えた再レンダリングではWhisperを再実行しない。
+ALIGN_CACHE_DIR = Path.cwd() / "runs" / "_align_cache"
+ALIGN_CACHE_ON_DRIVE = False
+ALIGN_CACHE_DRIVE_DIR_NAME = "Subtitle_AlignCache"
+_file_hash_memo: Dict[Tuple[str, int, int], str] = {}
+_file_hash_lock = threading.Lock()
+
+
+def file_content_hash(path: str) -> str:
+    """ファイル内容のSHA-256を返す ((パス, サイズ, mtime) ごとにメモ化)"""
+    st = os.stat(path)
+    memo_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    with _file_hash_lock:
+        cached = _file_hash_memo.get(memo_key)
+    if cached:
+        return cached
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(4 * 1024 * 1024), b""):
+            digest.update(chunk)
+    value = digest.hexdigest()
+    with _file_hash_lock:
+        _file_hash_memo[memo_key] = value
+    return value
+
+
+def normalize_script_text(text: str) -> str:
+    """改行コード・BOM・行末空白・前後の空行の違いを吸収した台本テキストを返す"""
+    text = text.lstrip("\ufeff").replace("\r\n", "\n").replace("\r", "\n")
+    return "\n".join(line.rstrip() for line in text.split("\n")).strip("\n")
+
+
+def get_align_cache_dir() -> Path:
+    directory = ensure_drive_mounted() / ALIGN_CACHE_DRIVE_DIR_NAME if ALIGN_CACHE_ON_DRIVE else ALIGN_CACHE_DIR
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory
+
+
+def alignment_cache_key(media_path: str, script_text: str, model_name: str, language: str) -> str:
+    script_hash = hashlib.sha256(normalize_script_text(script_text).encode("utf-8")).hexdigest()
+    raw = "|".join([file_content_hash(media_path), script_hash, model_name, language])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class StubAlignmentResult:
+    """台本の各行を文字数に比例して音声全体へ割り振るだけのアラインメント結果 (ベンチマーク用)"""
+
+    def __init__(self, audio: Any, script_text: str):
+        duration = len(audio) / ALIGN_SAMPLE_RATE if isinstance(audio, np.ndarray) else (probe_media(audio).duration or 0.0)
+        lines = [line for line in normalize_script_text(script_text).split("\n") if line.strip()]
+        total_chars = sum(len(line) for line in lines) or 1
+        self.segments, t = [], 0.0
+        for line in lines:
+            end = t + duration * len(line) / total_chars
+            self.segments.append({"start": round(t, 3), "end": round(end, 3), "text": line, "words": []})
+            t = end
+
+    def save_as_json(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"segments": self.segments}, f, ensure_ascii=False)
+
+
+def cached_align(
+    media_path: str, script_text: str, json_out: str,
+    audio_for_align: Callable[[], Any],
+    model_name: Optional[str] = None, language: str = "ja",
+    progress: Optional[Callable[..., Any]] = None,
+    backend: Optional[str] = None, threads: int = 0
+) -> SegmentTable:
+    """キャッシュがあれば再利用し、なければアラインメントを実行して保存する。空行を除いたセグメント表を返す"""
+    aligner, model_name = resolve_aligner(backend, model_name)
+    threads = threads or ALIGN_THREADS
+    longform = use_longform_alignment(media_path, aligner)
+    cache_model = aligner.cache_tag(model_name) + (f"+longform{LONGFORM_CHUNK_SEC}" if longform else "")
+    cache_file = get_align_cache_dir() / f"{alignment_cache_key(media_path, script_text, cache_model, language)}.json"
+    if cache_file.exists():
+        print(f"[INFO] アラインメント結果のキャッシュを使用します: {cache_file.name}")
+        shutil.copyfile(cache_file, json_out)
+    else:
+        audio = audio_for_align()
+        print(f"[INFO] アラインメント方式: {aligner.name} (モデル {model_name}, スレッド {threads or '自動'})")
+        if not aligner.uses_model:
+            result = aligner.align(audio, script_text, model_name, language)
+        elif longform:
+            with JOB_SCHEDULER.admit("align", "アラインメント (長時間モード)", progress):
+                result = align_longform(audio, script_text, model_name, language, progress, aligner, threads)
+        else:
+            with JOB_SCHEDULER.admit("align", "アラインメント", progress) as budget:
+                result = aligner.align(audio, script_text, model_name, language, threads or budget)
+        result.save_as_json(json_out)
+        tmp_file = cache_file.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        shutil.copyfile(json_out, tmp_file)
+        os.replace(tmp_file, cache_file)
+        print(f"[DEBUG] アラインメント結果をキャッシュに保存しました: {cache_file.name}")
+    return SegmentTable.from_json(json_out).drop_empty()
+
+
+# --- 長時間音声の分割アラインメント ---
+# 一定以上の長さの音声は無音区間で数分ずつに区切り、台本も各区間に割り振って
+# 区間ごとに並列でアラインメントしてから1本の結果に戻す。
+# 台本の割り振りには、小さなモデル (LONGFORM_COARSE_MODEL) で区間ごとに書き起こした結果を使う。
+# 書き起こしと台本を文字n-gramで突き合わせたアンカーから各行の話される時刻を見積もり、
+# 区間には担当する行 (と前後 LONGFORM_OVERLAP_LINES 行) と、それらの行の見積もり範囲に
+# 誤差分 (LONGFORM_AUDIO_PAD_SEC) を足した音声を渡すため、区間に無い台本を押し込むことはない。
+# 重なった行は、自分の担当区間の中に収まった結果を優先し、次に単語の確からしさが高い方を採用する。
+LONGFORM_ALIGN = True
+LONGFORM_MIN_DURATION_SEC = 20 * 60  # これより短い音声は従来どおり1回でアラインメントする
+LONGFORM_CHUNK_SEC = 300
+LONGFORM_COARSE_MODEL = "tiny"
+LONGFORM_ANCHOR_NGRAM = 4  # 台本の中で1回しか現れない文字n-gramだけをアンカーにする
+LONGFORM_MIN_ANCHORS = 20  # これより少なければ書き起こしを使わず文字数比で見積もる
+LONGFORM_OVERLAP_LINES = 1
+LONGFORM_AUDIO_PAD_SEC = 3.0
+LONGFORM_FRAME_SEC = 0.05
+LONGFORM_MIN_SILENCE_SEC = 0.3
+LONGFORM_SILENCE_MARGIN_DB = 10.0  # 下位10%の音量からこれだけ大きいところまでを無音とみなす
+LONGFORM_SILENCE_MAX_DB = -30.0
+# CPU時のワーカープロセス数。各ワーカーが自分用にモデルを1つ読み込むため、長時間モード中は
+# 最大で LONGFORM_MAX_WORKERS × モデルサイズ (smallで約1GB) のRAMを使う。これはメインプロセスの
+# MODEL_CACHE_RAM_BUDGET_MB とは別枠なので、RAMの少ない環境では減らすこと (1ならワーカーを使わない)
+LONGFORM_MAX_WORKERS = 4
+# ワーカープロセスは常駐してRAMを使うため、長時間の音声を扱うと分かっているときだけ起動する
+# (CLIでは --longform-workers)。起動しなければ区間は1プロセスで順に処理する
+LONGFORM_WORKER_POOL = False
+LONGFORM_POOL_POLL_SEC = 1.0
+_ANCHOR_STRIP_RE = re.compile(r"[\W_]+")
+_longform_worker_models: Dict[Tuple[str, str, int], Any] = {}
+_longform_pool: Optional[Any] = None
+_longform_pool_workers: Set[int] = set()
+
+
+def use_longform_alignment(media_path: str, aligner: AlignerBackend) -> bool:
+    if not LONGFORM_ALIGN or not aligner.uses_model:
+        return False
+    return (probe_media(media_path).duration or 0.0) >= LONGFORM_MIN_DURATION_SEC
+
+
+def detect_speech_frames(audio: np.ndarray, sr: int = ALIGN_SAMPLE_RATE) -> np.ndarray:
+    """LONGFORM_FRAME_SEC ごとのフレームが発話 (無音でない) かどうかの真偽値配列を返す"""
+    hop = max(1, int(sr * LONGFORM_FRAME_SEC))
+    n = len(audio) // hop
+    if n == 0:
+        return np.zeros(0, dtype=bool)
+    frames = audio[:n * hop].reshape(n, hop)
+    db = 10 * np.log10(np.mean(np.square(frames, dtype=np.float32), axis=1) + 1e-10)
+    threshold = min(float(np.percentile(db, 10)) + LONGFORM_SILENCE_MARGIN_DB, LONGFORM_SILENCE_MAX_DB)
+    return db >= threshold
+
+
+def find_silences(speech: np.ndarray) -> np.ndarray:
+    """LONGFORM_MIN_SILENCE_SEC 以上続く無音区間を [[開始秒, 終了秒], ...] で返す"""
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], (~speech).astype(np.int8), [0]))))
+    starts, ends = edges[0::2], edges[1::2]
+    keep = (ends - starts) * LONGFORM_FRAME_SEC >= LONGFORM_MIN_SILENCE_SEC
+    return np.stack([starts[keep], ends[keep]], axis=1) * LONGFORM_FRAME_SEC
+
+
+def plan_longform_chunks(duration: float, silences: np.ndarray, target_sec: float = LONGFORM_CHUNK_SEC) -> List[float]:
+    """目標の長さの前後で最も長い無音の中央を区切りにした境界の一覧 (先頭0と末尾durationを含む)"""
+    mids = silences.mean(axis=1) if len(silences) else np.zeros(0)
+    lengths = silences[:, 1] - silences[:, 0] if len(silences) else np.zeros(0)
+    cuts = [0.0]
+    while duration - cuts[-1] > target_sec * 1.5:
+        window = (mids > cuts[-1] + target_sec * 0.5) & (mids < cuts[-1] + target_sec * 1.5)
+        if window.any():
+            cuts.append(float(mids[window][np.argmax(lengths[window])]))
+        else:
+            cuts.append(cuts[-1] + target_sec)  # 無音が見つからなければ目標の長さで切る
+    cuts.append(float(duration))
+    return cuts
+
+
+def estimate_line_spans(lines: List[str], speech: np.ndarray) -> np.ndarray:
+    """各行の [開始, 終了] 時刻を、発話区間の累積時間と台本の累積文字数の比例で見積もる (書き起こしが使えない場合)"""
+    chars = np.array([len(line) for line in lines], dtype=np.float64)
+    bounds = np.concatenate(([0.0], np.cumsum(chars))) / max(chars.sum(), 1.0)
+    cum_speech = np.cumsum(speech)
+    total_speech = cum_speech[-1] if len(cum_speech) else 0
+    if total_speech == 0:
+        times = bounds * len(speech) * LONGFORM_FRAME_SEC
+    else:
+        times = np.searchsorted(cum_speech, bounds * total_speech) * LONGFORM_FRAME_SEC
+    return np.stack([times[:-1], times[1:]], axis=1)
+
+
+def _normalize_for_anchor(text: str) -> str:
+    return _ANCHOR_STRIP_RE.sub("", text).lower()
+
+
+def _longest_increasing(values: List[int]) -> List[int]:
+    """values の狭義単調増加な最長部分列の添字を返す"""
+    tails: List[int] = []
+    tail_index: List[int] = []
+    previous = [-1] * len(values)
+    for i, value in enumerate(values):
+        k = bisect.bisect_left(tails, value)
+        if k == len(tails):
+            tails.append(value)
+            tail_index.append(i)
+        else:
+            tails[k] = value
+            tail_index[k] = i
+        previous[i] = tail_index[k - 1] if k else -1
+    picked, i = [], tail_index[-1] if tail_index else -1
+    while i >= 0:
+        picked.append(i)
+        i = previous[i]
+    return picked[::-1]
+
+
+def anchor_line_spans(lines: List[str], words: List[Dict[str, Any]], duration: float) -> Optional[np.ndarray]:
+    """時刻付きの書き起こし単語と台本を文字n-gramで突き合わせ、各行の [開始, 終了] 時刻を見積もる。
+    アンカーが LONGFORM_MIN_ANCHORS に満たなければ None を返す"""
+    normalized = [_normalize_for_anchor(line) for line in lines]
+    bounds = np.cumsum([0] + [len(text) for text in normalized]).astype(np.float64)
+    script = "".join(normalized)
+    pieces, char_times = [], []
+    for word in words:
+        text = _normalize_for_anchor(word.get("word") or "")
+        if text:
+            step = (word["end"] - word["start"]) / len(text)
+            pieces.append(text)
+            char_times.extend((word["start"] + step * (np.arange(len(text)) + 0.5)).tolist())
+    transcript = "".join(pieces)
+    n = LONGFORM_ANCHOR_NGRAM
+    first_pos: Dict[str, int] = {}
+    unique: Dict[str, bool] = {}
+    for i in range(len(script) - n + 1):
+        gram = script[i:i + n]
+        unique[gram] = gram not in unique
+        first_pos.setdefault(gram, i)
+    pairs = [(first_pos[gram], char_times[j]) for j in range(len(transcript) - n + 1)
+             if unique.get(gram := transcript[j:j + n])]
+    picked = [pairs[i] for i in _longest_increasing([pos for pos, _ in pairs])]
+    if len(picked) < LONGFORM_MIN_ANCHORS:
+        return None
+    positions = np.array([pos for pos, _ in picked], dtype=np.float64)
+    times = np.array([t for _, t in picked], dtype=np.float64)
+    # 最初と最後のアンカーより外側は、アンカー全体の平均の話速で延長する
+    rate = (times[-1] - times[0]) / max(positions[-1] - positions[0], 1.0)
+    positions = np.concatenate(([0.0], positions, [max(len(script), positions[-1] + 1)]))
+    times = np.concatenate(([times[0] - positions[1] * rate], times, [times[-1] + (positions[-1] - positions[-2]) * rate]))
+    spans = np.interp(np.stack([bounds[:-1], bounds[1:]], axis=1), positions, np.clip(times, 0.0, duration))
+    return spans
+
+
+def _mean_word_probability(seg: Dict[str, Any]) -> float:
+    probs = [w.get("probability") for w in seg.get("words") or () if w.get("probability") is not None]
+    return float(np.mean(probs)) if probs else 0.0
+
+
+def _shift_segment(seg: Dict[str, Any], offset: float) -> Dict[str, Any]:
+    words = [dict(w, start=w["start"] + offset, end=w["end"] + offset) for w in seg.get("words") or ()]
+    return {"start": seg["start"] + offset, "end": seg["end"] + offset, "text": seg["text"], "words": words}
+
+
+def _run_longform_task(aligner: AlignerBackend, model: Any, task: str, audio: np.ndarray, text: str, language: str) -> List[Dict[str, Any]]:
+    """1区間を書き起こす (task="transcribe") かアラインメントし、区間先頭を0秒としたセグメントを返す"""
+    if task == "transcribe":
+        return aligner.transcribe_loaded(model, audio, language)
+    return aligner.align_loaded(model, audio, text, language, original_split=True).to_dict()["segments"]
+
+
+def _longform_worker_task(task: str, backend: str, model_name: str, threads: int,
+                          audio: np.ndarray, text: str, language: str) -> List[Dict[str, Any]]:
+    """ワーカープロセス内で実行する。モデルはワーカーごとに初回だけ読み込んで使い回す"""
+    aligner = get_aligner_backend(backend)
+    key = (backend, model_name, threads)
+    apply_torch_thread_budget(threads)
+    if key not in _longform_worker_models:
+        # ワーカーごとに保持するモデルは1つだけにする (書き起こし用とアラインメント用を同時に抱えない)
+        _longform_worker_models.clear()
+        _longform_worker_models[key] = aligner.load(model_name, "cpu", aligner.compute_type("cpu"), threads)
+    return _run_longform_task(aligner, _longform_worker_models[key], task, audio, text, language)
+
+
+def start_longform_pool() -> None:
+    """長時間モード用のCPUワーカープロセスを、torchを読み込む前にまとめてforkしておく"""
+    global _longform_pool, _longform_pool_workers
+    import multiprocessing
+    if _longform_pool is not None or not LONGFORM_ALIGN or LONGFORM_MAX_WORKERS < 2:
+        return
+    if "torch" in sys.modules:
+        # torch/OpenMPのスレッドが動き出したプロセスをforkすると、子プロセスが固まることがある
+        print("[WARN] torchが読み込み済みのため、長時間モードのワーカープロセスを起動しません (区間は順に処理します)。")
+        return
+    # forkを使う (このスクリプトはノートブック上で定義されるため、spawnでは関数を読み込めない)。
+    # multiprocessing.Pool は作成時に全ワーカーを起動するので、以降にtorchを読み込んでも影響しない
+    _longform_pool = multiprocessing.get_context("fork").Pool(LONGFORM_MAX_WORKERS)
+    atexit.register(_longform_pool.terminate)
+    _longform_pool_workers = _longform_pool_pids(_longform_pool)
+    print(f"[INFO] 長時間モード用のワーカープロセスを{LONGFORM_MAX_WORKERS}個起動しました。")
+
+
+def _longform_pool_pids(pool: Any) -> Set[int]:
+    """プールで動いているワーカーのPIDを返す (終了済みのプールなら空)"""
+    from multiprocessing.pool import RUN
+    if pool._state != RUN:
+        return set()
+    return {p.pid for p in pool._pool if p.is_alive()}
+
+
+def discard_longform_pool(reason: str) -> None:
+    """ワーカーが落ちたプールを破棄する。以降の長時間モードは区間を順に処理する"""
+    global _longform_pool
+    pool, _longform_pool = _longform_pool, None
+    if pool is not None:
+        print(f"[WARN] {reason}ため、長時間モードのワーカープロセスを破棄して区間を順に処理します。")
+        atexit.unregister(pool.terminate)
+        for worker in pool._pool:
+            worker.kill()
+        # 落ちたワーカーがタスクキューのロックを持ったままだと terminate() は戻らないため、待たない
+        threading.Thread(target=pool.terminate, daemon=True).start()
+
+
+def longform_pool_alive(pool: Any) -> bool:
+    """起動時のワーカーが全て動いていれば True。Poolは落ちたワーカーを補充するが、落ちたときに
+    処理中だった区間は返らず、キューのロックを持ったまま落ちていれば以降の区間も配られない"""
+    return _longform_pool_pids(pool) == _longform_pool_workers
+
+
+def get_longform_pool() -> Optional[Any]:
+    """起動済みで全ワーカーが動いているプールを返す (無ければ None)"""
+    if _longform_pool is not None and not longform_pool_alive(_longform_pool):
+        discard_longform_pool("ワーカープロセスが終了していた")
+    return _longform_pool
+
+
+class LongformAlignmentResult:
+    """分割アラインメントを統合した結果 (save_as_json はstable-tsの結果と同じ形式)"""
+
+    def __init__(self, segments: List[Dict[str, Any]]):
+        self.segments = segments
+
+    def save_as_json(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"segments": self.segments}, f, ensure_ascii=False)
+
+
+def merge_longform_segments(cuts: List[float], jobs: List[Dict[str, Any]], n_lines: int) -> List[Dict[str, Any]]:
+    """区間ごとの結果を時刻を戻して統合する。重なった行は担当区間に収まった方、次にその行を担当する区間、
+    次に確からしさが高い方を採る"""
+    if all(len(job["segments"]) == job["line_end"] - job["line_start"] for job in jobs):
+        chosen: List[Optional[Tuple[Tuple[bool, bool, float], Dict[str, Any]]]] = [None] * n_lines
+        for job in jobs:
+            core_start, core_end = cuts[job["index"]], cuts[job["index"] + 1]
+            for k, seg in enumerate(job["segments"], start=job["line_start"]):
+                seg = _shift_segment(seg, job["offset"])
+                mid = (seg["start"] + seg["end"]) / 2
+                owned = job.get("own_start", job["line_start"]) <= k < job.get("own_end", job["line_end"])
+                score = (core_start <= mid < core_end, owned, _mean_word_probability(seg))
+                if chosen[k] is None or score > chosen[k][0]:
+                    chosen[k] = (score, seg)
+        merged = [c[1] for c in chosen if c is not None]
+    else:
+        # 行とセグメントが1対1に対応しない区間がある場合は、中央が担当区間に入るセグメントだけを残す
+        print("[WARN] 区間の結果が台本の行と対応しないため、時刻で統合します。")
+        merged = []
+        for job in jobs:
+            core_start, core_end = cuts[job["index"]], cuts[job["index"] + 1]
+            for seg in job["segments"]:
+                seg = _shift_segment(seg, job["offset"])
+                if core_start <= (seg["start"] + seg["end"]) / 2 < core_end:
+                    merged.append(seg)
+        merged.sort(key=lambda s: s["start"])
+    # 区間の境界で前後が入れ替わらないよう、開始時刻を単調にそろえる
+    starts = np.maximum.accumulate(np.array([s["start"] for s in merged], dtype=np.float64)) if merged else np.zeros(0)
+    for seg, start in zip(merged, starts.tolist()):
+        seg["start"], seg["end"] = start, max(seg["end"], start)
+    return merged
+
+
+def _snap_to_silence(t: float, silences: np.ndarray, lo: float, hi: float, default: float) -> float:
+    """[lo, hi] に中央がある無音のうち最も長いものの中央を返す (無ければ default)。
+    区間の音声を無音で切り、台本に無い発話が端に入らないようにする"""
+    if not len(silences):
+        return default
+    mids = silences.mean(axis=1)
+    window = (mids >= lo) & (mids <= hi)
+    if not window.any():
+        return default
+    lengths = silences[window, 1] - silences[window, 0]
+    return float(mids[window][np.argmax(lengths)])
+
+
+def plan_longform_jobs(cuts: List[float], spans: np.ndarray, lines: List[str], duration: float,
+                       silences: Optional[np.ndarray] = None) -> List[Dict[str, Any]]:
+    """行の見積もり範囲から区間ごとの担当行を決め、音声はそれらの行の範囲の前後 LONGFORM_AUDIO_PAD_SEC 以内の無音で切り出す"""
+    silences = silences if silences is not None else np.zeros((0, 2))
+    owners = np.clip(np.searchsorted(cuts, spans.mean(axis=1), side="right") - 1, 0, len(cuts) - 2)
+    jobs = []
+    for i in range(len(cuts) - 1):
+        owned = np.flatnonzero(owners == i)
+        if not len(owned):
+            continue  # 台本が割り当てられない区間 (長い間奏など) は処理しない
+        line_start = max(0, int(owned[0]) - LONGFORM_OVERLAP_LINES)
+        line_end = min(len(lines), int(owned[-1]) + 1 + LONGFORM_OVERLAP_LINES)
+        first, last = float(spans[line_start:line_end, 0].min()), float(spans[line_start:line_end, 1].max())
+        offset = max(0.0, _snap_to_silence(first, silences, first - LONGFORM_AUDIO_PAD_SEC, first, first - LONGFORM_AUDIO_PAD_SEC))
+        end = min(duration, _snap_to_silence(last, silences, last, last + LONGFORM_AUDIO_PAD_SEC, last + LONGFORM_AUDIO_PAD_SEC))
+        jobs.append({"index": i, "offset": offset, "end": end, "line_start": line_start, "line_end": line_end,
+                     "own_start": int(owned[0]), "own_end": int(owned[-1]) + 1, "text": "\n".join(lines[line_start:line_end])})
+    return jobs
+
+
+def align_longform(audio: Any, script_text: str, model_name: str, language: str = "ja",
+                   progress: Optional[Callable[..., Any]] = None, aligner: Optional[AlignerBackend] = None,
+                   threads: int = 0) -> LongformAlignmentResult:
+    """無音で区切った区間ごとに書き起こしで台本を割り振り、並列にアラインメントして結果を統合する"""
+    if not isinstance(audio, np.ndarray):
+        audio = decode_audio_pcm(audio)
+    aligner = aligner or get_aligner_backend()
+    sr = ALIGN_SAMPLE_RATE
+    duration = len(audio) / sr
+    lines = [line for line in normalize_script_text(script_text).split("\n") if line.strip()]
+    speech = detect_speech_frames(audio, sr)
+    silences = find_silences(speech)
+    cuts = plan_longform_chunks(duration, silences)
+    print(f"[INFO] 長時間モード: {duration / 60:.0f}分を{len(cuts) - 1}区間に分けて書き起こし・アラインメントします。")
+
+    device = ModelRegistry.default_device()
+    threads = threads or JOB_SCHEDULER.threads_for("align")
+    # ワーカープロセスは起動時に start_longform_pool() でfork済みのものだけを使う (ここでforkはしない)
+    pool = get_longform_pool() if device != "cuda" and min(len(cuts) - 1, threads // 2) > 1 else None
+
+    def run_phase(task: str, phase_model: str, items: List[Tuple[float, float, str]], label: str) -> List[List[Dict[str, Any]]]:
+        """(開始秒, 終了秒, 台本) の一覧を処理し、結果を同じ順で返す"""
+        nonlocal pool
+        results: List[Optional[List[Dict[str, Any]]]] = [None] * len(items)
+        done = 0
+
+        def report() -> None:
+            print(f"[DEBUG] {label} {done}/{len(items)} 区間完了")
+            if progress is not None:
+                progress(done / len(items), desc=f"{label} {done}/{len(items)} 区間")
+
+        if pool is not None:
+            worker_threads = max(1, threads // LONGFORM_MAX_WORKERS)
+            pending = [pool.apply_async(_longform_worker_task, (task, aligner.name, phase_model, worker_threads,
+                                                               audio[int(start * sr):int(end * sr)], text, language))
+                       for start, end, text in items]
+            for i, result in enumerate(pending):
+                # ワーカーが落ちる (メモリ不足でkillされるなど) と、その区間の結果は永久に返らない
+                while not result.ready() and longform_pool_alive(pool):
+                    result.wait(LONGFORM_POOL_POLL_SEC)
+                if not result.ready():
+                    for j, other in enumerate(pending):
+                        if results[j] is None and other.ready() and other.successful():
+                            results[j] = other.get()
+                            done += 1
+                    discard_longform_pool("ワーカープロセスが途中で終了した")
+                    pool = None
+                    break
+                if results[i] is None:
+                    results[i] = result.get()
+                    done += 1
+                    report()
+        todo = [i for i, result in enumerate(results) if result is None]
+        if todo:
+            # GPUまたは1ワーカーのときは、1プロセスで区間を順に処理する (区間ごとのメモリで済む)
+            with borrow_alignment_model(phase_model, backend=aligner.name, threads=threads) as model, MODEL_REGISTRY.run_lock(model):
+                for i in todo:
+                    start, end, text = items[i]
+                    results[i] = _run_longform_task(aligner, model, task, audio[int(start * sr):int(end * sr)], text, language)
+                    done += 1
+                    report()
+        return results
+
+    chunk_items = [(cuts[i], cuts[i + 1], "") for i in range(len(cuts) - 1)]
+    transcripts = run_phase("transcribe", LONGFORM_COARSE_MODEL, chunk_items, "書き起こし")
+    words = [word for (start, _, _), segments in zip(chunk_items, transcripts)
+             for seg in segments for word in _shift_segment(seg, start)["words"]]
+    spans = anchor_line_spans(lines, words, duration)
+    if spans is None:
+        print("[WARN] 書き起こしと台本がほとんど一致しないため、文字数の比率で台本を割り振ります。")
+        spans = estimate_line_spans(lines, speech)
+    jobs = plan_longform_jobs(cuts, spans, lines, duration, silences)
+    aligned = run_phase("align", model_name, [(job["offset"], job["end"], job["text"]) for job in jobs], "アラインメント")
+    for job, segments in zip(jobs, aligned):
+        job["segments"] = segments
+    return LongformAlignmentResult(merge_longform_segments(cuts, jobs, len(lines)))
+
+
+def self_test_longform() -> List[str]:
+    """境界が分かっている合成データで、台本の割り振りと区間の統合を検査し、失敗の説明を返す"""
+    failures = []
+    # 区間 [0,10) と [10,20) に3行ずつ。互いに相手の担当行を1行ずつ誤った時刻で返す
+    truth = [1.0, 4.0, 8.0, 12.0, 15.0, 18.0]
+    def seg(start: float, offset: float, probability: float) -> Dict[str, Any]:
+        return {"start": start - offset, "end": start - offset + 1.0, "text": "",
+                "words": [{"word": "", "start": start - offset, "end": start - offset + 1.0, "probability": probability}]}
+    jobs = [
+        {"index": 0, "offset": 0.0, "line_start": 0, "line_end": 4, "own_start": 0, "own_end": 3,
+         "segments": [seg(t, 0.0, 0.9) for t in truth[:3]] + [seg(9.5, 0.0, 0.2)]},
+        {"index": 1, "offset": 7.0, "line_start": 2, "line_end": 6, "own_start": 3, "own_end": 6,
+         "segments": [seg(10.0, 7.0, 0.95)] + [seg(t, 7.0, 0.9) for t in truth[3:]]},
+    ]
+    merged = merge_longform_segments([0.0, 10.0, 20.0], jobs, len(truth))
+    if [s["start"] for s in merged] != truth:
+        failures.append(f"行ごとの統合: {[s['start'] for s in merged]} != {truth}")
+    jobs[1]["segments"] = jobs[1]["segments"][1:]  # 行数が合わない区間 → 時刻で統合
+    merged = merge_longform_segments([0.0, 10.0, 20.0], jobs, len(truth))
+    if [s["start"] for s in merged] != truth:
+        failures.append(f"時刻での統合: {[s['start'] for s in merged]} != {truth}")
+    # 書き起こし (2文字ずつ誤りあり) と台本の突き合わせ
+    rng = np.random.default_rng(0)
+    kana = [chr(c) for c in range(0x3042, 0x3094)]
+    lines = ["".join(rng.choice(kana, int(rng.integers(8, 20)))) for _ in range(60)]
+    words, t, line_starts = [], 0.0, []
+    for line in lines:
+        line_starts.append(t)
+        heard = list(line)
+        for k in rng.choice(len(heard), 2, replace=False):
+            heard[k] = "ー"
+        for ch in heard:
+            words.append({"word": ch, "start": t, "end": t + 0.12})
+            t += 0.12
+        t += float(rng.uniform(0.3, 2.0))
+    spans = anchor_line_spans(lines, words, t)
+    error = np.abs(spans[:, 0] - np.array(line_starts)).max() if spans is not None else float("inf")
+    if error > LONGFORM_AUDIO_PAD_SEC / 2:  # 区間の音声は見積もりの前後にPAD秒ずつ余裕を持たせてある
+        failures.append(f"台本の割り振り: 行の開始時刻の誤差 {error:.2f}秒")
+    return failures
+
+
+# --- 実行記録 (manifest.json) ---
+# 各実行ディレクトリに、入力の情報と段階ごとの経過時間・CPU時間・ピークRSS・出力サイズを残す。
+# CPU時間とRSSはプロセス全体 (子プロセスは終了済みのffmpegの合計/最大) の値のため、
+# 複数ジョブを同時に実行している場合は他のジョブの分も含まれる。
+# process_peak_rss_mb はプロセス起動からその段階の終了までの最大値で、段階ごとのピークではない。
+# 段階の中で別の段階を計測した場合 (アラインメント中の音声デコードなど)、外側の時間からは内側の分を差し引く。
+RUN_MANIFEST_NAME = "manifest.json"
+RUN_MANIFEST_VERSION = 2
+
+
+def describe_file(path: Optional[str]) -> Optional[Dict[str, Any]]:
+    """ファイルのサイズと、メディアであれば長さ・解像度・ビットレートを返す"""
+    if not path or not os.path.exists(path):
+        return None
+    info: Dict[str, Any] = {"path": str(path), "size_bytes": os.path.getsize(path)}
+    if Path(path).suffix.lower() in {".txt", ".ass", ".json", ".srt"}:
+        return info
+    try:
+        media = probe_media(str(path))
+    except Exception:
+        return info
+    info.update(duration_sec=media.duration, width=media.width or None, height=media.height or None,
+                video_codec=media.video_codec, audio_codec=media.audio_codec)
+    if media.duration:
+        info["bitrate_kbps"] = round(info["size_bytes"] * 8 / media.duration / 1000, 1)
+    return info
+
+
+def _resource_snapshot() -> Dict[str, float]:
+    import resource
+    own, children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    try:
+        with open("/proc/self/statm", "r") as f:
+            rss_mb = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        rss_mb = 0.0
+    return {
+        "wall": time.perf_counter(),
+        "cpu": own.ru_utime + own.ru_stime,
+        "children_cpu": children.ru_utime + children.ru_stime,
+        "rss_mb": rss_mb,
+        # Linuxのru_maxrssはKB単位
+        "process_peak_rss_mb": own.ru_maxrss / 1024,
+        "children_process_peak_rss_mb": children.ru_maxrss / 1024,
+    }
+
+
+class RunManifest:
+    """1回の実行の記録。stage() で各段階を計測し、save() で実行ディレクトリに書き出す"""
+
+    def __init__(self, run_dir: Path, mode: str, inputs: Dict[str, Optional[str]], settings: Dict[str, Any]):
+        self.path = Path(run_dir) / RUN_MANIFEST_NAME
+        self._origin = _resource_snapshot()
+        self._active: List[Dict[str, Any]] = []
+        self.data: Dict[str, Any] = {
+            "version": RUN_MANIFEST_VERSION,
+            "mode": mode,
+            "started_at": datetime.datetime.now().isoformat(timespec="seconds"),
+            "inputs": {key: describe_file(path) for key, path in inputs.items() if path},
+            "settings": settings,
+            "stages": [],
+            "outputs": {},
+            "status": "running",
+        }
+        # 実行中であることを prune_runs() に伝えるため、最初の段階を始める前に書き出しておく
+        self.save()
+
+    @contextmanager
+    def stage(self, name: str):
+        """with文の中の処理を1段階として計測する。yieldした辞書の "outputs" に出力パスを入れると大きさも記録する"""
+        record: Dict[str, Any] = {"name": name, "outputs": []}
+        parent = self._active[-1] if self._active else None
+        nested = {"wall": 0.0, "cpu": 0.0, "children_cpu": 0.0}
+        self._active.append(record)
+        before = _resource_snapshot()
+        record["started_at_sec"] = round(before["wall"] - self._origin["wall"], 3)
+        if parent is not None:
+            record["nested_in"] = parent["name"]
+        try:
+            yield record
+            record["status"] = "ok"
+        except Exception as e:
+            record["status"] = "error"
+            record["error"] = str(e)
+            raise
+        finally:
+            after = _resource_snapshot()
+            self._active.remove(record)
+            spent = {key: after[key] - before[key] for key in nested}
+            if parent is not None:
+                parent_nested = parent.setdefault("_nested", {key: 0.0 for key in nested})
+                for key in nested:
+                    parent_nested[key] += spent[key]
+            nested = record.pop("_nested", nested)
+            record.update(
+                wall_sec=round(spent["wall"] - nested["wall"], 3),
+                cpu_sec=round(spent["cpu"] - nested["cpu"], 3),
+                children_cpu_sec=round(spent["children_cpu"] - nested["children_cpu"], 3),
+                rss_mb=round(after["rss_mb"], 1),
+                process_peak_rss_mb=round(after["process_peak_rss_mb"], 1),
+                children_process_peak_rss_mb=round(after["children_process_peak_rss_mb"], 1),
+                outputs=[describe_file(path) for path in record["outputs"] if path],
+            )
+            self.data["stages"].append(record)
+            # 段階ごとに保存し直して、実行フォルダの更新時刻を新しく保つ (長い実行が古いものと判定されないように)
+            self.save()
+
+    def finish(self, outputs: Dict[str, Optional[str]], error: Optional[BaseException] = None) -> None:
+        end = _resource_snapshot()
+        self.data.update(
+            finished_at=datetime.datetime.now().isoformat(timespec="seconds"),
+            status="error" if error else "ok",
+            total_wall_sec=round(end["wall"] - self._origin["wall"], 3),
+            outputs={key: describe_file(path) for key, path in outputs.items() if path},
+        )
+        if error:
+            self.data["error"] = str(error)
+        self.save()
+
+    def save(self) -> None:
+        tmp_path = self.path.with_suffix(".json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+        print(f"[DEBUG] 実行記録を保存しました: {self.path}")
+
+
+# --- レンダリング進捗の通知 ---
+# ffmpegの -progress 出力 (出力時刻・fps) を出力全体の長さに対する割合へ換算し、
+# Gradioの進捗バーとログに処理速度と残り時間を出す。分割並列レンダリングでは区間ごとの進み具合を合算する。
+PROGRESS_LOG_INTERVAL_SEC = 10
+
+
+def format_eta(sec: Optional[float]) -> str:
+    if sec is None:
+        return "--:--"
+    sec = int(round(sec))
+    return f"{sec // 3600}:{sec % 3600 // 60:02d}:{sec % 60:02d}" if sec >= 3600 else f"{sec // 60}:{sec % 60:02d}"
+
+
+class RenderProgress:
+    """ffmpegの進捗を受け取り、進捗率・fps・速度倍率・残り時間を通知する"""
+
+    def __init__(self, progress: Optional[Callable[..., Any]], total_sec: float, label: str):
+        self.progress = progress
+        self.total_sec = max(float(total_sec or 0.0), 1e-6)
+        self.label = label
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        """途中まで進んだ集計を捨てて最初から数え直す (失敗したレンダリングを別の方式でやり直すとき)"""
+        with self._lock:
+            self._parts: Dict[int, Dict[str, float]] = {}
+            self._sharded = False
+            self._started = time.monotonic()
+            self._last_log = self._started
+
+    def __call__(self, stats: Dict[str, float]) -> None:
+        self._update(0, stats)
+
+    def part(self, index: int) -> Callable[[Dict[str, float]], None]:
+        """分割レンダリングの区間ごとのコールバックを返す"""
+        self._sharded = True
+        return lambda stats: self._update(index, stats)
+
+    def _update(self, index: int, stats: Dict[str, float]) -> None:
+        with self._lock:
+            # 終了時の報告は最後の映像フレームの時刻になることがあるため、出力時刻は後戻りさせない
+            previous = self._parts.get(index)
+            if previous:
+                stats = {**stats, "out_time": max(stats["out_time"], previous["out_time"])}
+            self._parts[index] = stats
+            done_sec = min(sum(p["out_time"] for p in self._parts.values()), self.total_sec)
+            if stats["done"] and not self._sharded:
+                done_sec = self.total_sec
+            fps = sum(p["fps"] for p in self._parts.values() if not p["done"])
+            now = time.monotonic()
+            elapsed = max(now - self._started, 1e-6)
+            fraction = done_sec / self.total_sec
+            eta = elapsed * (1 - fraction) / fraction if fraction > 0 else None
+            desc = f"{self.label} {fraction:.0%} | {fps:.0f}fps | {done_sec / elapsed:.2f}x | 残り {format_eta(eta)}"
+            if now - self._last_log >= PROGRESS_LOG_INTERVAL_SEC:
+                self._last_log = now
+                print(f"[INFO] {desc}")
+        if self.progress:
+            self.progress(fraction, desc=desc)
+
+
+# --- ジョブの同時実行制御 ---
+# アラインメントとエンコードにそれぞれ同時実行数の上限を設け、到着順に受け付ける。
+# 各ジョブのffmpeg/torchのスレッド数はコア数を同時実行数で割った値に抑え、
+# 待機中のジョブには順番と予想待ち時間を進捗バーで知らせる。
+CPU_COUNT = os.cpu_count() or 1
+ALIGN_MAX_CONCURRENT = 1
+ENCODE_MAX_CONCURRENT = max(1, CPU_COUNT // 4)
+# Gradioが同時に受け付ける生成ジョブ数 (超えた分はGradioのキューで待つ)
+JOB_MAX_ACTIVE = 8
+JOB_ESTIMATE_DEFAULT_SEC = {"align": 60.0, "encode": 120.0}
+
+
+def new_job_id() -> str:
+    return uuid.uuid4().hex[:8]
+
+
+def new_run_dir(kind: str) -> Path:
+    """ジョブごとに一意な実行ディレクトリのパスを返す (同じ秒に開始したジョブでも衝突しない)。
+    あわせて保持期間を過ぎた実行フォルダを削除する"""
+    try:
+        prune_runs()
+    except Exception as e:
+        print(f"[WARN] 古い実行フォルダの削除に失敗しました: {e}")
+    return RUNS_DIR / f"{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}_{new_job_id()}_{kind}"
+
+
+class _AdmissionQueue:
+    """上限付きの到着順受付。待ち順と所要時間の移動平均から予想待ち時間を出す"""
+
+    def __init__(self, name: str, capacity: int):
+        self.name = name
+        self.capacity = max(1, capacity)
+        self.running = 0
+        self.waiting: List[str] = []
+        self.avg_sec = JOB_ESTIMATE_DEFAULT_SEC.get(name, 60.0)
+        self.cond = threading.Condition()
+
+    def expected_wait(self, position: int) -> float:
+        return (position // self.capacity + 1) * self.avg_sec
+
+    def record(self, elapsed: float) -> None:
+        with self.cond:
+            self.avg_sec = 0.7 * self.avg_sec + 0.3 * elapsed
+
+
+class JobScheduler:
+    """アラインメント/エンコードの同時実行数とジョブごとのスレッド数を管理する"""
+
+    def __init__(self, align_limit: int, encode_limit: int):
+        self.queues = {"align": _AdmissionQueue("align", align_limit), "encode": _AdmissionQueue("encode", encode_limit)}
+
+    def threads_for(self, kind: str) -> int:
+        """1ジョブに割り当てるスレッド数"""
+        return max(1, CPU_COUNT // self.queues[kind].capacity)
+
+    @contextmanager
+    def admit(self, kind: str, label: str = "", progress: Optional[Callable[..., Any]] = None):
+        """順番が来るまで待ってから with 文の中を実行する。待機中は順番と予想待ち時間を progress に通知する"""
+        queue = self.queues[kind]
+        ticket = new_job_id()
+        with queue.cond:
+            queue.waiting.append(ticket)
+            last_position = None
+            while queue.waiting.index(ticket) > 0 or queue.running >= queue.capacity:
+                position = queue.waiting.index(ticket) + 1
+                if position != last_position:
+                    last_position = position
+                    desc = f"{label}待機中: {position}番目 (予想待ち時間 {format_eta(queue.expected_wait(position - 1))})"
+                    print(f"[INFO] {desc}")
+                    if progress:
+                        progress(0, desc=desc)
+                queue.cond.wait(timeout=1.0)
+            queue.waiting.remove(ticket)
+            queue.running += 1
+            queue.cond.notify_all()
+        started = time.monotonic()
+        try:
+            if kind == "align":
+                apply_torch_thread_budget(self.threads_for("align"))
+            yield self.threads_for(kind)
+        finally:
+            queue.record(time.monotonic() - started)
+            with queue.cond:
+                queue.running -= 1
+                queue.cond.notify_all()
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        return {kind: {"running": q.running, "waiting": len(q.waiting), "capacity": q.capacity, "avg_sec": round(q.avg_sec, 1)}
+                for kind, q in self.queues.items()}
+
+
+def apply_torch_thread_budget(threads: int) -> None:
+    """torchのCPUスレッド数を予算に合わせる (プロセス全体の設定)"""
+    try:
+        import torch
+    except ImportError:
+        return
+    if torch.get_num_threads() != threads:
+        torch.set_num_threads(threads)
+        print(f"[DEBUG] torchのスレッド数を {threads} に設定しました。")
+
+
+def encode_thread_opts() -> List[str]:
+    """エンコードするffmpegコマンドに付けるスレッド数の指定"""
+    return ["-threads", str(JOB_SCHEDULER.threads_for("encode"))]
+
+
+_ffmpeg_has_fps_mode: Optional[bool] = None
+
+
+def fps_mode_opts(mode: str) -> List[str]:
+    """フレームの複製・間引き方式の指定。-vsync は非推奨のため、-fps_mode (FFmpeg 5.1以降) が使えればそちらを使う"""
+    global _ffmpeg_has_fps_mode
+    if _ffmpeg_has_fps_mode is None:
+        try:
+            help_text = subprocess.run(["ffmpeg","-hide_banner","-h","long"], capture_output=True, text=True).stdout
+            _ffmpeg_has_fps_mode = "-fps_mode" in help_text
+        except OSError:
+            _ffmpeg_has_fps_mode = True
+    return ["-fps_mode" if _ffmpeg_has_fps_mode else "-vsync", mode]
+
+
+JOB_SCHEDULER = JobScheduler(ALIGN_MAX_CONCURRENT, ENCODE_MAX_CONCURRENT)
+
+
+# --- プレビュー要求の間引き ---
+# スライダー操作で大量に発生するプレビュー要求をセッション単位でまとめ、
+# 待機中に新しい要求が来た古い要求は描画せずに捨てる。
+PREVIEW_DEBOUNCE_SEC = 0.15
+PREVIEW_CONCURRENCY_LIMIT = 4
+
+
+class PreviewCoalescer:
+    """セッションごとに最新の設定だけを描画するプレビュー関数のラッパー"""
+
+    def __init__(self, render_fn: Callable[..., Any], debounce_sec: float = PREVIEW_DEBOUNCE_SEC, n_outputs: int = 1):
+        self.render_fn = render_fn
+        self.debounce_sec = debounce_sec
+        self.n_outputs = n_outputs
+        # セッションごとの状態は処理中の要求がある間だけ持ち、最後の要求が終わったら捨てる (閉じたタブの分が溜まらない)
+        self._generations: Dict[str, int] = {}
+        self._session_locks: Dict[str, threading.Lock] = {}
+        self._in_flight: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _is_stale(self, session_key: str, generation: int) -> bool:
+        with self._lock:
+            return self._generations.get(session_key) != generation
+
+    def _unchanged(self) -> Any:
+        return gr.update() if self.n_outputs == 1 else tuple(gr.update() for _ in range(self.n_outputs))
+
+    def __call__(self, session_key: str, *args):
+        with self._lock:
+            generation = self._generations.get(session_key, 0) + 1
+            self._generations[session_key] = generation
+            session_lock = self._session_locks.setdefault(session_key, threading.Lock())
+            self._in_flight[session_key] = self._in_flight.get(session_key, 0) + 1
+        try:
+            time.sleep(self.debounce_sec)
+            if self._is_stale(session_key, generation):
+                return self._unchanged()
+            # 同一セッションの描画は1本ずつ。待っている間に追い越された要求は描画しない
+            with session_lock:
+                if self._is_stale(session_key, generation):
+                    return self._unchanged()
+                return self.render_fn(*args)
+        finally:
+            self._release(session_key)
+
+    def _release(self, session_key: str) -> None:
+        with self._lock:
+            remaining = self._in_flight[session_key] - 1
+            if remaining:
+                self._in_flight[session_key] = remaining
+                return
+            # 処理中の要求が無ければ世代を比べる相手もいないので、次の要求は新しい状態から始めてよい
+            del self._in_flight[session_key]
+            self._generations.pop(session_key, None)
+            self._session_locks.pop(session_key, None)
+
+
+def preview_session_key(request: Optional["gr.Request"]) -> str:
+    return getattr(request, "session_hash", None) or "default"
+
+
+# ノートブック名の入力中はキー入力ごとに一覧を引かず、入力が止まってから両タブの一覧をまとめて更新する
+preset_refresh_coalescer = PreviewCoalescer(
+    lambda notebook_name: (handle_preset_refresh(notebook_name, "podcast"), handle_preset_refresh(notebook_name, "subtitler")),
+    PRESET_REFRESH_DEBOUNCE_SEC, n_outputs=2
+)
+
+
+def handle_notebook_name_change(request: gr.Request, notebook_name: str):
+    return preset_refresh_coalescer(preview_session_key(request), notebook_name)
+
+
+# --- 一時ファイルと実行フォルダの管理 ---
+# プレビュー画像・背景フレーム・速度プレビューなどの中間ファイルは、すべてスクラッチ領域の
+# 区分ごとのサブディレクトリに置き、合計容量が上限を超えたら最後に使われたのが古いものから削除する。
+# 完了した実行フォルダ (runs/) は件数・日数・合計容量の保持ルールで古い順に削除する。
+SCRATCH_DIR = Path(tempfile.gettempdir()) / "subtitle_tool_scratch"
+SCRATCH_MAX_MB = 1024
+SCRATCH_MIN_AGE_SEC = 120      # 作成・使用から間もないファイルは、呼び出し元がまだ読むため削除しない
+SCRATCH_STALE_TMP_SEC = 3600   # 書き込み途中 (*.tmp*) のまま残ったファイルを削除するまでの時間
+RUNS_DIR = Path.cwd() / "runs"
+RUNS_KEEP_COUNT = 20           # 完了した実行フォルダを新しい順に何件残すか (0 = 無制限)
+RUNS_KEEP_DAYS = 7             # これより古い実行フォルダは削除する (0 = 無制限)
+RUNS_MAX_MB = 20 * 1024        # 実行フォルダの合計容量の上限 (0 = 無制限)
+RUNS_STALE_RUNNING_HOURS = 24  # 実行中のまま更新が止まったフォルダを完了扱いにするまでの時間
+
+
+class ScratchManager:
+    """中間ファイルを区分ごとのサブディレクトリで管理し、合計容量を上限内に保つ。
+    使用順はメモリ上で管理するので、ファイル数が増えても追加・参照のたびにディレクトリを走査しない"""
+
+    def __init__(self, root: Path, max_mb: float):
+        self.root = Path(root)
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._files: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()  # パス -> (サイズ, 最終使用時刻) を古い順に
+        self._total = 0
+        self._scanned = False
+        self._lock = threading.Lock()
+
+    def _scan(self) -> None:
+        """起動後最初の利用時に、前回までに残ったファイルを索引に取り込む (ロックを持って呼ぶ)"""
+        self._scanned = True
+        if not self.root.is_dir():
+            return
+        now, found = time.time(), []
+        for path in self.root.rglob("*"):
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            if not path.is_file():
+                continue
+            if ".tmp" in path.suffixes:
+                if now - st.st_mtime > SCRATCH_STALE_TMP_SEC:
+                    path.unlink(missing_ok=True)
+                continue
+            found.append((st.st_mtime, str(path), st.st_size))
+        for mtime, key, size in sorted(found):
+            self._files[key] = (size, mtime)
+            self._total += size
+
+    def area(self, name: str) -> Path:
+        """区分のディレクトリを返す (無ければ作る)"""
+        directory = self.root / name
+        directory.mkdir(parents=True, exist_ok=True)
+        return directory
+
+    def path(self, area: str, name: str) -> Path:
+        """区分内の決まった名前 (キャッシュキーなど) のパスを返す"""
+        return self.area(area) / name
+
+    def new_path(self, area: str, suffix: str) -> Path:
+        """区分内の一意なパスを返す"""
+        return self.area(area) / f"{uuid.uuid4().hex}{suffix}"
+
+    @staticmethod
+    def tmp_path(path: Path) -> Path:
+        """書き込み途中用のパス。拡張子は残すのでffmpegの出力形式の判定に影響しない"""
+        path = Path(path)
+        return path.with_name(f"{path.stem}.{os.getpid()}.{threading.get_ident()}.tmp{path.suffix}")
+
+    def add(self, path: Any) -> str:
+        """書き終えたファイルを登録し、容量上限を超えていれば古いものから削除する"""
+        key = str(path)
+        size = os.path.getsize(key)
+        with self._lock:
+            if not self._scanned:
+                self._scan()
+            old = self._files.pop(key, None)
+            if old:
+                self._total -= old[0]
+            self._files[key] = (size, time.time())
+            self._total += size
+            self._evict(keep=key)
+        return key
+
+    def touch(self, path: Any) -> bool:
+        """キャッシュ済みのファイルを使ったことを記録する。消えていれば False"""
+        key = str(path)
+        if not os.path.exists(key):
+            with self._lock:
+                old = self._files.pop(key, None)
+                if old:
+                    self._total -= old[0]
+            return False
+        with self._lock:
+            if not self._scanned:
+                self._scan()
+            entry = self._files.pop(key, None)
+            if entry is None:
+                entry = (os.path.getsize(key), 0.0)
+                self._total += entry[0]
+            self._files[key] = (entry[0], time.time())
+        return True
+
+    def _evict(self, keep: str) -> None:
+        """合計が上限以下になるまで古いファイルを削除する (ロックを持って呼ぶ)"""
+        protect_after = time.time() - SCRATCH_MIN_AGE_SEC
+        for key in list(self._files):
+            if self._total <= self.max_bytes:
+                break
+            size, last_used = self._files[key]
+            if last_used > protect_after:
+                break
+            if key == keep:
+                continue
+            try:
+                os.remove(key)
+                print(f"[DEBUG] 一時ファイルを削除 (容量上限): {key}")
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"[WARN] 一時ファイルを削除できません: {key}: {e}")
+                continue
+            del self._files[key]
+            self._total -= size
+
+    def usage(self) -> Dict[str, float]:
+        with self._lock:
+            if not self._scanned:
+                self._scan()
+            return {"files": len(self._files), "mb": round(self._total / (1024 * 1024), 1), "max_mb": round(self.max_bytes / (1024 * 1024), 1)}
+
+
+SCRATCH = ScratchManager(SCRATCH_DIR, SCRATCH_MAX_MB)
+
+
+def _dir_size(path: Path) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def _run_is_active(run_dir: Path, mtime: float) -> bool:
+    """実行記録が実行中で、最近更新されているなら True (別プロセスのバッチ実行も対象)"""
+    try:
+        with open(run_dir / RUN_MANIFEST_NAME, "r", encoding="utf-8") as f:
+            status = json.load(f).get("status")
+    except (OSError, ValueError):
+        return False
+    return status == "running" and time.time() - mtime < RUNS_STALE_RUNNING_HOURS * 3600
+
+
+def prune_runs(runs_dir: Optional[Path] = None) -> int:
+    """完了した実行フォルダを保持ルール (件数・日数・合計容量) に従って古い順に削除し、削除した数を返す"""
+    runs_dir = Path(runs_dir or RUNS_DIR)
+    if not runs_dir.is_dir():
+        return 0
+    runs = []
+    for path in runs_dir.iterdir():
+        # _align_cache や _bench_media などの共有ディレクトリは対象外
+        if path.name.startswith("_") or not path.is_dir():
+            continue
+        try:
+            runs.append((path.stat().st_mtime, path))
+        except FileNotFoundError:
+            continue
+    cutoff = time.time() - RUNS_KEEP_DAYS * 86400 if RUNS_KEEP_DAYS else None
+    budget = RUNS_MAX_MB * 1024 * 1024 if RUNS_MAX_MB else None
+    kept, kept_bytes, removed = 0, 0, 0
+    for mtime, path in sorted(runs, reverse=True):
+        if _run_is_active(path, mtime):
+            continue
+        size = _dir_size(path) if budget else 0
+        if (RUNS_KEEP_COUNT and kept >= RUNS_KEEP_COUNT) or (cutoff and mtime < cutoff) or (budget and kept_bytes + size > budget):
+            shutil.rmtree(path, ignore_errors=True)
+            removed += 1
+            print(f"[DEBUG] 古い実行フォルダを削除しました: {path.name}")
+        else:
+            kept += 1
+            kept_bytes += size
+    if removed:
+        print(f"[INFO] 実行フォルダを{removed}件削除しました (残り{kept}件, {kept_bytes / (1024 * 1024):.0f}MB)")
+    return removed
+
+
+# --- プレビュー背景フレームのキャッシュ ---
+# 動画が変わらない限り、ffprobe とフレーム抽出はファイルごとに1回だけ行う。
+# (パス, サイズ, mtime, タイムスタンプ) をキーにメモリとスクラッチ領域へ保存する。
+PREVIEW_FRAME_TIMESTAMP = "00:00:01"
+PREVIEW_FRAME_SCRATCH_AREA = "frames"
+PREVIEW_FRAME_MEMORY_ITEMS = 16
+_preview_frame_memo: "OrderedDict[Tuple[Any, ...], Tuple[str, int, int]]" = OrderedDict()
+_preview_frame_lock = threading.Lock()
+
+
+def _remember_preview_frame(key: Tuple[Any, ...], frame: Tuple[str, int, int]) -> Tuple[str, int, int]:
+    with _preview_frame_lock:
+        _preview_frame_memo[key] = frame
+        _preview_frame_memo.move_to_end(key)
+        while len(_preview_frame_memo) > PREVIEW_FRAME_MEMORY_ITEMS:
+            _preview_frame_memo.popitem(last=False)
+    return frame
+
+
+def _lookup_preview_frame(key: Tuple[Any, ...]) -> Optional[Tuple[str, int, int]]:
+    with _preview_frame_lock:
+        frame = _preview_frame_memo.get(key)
+    if frame and SCRATCH.touch(frame[0]):
+        with _preview_frame_lock:
+            _preview_frame_memo.move_to_end(key)
+        return frame
+    cache_name = hashlib.sha256(repr(key).encode("utf-8")).hexdigest()[:32]
+    png_path = SCRATCH.path(PREVIEW_FRAME_SCRATCH_AREA, f"{cache_name}.png")
+    meta_path = png_path.with_suffix(".json")
+    if meta_path.exists() and SCRATCH.touch(png_path):
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        return _remember_preview_frame(key, (str(png_path), meta["w"], meta["h"]))
+    return None
+
+
+def _store_preview_frame(key: Tuple[Any, ...], tmp_png: str, w: int, h: int) -> Tuple[str, int, int]:
+    cache_name = hashlib.sha256(repr(key).encode("utf-8")).hexdigest()[:32]
+    png_path = SCRATCH.path(PREVIEW_FRAME_SCRATCH_AREA, f"{cache_name}.png")
+    meta_path = png_path.with_suffix(".json")
+    meta_path.write_text(json.dumps({"w": w, "h": h}), encoding="utf-8")
+    os.replace(tmp_png, png_path)
+    SCRATCH.add(meta_path)
+    SCRATCH.add(png_path)
+    return _remember_preview_frame(key, (str(png_path), w, h))
+
+
+def get_black_frame(w: int, h: int) -> Tuple[str, int, int]:
+    """指定サイズの黒背景PNGを返す (初回のみ生成)"""
+    key = ("black", w, h)
+    frame = _lookup_preview_frame(key)
+    if frame:
+        return frame
+    tmp_png = str(ScratchManager.tmp_path(SCRATCH.path(PREVIEW_FRAME_SCRATCH_AREA, "black.png")))
+    Image.new("RGB", (w, h), (0, 0, 0)).save(tmp_png)
+    return _store_preview_frame(key, tmp_png, w, h)
+
+
+def get_preview_background_frame(video_path: str, timestamp: str = PREVIEW_FRAME_TIMESTAMP) -> Tuple[str, int, int]:
+    """動画から抽出したプレビュー背景フレームのパスとサイズ(W,H)を返す"""
+    st = os.stat(video_path)
+    key = (os.path.abspath(video_path), st.st_size, st.st_mtime_ns, timestamp)
+    frame = _lookup_preview_frame(key)
+    if frame:
+        print(f"[DEBUG] キャッシュ済みの背景フレームを使用: {video_path} ({frame[1]}x{frame[2]})")
+        return frame
+    w, h = subtitler_get_video_size(video_path)
+    tmp_png = str(ScratchManager.tmp_path(SCRATCH.path(PREVIEW_FRAME_SCRATCH_AREA, "extract.png")))
+    run_chk(["ffmpeg","-y","-ss",timestamp,"-i",video_path,"-frames:v","1", "-loglevel", "error", tmp_png])
+    print(f"[DEBUG] 動画ファイルからフレームを抽出: {video_path} ({w}x{h})")
+    return _store_preview_frame(key, tmp_png, w, h)
+
+
+# --- 速度プレビュー音声のキャッシュ ---
+# 入力側シークした1回のffmpegで切り出しと速度変更を行い、
+# (音声の内容ハッシュ, 速度, 区間, 形式) ごとにスクラッチ領域へ保存する。
+SPEED_PREVIEW_WINDOW_SEC = 30
+SPEED_PREVIEW_FORMAT = "m4a"  # "wav" にすると無圧縮で出力する
+SPEED_PREVIEW_SCRATCH_AREA = "speed_previews"
+SPEED_PREVIEW_CODECS: Dict[str, List[str]] = {
+    "wav": ["-c:a", "pcm_s16le"],
+    "m4a": ["-c:a", "aac", "-b:a", "96k", "-movflags", "+faststart"],
+    "ogg": ["-c:a", "libopus", "-b:a", "64k"],
+}
+
+
+def _file_path(file_obj: Any) -> Optional[str]:
+    """Gradioのファイル入力 (パス文字列またはファイルオブジェクト) からパスを取り出す"""
+    if not file_obj:
+        return None
+    return file_obj if isinstance(file_obj, str) else getattr(file_obj, "name", None)
+
+
+def get_speed_preview(source_path: str, speed: float, start_sec: float = 0.0,
+                      window_sec: float = SPEED_PREVIEW_WINDOW_SEC, fmt: str = SPEED_PREVIEW_FORMAT) -> str:
+    """音声/動画の指定区間を指定速度にした音声ファイルのパスを返す (キャッシュ済みなら再利用)"""
+    # atempoフィルターは0.5から2.0の範囲で動作するため、範囲外の値はクリップする
+    safe_speed = max(0.5, min(2.0, float(speed)))
+    raw_key = "|".join([file_content_hash(source_path), f"{safe_speed:.3f}", f"{start_sec:.3f}", f"{window_sec:.3f}", fmt])
+    out_path = SCRATCH.path(SPEED_PREVIEW_SCRATCH_AREA, f"{hashlib.sha256(raw_key.encode('utf-8')).hexdigest()[:32]}.{fmt}")
+    if SCRATCH.touch(out_path):
+        print(f"[DEBUG] キャッシュ済みの速度プレビューを使用: {out_path.name}")
+        return str(out_path)
+    tmp_path = ScratchManager.tmp_path(out_path)
+    cmd = ["ffmpeg","-y","-ss",f"{start_sec:.3f}","-t",f"{window_sec:.3f}","-i",source_path,
+           "-vn","-af",f"atempo={safe_speed}"] + SPEED_PREVIEW_CODECS[fmt] + ["-f", "mp4" if fmt == "m4a" else fmt,
+           "-loglevel","error", str(tmp_path)]
+    print(f"[DEBUG] FFmpeg 音声プレビューコマンド実行: {' '.join(cmd)}")
+    try:
+        run_chk(cmd)
+        os.replace(tmp_path, out_path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+    return SCRATCH.add(out_path)
+
+
+# --- プレビュー用のインプロセス字幕描画 ---
+# スライダー操作のたびに ffmpeg を起動せず、生成したASSのDEFスタイルを
+# Pillow/NumPy でキャッシュ済み背景に直接描画して画像配列を返す。
+# libassと同じ解釈 (Fontsize=行の高さ, 色の&HAABBGGRR, 配置の1-9, 各マージン) に合わせている。
+PREVIEW_RENDERER = "pillow"  # "ffmpeg" にすると従来どおりlibassで描画する
+PREVIEW_BACKGROUND_MEMORY_ITEMS = 4
+_font_file_memo: Dict[Tuple[str, bool, bool], Tuple[str, int]] = {}
+_font_memo: Dict[Tuple[str, int, int], Any] = {}
+_background_array_memo: "OrderedDict[Tuple[str, int, int], np.ndarray]" = OrderedDict()
+_render_memo_lock = threading.Lock()
+
+
+def resolve_font_file(family: str, bold: bool = False, italic: bool = False) -> Tuple[str, int]:
+    """fontconfigでフォントファミリー名を (ファイルパス, フェイス番号) に解決する"""
+    key = (family, bool(bold), bool(italic))
+    with _render_memo_lock:
+        if key in _font_file_memo:
+            return _font_file_memo[key]
+    pattern = f"{family}:weight={'bold' if bold else 'regular'}:slant={'italic' if italic else 'roman'}"
+    out = subprocess.check_output(["fc-match", "-f", "%{file}|%{index}", pattern]).decode("utf-8").strip()
+    path, _, index = out.partition("|")
+    resolved = (path, int(index or 0))
+    with _render_memo_lock:
+        _font_file_memo[key] = resolved
+    return resolved
+
+
+def load_ass_font(family: str, bold: bool, italic: bool, cell_height: float):
+    """ASSのFontsize (アセンダ+ディセンダの高さ) に合うサイズでフォントを読み込む"""
+    from PIL import ImageFont
+    path, index = resolve_font_file(family, bold, italic)
+    key = (path, index, int(round(cell_height * 4)))
+    with _render_memo_lock:
+        font = _font_memo.get(key)
+    if font is None:
+        probe_size = 1000
+        ascent, descent = ImageFont.truetype(path, probe_size, index=index).getmetrics()
+        size = max(1.0, cell_height * probe_size / max(1, ascent + descent))
+        try:
+            # libassは端数のあるサイズのまま描画するため、整数に丸めると行幅が最大で1%ほど変わる (Pillow 10.1以降)
+            font = ImageFont.truetype(path, size, index=index)
+        except (TypeError, ValueError):
+            font = ImageFont.truetype(path, int(round(size)), index=index)
+        with _render_memo_lock:
+            _font_memo[key] = font
+    return font
+
+
+def load_background_array(path: str) -> np.ndarray:
+    """背景画像をRGBのuint8配列として返す ((パス, サイズ, mtime) ごとにメモ化)"""
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    with _render_memo_lock:
+        array = _background_array_memo.get(key)
+        if array is not None:
+            _background_array_memo.move_to_end(key)
+            return array
+    with Image.open(path) as img:
+        array = np.asarray(img.convert("RGB"))
+    array.setflags(write=False)
+    with _render_memo_lock:
+        _background_array_memo[key] = array
+        while len(_background_array_memo) > PREVIEW_BACKGROUND_MEMORY_ITEMS:
+            _background_array_memo.popitem(last=False)
+    return array
+
+
+def ass_color_to_rgba(value: str) -> Tuple[int, int, int, int]:
+    """&HAABBGGRR を (R,G,B,不透明度) に変換する"""
+    digits = value.strip().upper().lstrip("&H").rstrip("&").rjust(8, "0")[-8:]
+    a, b, g, r = (int(digits[i:i + 2], 16) for i in range(0, 8, 2))
+    return r, g, b, 255 - a
+
+
+def parse_ass_for_preview(ass_text: str, at_time: float = 0.0) -> Tuple[Tuple[int, int], Dict[str, str], List[str]]:
+    """ASSテキストから PlayRes, DEFスタイル, 指定時刻に表示されるイベントの本文を取り出す"""
+    play_res = [1920, 1080]
+    style_format: List[str] = []
+    event_format: List[str] = []
+    style: Dict[str, str] = {}
+    texts: List[str] = []
+    section = ""
+    for raw in ass_text.splitlines():
+        line = raw.strip()
+        if line.startswith("[") and line.endswith("]"):
+            section = line.lower()
+            continue
+        key, sep, value = line.partition(":")
+        if not sep:
+            continue
+        value = value.strip()
+        if section == "[script info]" and key in ("PlayResX", "PlayResY"):
+            play_res[0 if key == "PlayResX" else 1] = int(value)
+        elif section == "[v4+ styles]" and key == "Format":
+            style_format = [f.strip() for f in value.split(",")]
+        elif section == "[v4+ styles]" and key == "Style":
+            fields = value.split(",", len(style_format) - 1)
+            if fields[0] == "DEF" or not style:
+                style = dict(zip(style_format, fields))
+        elif section == "[events]" and key == "Format":
+            event_format = [f.strip() for f in value.split(",")]
+        elif section == "[events]" and key == "Dialogue":
+            fields = dict(zip(event_format, value.split(",", len(event_format) - 1)))
+            h, m, sec = fields["Start"].split(":")
+            start = int(h) * 3600 + int(m) * 60 + float(sec)
+            h, m, sec = fields["End"].split(":")
+            end = int(h) * 3600 + int(m) * 60 + float(sec)
+            if start <= at_time < end:
+                texts.append(fields["Text"])
+    return (play_res[0], play_res[1]), style, texts
+
+
+def _ass_text_lines(text: str) -> List[str]:
+    text = re.sub(r"\{[^}]*\}", "", text)
+    return text.replace(r"\h", " ").replace(r"\n", " ").split(r"\N")
+
+
+def render_ass_preview(ass_text: str, background: np.ndarray) -> np.ndarray:
+    """DEFスタイルのイベントを背景配列に描画したRGB配列を返す"""
+    from PIL import ImageDraw
+    (res_x, res_y), style, texts = parse_ass_for_preview(ass_text)
+    img_h, img_w = background.shape[:2]
+    scale_x, scale_y = img_w / res_x, img_h / res_y
+    canvas = Image.fromarray(background).convert("RGBA")
+    if not texts:
+        return np.asarray(canvas.convert("RGB"))
+
+    cell = float(style["Fontsize"]) * scale_y
+    bold, italic = style["Bold"] != "0", style["Italic"] != "0"
+    font = load_ass_font(style["Fontname"], bold, italic, cell)
+    metrics = get_glyph_metrics(style["Fontname"], bold, italic, cell)
+    ascent, descent = font.getmetrics()
+    line_h = ascent + descent
+    spacing = float(style["Spacing"]) * scale_x
+    border_style = int(style["BorderStyle"])
+    outline = float(style["Outline"]) * scale_y
+    shadow = float(style["Shadow"]) * scale_y
+    primary = ass_color_to_rgba(style["PrimaryColour"])
+    outline_c = ass_color_to_rgba(style["OutlineColour"])
+    back_c = ass_color_to_rgba(style["BackColour"])
+    alignment = int(style["Alignment"])
+    margin_l, margin_r = int(style["MarginL"]) * scale_x, int(style["MarginR"]) * scale_x
+    margin_v = int(style["MarginV"]) * scale_y
+
+    lines = [line for text in texts for line in _ass_text_lines(text)]
+    advances = [metrics.advances(line) + spacing for line in lines]
+    widths = [float(adv.sum()) for adv in advances]
+    block_h = line_h * len(lines)
+    if alignment in (1, 2, 3):
+        top = img_h - margin_v - block_h
+    elif alignment in (7, 8, 9):
+        top = margin_v
+    else:
+        top = (img_h - block_h) / 2
+
+    def line_x(width: float) -> float:
+        if alignment in (1, 4, 7):
+            return margin_l
+        if alignment in (3, 6, 9):
+            return img_w - margin_r - width
+        return (margin_l + img_w - margin_r - width) / 2
+
+    def draw_text(draw, x: float, y: float, line: str, adv: np.ndarray, fill, stroke: int = 0, stroke_fill=None) -> None:
+        # 1文字ずつヒンティングなしの送り幅の位置に置く (libassと同じ並べ方)
+        for ch, ch_x in zip(line, x + np.concatenate(([0.0], np.cumsum(adv)[:-1]))):
+            draw.text((float(ch_x), y), ch, font=font, fill=fill, stroke_width=stroke, stroke_fill=stroke_fill)
+
+    def decorate(draw, x: float, y: float, width: float, fill) -> None:
+        thickness = max(1, int(round(line_h / 20)))
+        if style["Underline"] != "0":
+            draw.rectangle([x, y + ascent + thickness, x + width, y + ascent + 2 * thickness], fill=fill)
+        if style["StrikeOut"] != "0":
+            mid = y + ascent - line_h * 0.3
+            draw.rectangle([x, mid, x + width, mid + thickness], fill=fill)
+
+    def text_layer(fill, stroke: int, stroke_fill, dx: float = 0.0, dy: float = 0.0):
+        layer = Image.new("RGBA", canvas.size, (0, 0, 0, 0))
+        draw = ImageDraw.Draw(layer)
+        for i, (line, adv, width) in enumerate(zip(lines, advances, widths)):
+            x, y = line_x(width) + dx, top + i * line_h + dy
+            draw_text(draw, x, y, line, adv, fill, stroke, stroke_fill)
+            decorate(draw, x, y, width, fill)
+        if italic:
+            # CJKフォントには斜体が無いため、libassと同様にベースライン基準で傾ける
+            shear = 0.2
+            layer = layer.transform(layer.size, Image.AFFINE, (1, shear, -shear * (top + ascent), 0, 1, 0), resample=Image.BILINEAR)
+        return layer
+
+    def box_layer(fill, dx: float = 0.0, dy: float = 0.0):
+        layer = Image.new("RGBA", canvas.size, (0, 0, 0, 0))
+        draw = ImageDraw.Draw(layer)
+        for i, width in enumerate(widths):
+            x, y = line_x(width) + dx, top + i * line_h + dy
+            draw.rectangle([x - outline, y - outline, x + width + outline, y + line_h + outline], fill=fill)
+        return layer
+
+    layers = []
+    if border_style == 3:
+        if shadow > 0 and back_c[3]:
+            layers.append(box_layer(back_c, shadow, shadow))
+        if outline_c[3]:
+            layers.append(box_layer(outline_c))
+        layers.append(text_layer(primary, 0, None))
+    else:
+        stroke = int(round(outline))
+        if shadow > 0 and back_c[3]:
+            layers.append(text_layer(back_c, stroke, back_c, shadow, shadow))
+        if stroke and outline_c[3]:
+            layers.append(text_layer(outline_c, stroke, outline_c))
+        layers.append(text_layer(primary, 0, None))
+    for layer in layers:
+        canvas.alpha_composite(layer)
+    return np.asarray(canvas.convert("RGB"))
+
+
+def render_ass_preview_with_ffmpeg(ass_text: str, bg_path: str) -> np.ndarray:
+    """libassで描画したプレビューを配列で返す (比較・フォールバック用)"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        ass_path = os.path.join(tmp_dir, "preview.ass")
+        out_png = os.path.join(tmp_dir, "preview.png")
+        with open(ass_path, "w", encoding="utf-8") as f:
+            f.write(ass_text)
+        safe_ass = ass_path.replace("\\", "/").replace(":", "\\:")
+        run_chk(["ffmpeg", "-y", "-loglevel", "warning", "-i", bg_path, "-vf", f"ass='{safe_ass}'", "-frames:v", "1", out_png])
+        with Image.open(out_png) as img:
+            return np.asarray(img.convert("RGB"))
+
+
+def compare_preview_renderers(ass_text: str, bg_path: str) -> Dict[str, float]:
+    """インプロセス描画とlibass描画の差を測る。字幕の外接矩形のずれと描画量(インク)の比を返す"""
+    background = load_background_array(bg_path).astype(np.int16)
+    ours = render_ass_preview(ass_text, load_background_array(bg_path)).astype(np.int16)
+    reference = render_ass_preview_with_ffmpeg(ass_text, bg_path).astype(np.int16)
+
+    def ink(img: np.ndarray) -> np.ndarray:
+        return np.abs(img - background).max(axis=2)
+
+    def bbox(img: np.ndarray) -> Optional[np.ndarray]:
+        ys, xs = np.nonzero(ink(img) > 0)
+        return np.array([xs.min(), ys.min(), xs.max(), ys.max()]) if len(xs) else None
+
+    ours_box, ref_box = bbox(ours), bbox(reference)
+    if ours_box is None or ref_box is None:
+        offset = 0.0 if ours_box is None and ref_box is None else float("inf")
+    else:
+        offset = float(np.abs(ours_box - ref_box).max())
+    ref_ink = float(ink(reference).sum())
+    return {
+        "mean_abs_diff": float(np.abs(ours - reference).mean()),
+        "bbox_offset_px": offset,
+        "ink_ratio": float(ink(ours).sum()) / ref_ink if ref_ink else 1.0,
+    }
 
 
 
@@ -471,11 +3450,7 @@ def handle_preset_import(uploaded_file, notebook_name: str, preset_type: str):
 
 def podcast_get_img_size(path:str) -> tuple[int,int]:
  """画像または動画のサイズ(W,H)を取得"""
- try:
-    out = subprocess.check_output(["ffprobe","-v","error","-select_streams","v:0","-show_entries","stream=width,height","-of","csv=p=0", path])
-    w, h = map(int, out.decode('utf-8').strip().split(','))
-    return w, h
- except: return (1920, 1080)
+ return probe_display_size(path)
 
 
 
@@ -495,57 +3470,13 @@ def podcast_build_ass_text(
     speed=1.0
 ) -> str:
     """ASSファイルのテキスト内容を生成する (ポッドキャスト用)"""
-    fs = int(h * (fs_pct / 100))
-    mv = int(h * (margin_pct / 100))
-    prim_c = hex_to_ass(txt_col, txt_alpha)
-    if use_bg:
-        border_style = 3
-        out_c_ass = hex_to_ass(bg_col, bg_alpha)
-        back_c = "&HFF000000"
-    else:
-        border_style = 1
-        out_c_ass = hex_to_ass(out_col, 100)
-        if use_shad:
-            back_c = hex_to_ass(out_col, 50)
-        else:
-            back_c = "&HFF000000"
-    bold_f, italic_f = ("-1" if bold else "0"), ("-1" if italic else "0")
-    ul_f, strike_f = ("-1" if ul else "0"), ("-1" if strike else "0")
-    # [BUGFIX] 座布団(use_bg)が有効な場合、縁取り(use_out)の状態に関わらず、
-    # '太さ'(out_w)をASSのOutline値として使用するよう修正。
-    if use_bg:
-        final_out_w = out_w
-        print(f"[DEBUG] podcast_create_ass_content: 座布団が有効なため、'太さ'({out_w})をOutline値として使用します。")
-    else:
-        final_out_w = out_w if use_out else 0
-        print(f"[DEBUG] podcast_create_ass_content: 座布団は無効。縁取り有効({use_out}) -> Outline値は{final_out_w}です。")
-    final_shad_d = shad_d if use_shad else 0
-
-    header = textwrap.dedent(f"""
-[Script Info]
-ScriptType: v4.00+
-PlayResX: {w}
-PlayResY: {h}
-[V4+ Styles]
-Format: Name,Fontname,Fontsize,PrimaryColour,SecondaryColour,OutlineColour,BackColour,Bold,Italic,Underline,StrikeOut,ScaleX,ScaleY,Spacing,Angle,BorderStyle,Outline,Shadow,Alignment,MarginL,MarginR,MarginV,Encoding
-Style: DEF,{font},{fs},{prim_c},{prim_c},{out_c_ass},{back_c},{bold_f},{italic_f},{ul_f},{strike_f},100,100,{char_spacing},0,{border_style},{final_out_w},{final_shad_d},{align},10,10,{mv},1
-[Events]
-Format: Layer,Start,End,Style,Name,MarginL,MarginR,MarginV,Effect,Text
-""").strip()
-
-    events = ""
-    if float(speed) != 1.0:
-        print(f"[DEBUG] 字幕タイミングを再生速度 {speed}x に合わせて調整します。")
-    for s in segs:
-        text = s["text"]
-        if wrap > 0 and len(text) > wrap:
-            text = r"\N".join(textwrap.wrap(text, int(wrap)))
-        start_time = s['start'] / float(speed)
-        end_time = s['end'] / float(speed)
-        if float(speed) != 1.0:
-            print(f"  [DEBUG] ASSタイムコード調整: original=({s['start']:.2f}s, {s['end']:.2f}s) -> adjusted=({start_time:.2f}s, {end_time:.2f}s)")
-        events += f"Dialogue: 0,{tc(start_time)},{tc(end_time)},DEF,,0,0,0,,{text}\n"  # MarginVを0に固定
-    return header + "\n" + events
+    buf = io.StringIO()
+    write_ass_document(buf, segs, w, h,
+                       font, fs_pct, txt_col, txt_alpha, bold, italic, ul, strike,
+                       align, margin_pct, wrap, char_spacing,
+                       use_out, out_w, use_shad, shad_d, out_col, use_bg, bg_col, bg_alpha,
+                       speed=speed)
+    return buf.getvalue()
 
 
 def podcast_create_ass_content(*args, **kwargs):
@@ -568,13 +3499,8 @@ use_bg, bg_col, bg_alpha
          w, h = podcast_get_img_size(bg_img)
          print(f"[DEBUG] 背景画像を使用: {bg_path} ({w}x{h})")
      else:
-         w, h = 1920, 1080
-         bg_tmp = tempfile.NamedTemporaryFile(suffix=".png", delete=False)
-         bg_path = bg_tmp.name
-         bg_tmp.close()
-         temp_files.append(bg_path)
-         subprocess.run(["ffmpeg","-y","-f","lavfi","-i",f"color=c=black:s={w}x{h}","-frames:v","1",bg_path], check=True, stderr=subprocess.DEVNULL)
-         print(f"[DEBUG] デフォルトの黒背景を生成: {bg_path}")
+         bg_path, w, h = get_black_frame(1920, 1080)
+         print(f"[DEBUG] デフォルトの黒背景を使用: {bg_path}")
 
 
 
@@ -590,11 +3516,17 @@ use_bg, bg_col, bg_alpha
          use_out, out_w, use_shad, shad_d, out_col,
          use_bg, bg_col, bg_alpha
      )
-     ass_tmp = tempfile.NamedTemporaryFile(suffix=".ass", delete=False, mode='w', encoding='utf-8')
-     ass_tmp.write(ass_content)
-     ass_tmp.close()
-     temp_files.append(ass_tmp.name)
-     print(f"[DEBUG] 一時ASSファイルを作成: {ass_tmp.name}")
+     if PREVIEW_RENDERER == "pillow":
+         try:
+             image = render_ass_preview(ass_content, load_background_array(bg_path))
+             print("--- [DEBUG] ポッドキャスト用プレビュー生成に成功 (インプロセス描画) ---")
+             return image
+         except Exception as e:
+             print(f"[WARN] インプロセス描画に失敗したため、ffmpegで描画します: {e}")
+     ass_tmp = SCRATCH.new_path("previews", ".ass")
+     ass_tmp.write_text(ass_content, encoding='utf-8')
+     temp_files.append(str(ass_tmp))
+     print(f"[DEBUG] 一時ASSファイルを作成: {ass_tmp}")
 
 
 
@@ -603,9 +3535,7 @@ use_bg, bg_col, bg_alpha
 
 
 
-     out_png_tmp = tempfile.NamedTemporaryFile(suffix=".png", delete=False)
-     out_png = out_png_tmp.name
-     out_png_tmp.close()
+     out_png = str(SCRATCH.new_path("previews", ".png"))
 
 
 
@@ -614,12 +3544,12 @@ use_bg, bg_col, bg_alpha
 
 
 
-     safe_ass = ass_tmp.name.replace("\\", "/").replace(":", "\\:")
+     safe_ass = str(ass_tmp).replace("\\", "/").replace(":", "\\:")
      cmd = ["ffmpeg", "-y", "-loglevel", "warning", "-i", bg_path, "-vf", f"ass='{safe_ass}'", "-frames:v", "1", out_png]
      print(f"[DEBUG] FFmpegコマンド実行: {' '.join(cmd)}")
      run_chk(cmd)
      print("--- [DEBUG] ポッドキャスト用プレビュー生成に成功 ---")
-     return out_png
+     return SCRATCH.add(out_png)
 
 
 
@@ -646,41 +3576,36 @@ use_bg, bg_col, bg_alpha
 
 
 
+podcast_preview_coalescer = PreviewCoalescer(podcast_generate_preview)
+
+
+def podcast_live_preview(request: gr.Request, *values):
+    """スタイル変更イベント用。連続した要求は最新のものだけを描画する"""
+    return podcast_preview_coalescer(preview_session_key(request), *values)
+
+
+
+
+
+
+
+
 def podcast_generate_speed_preview(audio_file, speed):
    """指定された速度で音声プレビューを生成する"""
    print(f"--- [DEBUG] ポッドキャスト用音声速度プレビュー生成を開始 (速度: {speed}x) ---")
-   if not audio_file:
+   audio_path = _file_path(audio_file)
+   if not audio_path:
        print("[WARN] 音声ファイルがアップロードされていないため、プレビューをスキップします。")
        return None
   
-   temp_audio_out = None
    try:
-       temp_audio_out = tempfile.NamedTemporaryFile(suffix=".wav", delete=False).name
-      
-       # atempoフィルターは0.5から2.0の範囲で動作
-       # 範囲外の値はクリップする
-       safe_speed = max(0.5, min(2.0, float(speed)))
-      
-# --- MODIFICATION START ---
-       # プレビューは冒頭30秒に限定して高速化
-       cmd = [
-           "ffmpeg", "-y", "-i", audio_file.name,
-           "-af", f"atempo={safe_speed}",
-           "-t", "30", # 冒頭30秒のみ処理
-           "-loglevel", "error",
-           temp_audio_out
-       ]
-# --- MODIFICATION END ---
-      
-       print(f"[DEBUG] FFmpeg 音声プレビューコマンド実行: {' '.join(cmd)}")
-       run_chk(cmd)
+       # プレビューは冒頭30秒に限定して高速化 (生成結果は速度ごとにキャッシュ)
+       preview_path = get_speed_preview(audio_path, speed)
        print("--- [DEBUG] 音声速度プレビュー生成に成功 ---")
-       return temp_audio_out
+       return preview_path
    except Exception as e:
        print(f"❌ 音声速度プレビュー生成中にエラーが発生しました。", file=sys.stderr)
        traceback.print_exc()
-       if temp_audio_out and os.path.exists(temp_audio_out):
-           os.remove(temp_audio_out)
        return None
 
 
@@ -690,6 +3615,105 @@ def podcast_generate_speed_preview(audio_file, speed):
 
 
 
+# 背景は静止画なので、字幕の表示状態が変わる瞬間ごとに1フレームだけ描画し、可変フレームレートで並べる。
+# 背景を1フレームの動画にして concat demuxer で区間の長さずつ並べ、元のASSをそのまま焼き付けるので、
+# 中間の画像ファイルは作らない。エンコード量は音声の長さではなく字幕イベント数に比例する。
+PODCAST_RENDER_MODE = "stills"  # "loop" にすると背景をフレームごとにエンコードする従来方式
+PODCAST_STILL_EVAL_OFFSET_SEC = 0.005  # ASSの時刻はセンチ秒単位なので、区間の長さは必ずこれより長い
+_ASS_DIALOGUE_RE = re.compile(r"^Dialogue:\s*[^,]*,(\d+):(\d+):(\d+(?:\.\d+)?),(\d+):(\d+):(\d+(?:\.\d+)?),")
+
+
+def _ass_time_to_sec(h: str, m: str, s: str) -> float:
+    return int(h) * 3600 + int(m) * 60 + float(s)
+
+
+def podcast_build_subtitle_intervals(ass_text: str, duration: float) -> List[Tuple[float, float]]:
+    """ASSの表示内容が変わらない [開始, 終了) の区間列を返す"""
+    times = []
+    for line in ass_text.splitlines():
+        m = _ASS_DIALOGUE_RE.match(line)
+        if m:
+            start, end = _ass_time_to_sec(*m.group(1, 2, 3)), _ass_time_to_sec(*m.group(4, 5, 6))
+            if end > start:
+                times += [start, end]
+    # 表示内容はイベントの開始・終了の時刻でだけ変わり、各境界では必ず何かが出入りする。
+    # 境界を1回並べ替えるだけで区間が決まる (イベント数 × 区間数 の走査をしない)
+    bounds = sorted({0.0, duration, *(t for t in times if 0.0 < t < duration)})
+    return list(zip(bounds, bounds[1:]))
+
+
+def podcast_render_stills(ass_path: str, bg_img: Optional[str], w: int, h: int, audio: str, duration: float, speed: float, mp4_out: str,
+                          on_progress: Optional[Callable[[Dict[str, float]], None]] = None) -> None:
+    """字幕の表示状態が変わるごとに1フレームを描画し、可変長の静止画動画として音声と合わせてエンコードする"""
+    with open(ass_path, "r", encoding="utf-8") as f:
+        ass_text = f.read()
+    intervals = podcast_build_subtitle_intervals(ass_text, duration)
+    print(f"[DEBUG] 静止画モード: 字幕区間 {len(intervals)} 個")
+    with tempfile.TemporaryDirectory(dir=str(Path(mp4_out).parent)) as work_dir:
+        # 画像をconcatで直接並べると時刻が1/25秒単位に丸められるため、1ms単位のmkvにした背景を並べる
+        bg_clip = os.path.join(work_dir, "background.mkv")
+        bg_opts = ["-i", bg_img] if bg_img else ["-f", "lavfi", "-i", f"color=c=black:s={w}x{h}"]
+        run_chk(["ffmpeg", "-y"] + bg_opts + ["-frames:v", "1", "-c:v", "ffv1", "-loglevel", "error", bg_clip])
+
+        concat_list = os.path.join(work_dir, "frames.txt")
+        with open(concat_list, "w", encoding="utf-8") as f:
+            f.write("ffconcat version 1.0\n")
+            for t0, t1 in intervals:
+                f.write(f"file 'background.mkv'\nduration {t1 - t0:.6f}\n")
+            # concat demuxerは最後のdurationを無視するため、最終フレームをもう一度並べる
+            f.write("file 'background.mkv'\n")
+        safe_ass = ass_path.replace("\\", "/").replace(":", "\\:")
+        # 区間の先頭ちょうどの時刻では丸めで直前の状態を描くことがあるため、区間の少し後の時刻でASSを評価する
+        offset = PODCAST_STILL_EVAL_OFFSET_SEC
+        cmd = ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", concat_list, "-i", audio,
+               "-vf", f"setpts=PTS+{offset}/TB,ass='{safe_ass}',setpts=PTS-{offset}/TB",
+               "-af", f"atempo={speed}"] + fps_mode_opts("vfr") + ["-pix_fmt", "yuv420p",
+               "-c:v", "libx264", "-preset", "ultrafast", "-tune", "stillimage",
+               "-c:a", "aac", "-b:a", "192k", "-t", f"{duration:.6f}"] + encode_thread_opts() + ["-loglevel", "warning", mp4_out]
+        print(f"[DEBUG] FFmpeg Render Command: {' '.join(cmd)}")
+        run_chk(cmd, on_progress=on_progress)
+
+
+
+
+
+
+
+
+def podcast_render_video(ass_path: str, bg_img: Optional[str], w: int, h: int, audio: str, speed: float, mp4_out: str,
+                         render_progress: Optional[RenderProgress] = None) -> None:
+    """作成済みのASSを背景画像 (無ければ黒背景) に焼き付け、速度を変えた音声と合わせて mp4_out にエンコードする"""
+    # 速度変更を考慮して、元の音声デュレーションを速度で割る
+    duration = float(probe_media(audio).duration) / float(speed)
+    if PODCAST_RENDER_MODE == "stills":
+        try:
+            podcast_render_stills(ass_path, bg_img, w, h, audio, duration, speed, mp4_out, render_progress)
+            return
+        except Exception as e:
+            print(f"[WARN] 静止画モードでのレンダリングに失敗したため、従来方式で再試行します: {e}")
+            if render_progress is not None:
+                render_progress.reset()
+    if bg_img:
+        input_opts = ["-loop", "1", "-i", bg_img]
+    else:
+        print(f"[DEBUG] 速度変更適用後の背景デュレーション: {duration}s")
+        input_opts = ["-f", "lavfi", "-i", f"color=c=black:s={w}x{h}:d={duration}"]
+    # 映像と音声に速度変更フィルタを追加
+    safe_ass = ass_path.replace(':', r'.\:').replace(os.sep, '/')
+    video_filters = f"setpts=PTS/{speed},ass='{safe_ass}'"
+    audio_filters = f"atempo={speed}"
+    cmd = ["ffmpeg", "-y"] + input_opts + ["-i", audio, "-vf", video_filters, "-af", audio_filters] + \
+          ["-c:v", "libx264", "-preset", "ultrafast", "-c:a", "aac", "-b:a", "192k", "-shortest"] + encode_thread_opts() + [mp4_out]
+    print(f"[DEBUG] FFmpeg Render Command: {' '.join(cmd)}")
+    run_chk(cmd, on_progress=render_progress)
+
+
+
+
+
+
+
+
 def podcast_create_video(
 audio, bg_img, script,
 font, fs_pct, txt_col, txt_alpha,
@@ -697,13 +3721,20 @@ bold, italic, ul, strike,
 align, margin_pct, wrap, char_spacing,
 speed,
 use_out, out_w, use_shad, shad_d, out_col,
-use_bg, bg_col, bg_alpha
+use_bg, bg_col, bg_alpha,
+aligner_backend=None, aligner_model=None, aligner_threads=0,
+progress=gr.Progress(),
+*, run_dir=None
 ):
  """動画を生成する (ポッドキャスト用)"""
  print("\n--- 📢 ポッドキャスト動画生成処理を開始します ---")
+ manifest = None
  try:
      if not audio or not script:
          raise gr.Error("必須ファイル（音声、台本）が指定されていません。")
+     # 長さが分からないと背景の長さもレンダリングの進捗も決められないため、アラインメントの前に確かめる
+     if not probe_media(audio).duration:
+         raise gr.Error("音声ファイルの長さを取得できません。ファイルが壊れていないか、対応形式の音声か確認してください。")
 
 
      print(f"[INFO] 再生速度 {speed}x を適用して動画を生成します。")
@@ -711,10 +3742,14 @@ use_bg, bg_col, bg_alpha
 
 
 
-     run_dir = Path.cwd() / "runs" / datetime.datetime.now().strftime("%Y%m%d_%H%M%S_podcast")
+     run_dir = Path(run_dir) if run_dir else new_run_dir("podcast")
      run_dir.mkdir(parents=True, exist_ok=True)
      print(f"📂 作業ディレクトリを作成しました: {run_dir}")
      mp4_out, ass_out, json_out = str(run_dir/"out.mp4"), str(run_dir/"sub.ass"), str(run_dir/"align.json")
+     manifest = RunManifest(run_dir, "podcast", {"audio": audio, "script": script, "background": bg_img},
+                            dict(zip(STYLE_FIELD_ORDER, [font, fs_pct, txt_col, txt_alpha, bold, italic, ul, strike,
+                                 align, margin_pct, wrap, char_spacing, speed,
+                                 use_out, out_w, use_shad, shad_d, out_col, use_bg, bg_col, bg_alpha])))
 
 
 
@@ -724,11 +3759,16 @@ use_bg, bg_col, bg_alpha
 
 
      print("⏳ [1/4] 音声認識を実行中...")
-     import stable_whisper
-     model = stable_whisper.load_model('small')
-     result = model.align(audio, Path(script).read_text(encoding='utf-8'), language='ja')
-     result.save_as_json(json_out)
-     segs = [s for s in result.to_dict()['segments'] if s['text'].strip()]
+     progress(0, desc="[1/4] 音声認識を実行中...")
+     def decode_audio() -> np.ndarray:
+         with manifest.stage("decode"):
+             return decode_audio_pcm(audio)
+     aligner, aligner_model = resolve_aligner(aligner_backend, aligner_model)
+     with manifest.stage("align") as stage:
+         stage["aligner"] = {"backend": aligner.name, "model": aligner_model, "threads": int(aligner_threads or 0)}
+         segs = cached_align(audio, Path(script).read_text(encoding='utf-8'), json_out, decode_audio, progress=progress,
+                             model_name=aligner_model, backend=aligner.name, threads=int(aligner_threads or 0))
+         stage["outputs"].append(json_out)
      print("✅ [1/4] 音声認識が完了しました。")
 
 
@@ -738,10 +3778,7 @@ use_bg, bg_col, bg_alpha
 
 
 
-     if bg_img:
-         w, h, bg_in = *podcast_get_img_size(bg_img), bg_img
-     else:
-         w, h, bg_in = 1920, 1080, f"color=c=black:s=1920x1080"
+     w, h = podcast_get_img_size(bg_img) if bg_img else (1920, 1080)
      print(f"🖼️ 背景設定: {'画像ファイル' if bg_img else '黒背景'} ({w}x{h})")
 
 
@@ -752,14 +3789,18 @@ use_bg, bg_col, bg_alpha
 
 
      print("⏳ [2/4] 字幕ファイルを作成中...")
-     ass_text = podcast_create_ass_content(
-         segs, w, h, font, fs_pct, txt_col, txt_alpha,
-         bold, italic, ul, strike, align, margin_pct, wrap, char_spacing,
-         use_out, out_w, use_shad, shad_d, out_col,
-         use_bg, bg_col, bg_alpha,
-         speed=speed
-     )
-     with open(ass_out, "w", encoding="utf-8") as f: f.write(ass_text)
+     progress(0, desc="[2/4] 字幕ファイルを作成中...")
+     with manifest.stage("ass") as stage:
+         # 全文を文字列に組み立てずにファイルへ直接書き出す
+         with open(ass_out, "w", encoding="utf-8") as f:
+             write_ass_document(
+                 f, segs, w, h, font, fs_pct, txt_col, txt_alpha,
+                 bold, italic, ul, strike, align, margin_pct, wrap, char_spacing,
+                 use_out, out_w, use_shad, shad_d, out_col,
+                 use_bg, bg_col, bg_alpha,
+                 speed=speed
+             )
+         stage["outputs"].append(ass_out)
      print("✅ [2/4] 字幕ファイルを作成しました。")
 
 
@@ -770,39 +3811,10 @@ use_bg, bg_col, bg_alpha
 
 
      print("⏳ [3/4] 動画をレンダリング中...")
-     input_opts = ["-loop", "1", "-i", bg_in] if bg_img else ["-f", "lavfi", "-i", bg_in]
-     # FFmpegコマンドの期間を音声に合わせる
-     audio_duration_cmd = ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "default=noprint_wrappers=1:nokey=1", audio]
-     duration_str = subprocess.check_output(audio_duration_cmd).decode('utf-8').strip()
-
-
-
-
-
-
-
-
-     # lavfiの-iオプションにd={duration}を追加
-     if not bg_img:
-         # 速度変更を考慮して、元の音声デュレーションを速度で割る
-         try:
-             original_duration = float(duration_str)
-             adjusted_duration = original_duration / float(speed)
-             duration_str = str(adjusted_duration)
-             print(f"[DEBUG] 速度変更適用後の背景デュレーション: {duration_str}s")
-         except ValueError:
-             print(f"[WARN] デュレーションの調整に失敗しました。元の値 {duration_str} を使用します。")
-         input_opts = ["-f", "lavfi", "-i", f"{bg_in}:d={duration_str}"]
-
-
-     # 映像と音声に速度変更フィルタを追加
-     video_filters = f"setpts=PTS/{speed},ass='{ass_out.replace(':', r'.\:').replace(os.sep, '/')}'"
-     audio_filters = f"atempo={speed}"
-    
-     cmd = ["ffmpeg", "-y"] + input_opts + ["-i", audio, "-vf", video_filters, "-af", audio_filters] + \
-           ["-c:v", "libx264", "-preset", "ultrafast", "-c:a", "aac", "-b:a", "192k", "-shortest", mp4_out]
-     print(f"[DEBUG] FFmpeg Render Command: {' '.join(cmd)}")
-     run_chk(cmd)
+     with JOB_SCHEDULER.admit("encode", "エンコード", progress), manifest.stage("render") as stage:
+         render_progress = RenderProgress(progress, probe_media(audio).duration / float(speed), "[3/4] レンダリング中")
+         podcast_render_video(ass_out, bg_img, w, h, audio, speed, mp4_out, render_progress)
+         stage["outputs"].append(mp4_out)
      print("✅ [3/4] 動画のレンダリングが完了しました。")
 
 
@@ -812,6 +3824,7 @@ use_bg, bg_col, bg_alpha
 
 
 
+     manifest.finish({"video": mp4_out, "ass": ass_out, "json": json_out})
      print("🎉 [4/4] 全工程完了！")
      return mp4_out, ass_out, json_out, mp4_out
 
@@ -825,6 +3838,8 @@ use_bg, bg_col, bg_alpha
  except Exception as e:
      print(f"❌ ポッドキャスト動画生成中に致命的なエラーが発生しました。", file=sys.stderr)
      traceback.print_exc()
+     if manifest:
+         manifest.finish({}, error=e)
      # Gradioにエラーメッセージを通知
      raise gr.Error(f"エラーが発生しました: {e}")
 
@@ -856,93 +3871,130 @@ use_bg, bg_col, bg_alpha
 
 def subtitler_get_video_size(path:str) -> tuple[int,int]:
  """動画のサイズ(W,H)を取得"""
- try:
-     out = subprocess.check_output(["ffprobe","-v","error","-select_streams","v:0","-show_entries","stream=width,height","-of","csv=p=0", path])
-     w, h = map(int, out.decode('utf-8').strip().split(','))
-     return w, h
- except: return (1920, 1080)
-
-
-
-
-
-
-
-
-def subtitler_create_ass_content(
-segs, w, h,
-font, fs_pct, txt_col, txt_alpha,
-bold, italic, ul, strike,
-align, margin_pct, wrap, char_spacing,
-use_out, out_w, use_shad, shad_d, out_col,
-use_bg, bg_col, bg_alpha,
-speed=1.0
-) -> str:
- """ASSファイルのテキスト内容を生成する (動画字幕付け用)"""
- fs = int(h * (fs_pct / 100))
- mv = int(h * (margin_pct / 100))
- prim_c = hex_to_ass(txt_col, txt_alpha)
-
-
-
-
-
-
-
-
- if use_bg:
-     border_style = 3
-     out_c_ass = hex_to_ass(bg_col, bg_alpha)
-     back_c = "&HFF000000"
- else:
-     border_style = 1
-     out_c_ass = hex_to_ass(out_col, 100)
-     if use_shad:
-         back_c = hex_to_ass(out_col, 50)
-     else:
-         back_c = "&HFF000000"
-
-
-
-
-
-
-
-
- bold_f, italic_f = ("-1" if bold else "0"), ("-1" if italic else "0")
- ul_f, strike_f = ("-1" if ul else "0"), ("-1" if strike else "0")
-
-
-
+ return probe_display_size(path)
 
 
 
 
 
- if use_bg:
-     final_out_w = out_w
- else:
-     final_out_w = out_w if use_out else 0
- final_shad_d = shad_d if use_shad else 0
-
-
-
 
 
 
+# ストリームコピーでMP4に格納できる音声コーデック
+MP4_COPYABLE_AUDIO_CODECS = {"aac", "mp3", "ac3", "eac3", "alac"}
+# ストリームコピーでMP4に格納できる映像コーデック (これ以外はH.264に再エンコードする)
+MP4_COPYABLE_VIDEO_CODECS = {"h264", "hevc", "av1", "vp9", "mpeg4", "mpeg2video"}
+SUBTITLER_OUTPUT_MODES = [
+    ("字幕を焼き付け (MP4)", "burn"),
+    ("字幕トラック (MKV / ASS・再エンコードなし)", "soft_mkv"),
+    ("字幕トラック (MP4 / mov_text・映像が対応形式なら再エンコードなし)", "soft_mp4"),
+]
 
 
- header = textwrap.dedent(f"""
-[Script Info]
-ScriptType: v4.00+
-PlayResX: {w}
-PlayResY: {h}
-[V4+ Styles]
-Format: Name,Fontname,Fontsize,PrimaryColour,SecondaryColour,OutlineColour,BackColour,Bold,Italic,Underline,StrikeOut,ScaleX,ScaleY,Spacing,Angle,BorderStyle,Outline,Shadow,Alignment,MarginL,MarginR,MarginV,Encoding
-Style: DEF,{font},{fs},{prim_c},{prim_c},{out_c_ass},{back_c},{bold_f},{italic_f},{ul_f},{strike_f},100,100,{char_spacing},0,{border_style},{final_out_w},{final_shad_d},{align},10,10,{mv},1
-[Events]
-Format: Layer,Start,End,Style,Name,MarginL,MarginR,MarginV,Effect,Text
-""").strip()
+# 長い動画の焼き付けはキーフレーム境界で時間方向に分割し、各区間を別プロセスで並列にエンコードして
+# 無劣化で連結する。各区間にはその時間帯のASSイベントだけを渡す。
+# 区間の長さは秒ではなくフレーム数 (-frames:v) で指定し、継ぎ目でフレームが重複・欠落しないようにする。
+SHARD_MIN_DURATION_SEC = 600
+SHARD_TARGET_SEC = 300
+SHARD_MAX_WORKERS = max(1, (os.cpu_count() or 1) // 2)
+
+
+def count_video_frames(path: str) -> int:
+    """映像ストリームのフレーム (パケット) 数を数える"""
+    out = subprocess.check_output(["ffprobe","-v","error","-select_streams","v:0","-count_packets",
+                                   "-show_entries","stream=nb_read_packets","-of","csv=p=0", path])
+    return int(out.decode("utf-8").strip().split(",")[0])
+
+
+def plan_keyframe_shards(keyframes: List[float], duration: float, target_sec: float, max_shards: int) -> List[Tuple[float, float]]:
+    """目標の長さに近くなるよう、キーフレーム位置で [開始, 終了) の区間に分割する"""
+    count = max(1, min(max_shards, int(round(duration / target_sec))))
+    cuts = [0.0]
+    for i in range(1, count):
+        ideal = duration * i / count
+        candidates = [k for k in keyframes if cuts[-1] < k < duration]
+        if not candidates:
+            break
+        nearest = min(candidates, key=lambda k: abs(k - ideal))
+        if nearest > cuts[-1]:
+            cuts.append(nearest)
+    cuts.append(duration)
+    return list(zip(cuts, cuts[1:]))
+
+
+def slice_ass_events(ass_text: str, t0: float, t1: float) -> str:
+    """[t0, t1) に表示されるDialogueだけを残したASSを返す (時刻はそのまま)"""
+    out_lines = []
+    for line in ass_text.splitlines():
+        m = _ASS_DIALOGUE_RE.match(line)
+        if m and (_ass_time_to_sec(*m.group(4, 5, 6)) <= t0 or _ass_time_to_sec(*m.group(1, 2, 3)) >= t1):
+            continue
+        out_lines.append(line)
+    return "\n".join(out_lines) + "\n"
+
+
+def subtitler_burn_sharded(video: str, ass_path: str, speed: float, audio_opts: List[str], mp4_out: str,
+                           progress: Optional[RenderProgress] = None) -> bool:
+    """長い動画を分割並列で焼き付ける。分割する価値が無い場合は何もせずFalseを返す"""
+    import contextvars
+    from concurrent.futures import ThreadPoolExecutor
+    info = probe_media(video)
+    duration = info.duration or 0.0
+    if duration < SHARD_MIN_DURATION_SEC:
+        return False
+    shards = plan_keyframe_shards(info.keyframe_times(), duration, SHARD_TARGET_SEC, SHARD_MAX_WORKERS * 4)
+    if len(shards) < 2:
+        return False
+    frames = info.frame_times()
+    # 各区間の先頭フレームの番号。区間 i は first[i] から first[i + 1] の手前までのフレームを受け持つ
+    first = [bisect.bisect_left(frames, start) for start, _ in shards] + [len(frames)]
+    with open(ass_path, "r", encoding="utf-8") as f:
+        ass_text = f.read()
+    speed = float(speed)
+    # このジョブのエンコード用スレッド予算を区間ごとのプロセスで分け合う
+    budget = JOB_SCHEDULER.threads_for("encode")
+    workers = max(1, min(SHARD_MAX_WORKERS, budget))
+    threads_per_job = max(1, budget // workers)
+    print(f"[INFO] {len(shards)}区間に分割し、{workers}並列でレンダリングします (各{threads_per_job}スレッド)")
+    with tempfile.TemporaryDirectory(dir=str(Path(mp4_out).parent)) as work_dir:
+        def render_shard(index: int) -> str:
+            start, end = shards[index]
+            # 先頭のキーフレームと1つ前のフレームの中間へシークする (時刻の丸めで先頭フレームを落とさないため)
+            seek = (frames[first[index] - 1] + start) / 2 if first[index] > 0 else 0.0
+            shard_ass = os.path.join(work_dir, f"shard_{index:04d}.ass")
+            with open(shard_ass, "w", encoding="utf-8") as f:
+                f.write(slice_ass_events(ass_text, start / speed, end / speed))
+            shard_out = os.path.join(work_dir, f"shard_{index:04d}.mp4")
+            safe_ass = shard_ass.replace("\\", "/").replace(":", "\\:")
+            cmd = ["ffmpeg","-y","-ss",f"{seek:.6f}","-i",video,
+                   "-map","0:v:0","-an",
+                   # シーク位置を足して単一プロセス時と同じ時刻でASSを評価し、出力時に0起点へ戻す。
+                   # ASSの時刻を書き換えないため、センチ秒の丸めで表示フレームがずれることがない
+                   "-vf",f"setpts=PTS/{speed}+{seek / speed:.6f}/TB,ass='{safe_ass}':fontsdir='/usr/share/fonts/',setpts=PTS-STARTPTS",
+                   "-frames:v",str(first[index + 1] - first[index])] + fps_mode_opts("passthrough") + [
+                   "-c:v","libx264","-preset","ultrafast","-crf","23","-threads",str(threads_per_job),
+                   "-loglevel","warning", shard_out]
+            run_chk(cmd, on_progress=progress.part(index) if progress else None)
+            print(f"[DEBUG] 区間 {index + 1}/{len(shards)} ({start:.1f}s-{end:.1f}s) のレンダリングが完了")
+            return shard_out
+
+        # Gradioの進捗通知は呼び出し元のコンテキストに依存するため、各区間に複製して渡す
+        contexts = [contextvars.copy_context() for _ in shards]
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            shard_files = list(pool.map(lambda i: contexts[i].run(render_shard, i), range(len(shards))))
+        concat_list = os.path.join(work_dir, "shards.txt")
+        with open(concat_list, "w", encoding="utf-8") as f:
+            f.write("ffconcat version 1.0\n")
+            for path in shard_files:
+                f.write(f"file '{os.path.basename(path)}'\n")
+        cmd = ["ffmpeg","-y","-f","concat","-safe","0","-i",concat_list,"-i",video,
+               "-map","0:v:0","-map","1:a?","-c:v","copy"] + audio_opts + ["-loglevel","warning", mp4_out]
+        print(f"[DEBUG] FFmpeg Concat Command: {' '.join(cmd)}")
+        run_chk(cmd)
+    rendered = count_video_frames(mp4_out)
+    if rendered != len(frames):
+        raise RuntimeError(f"連結後のフレーム数が元動画と一致しません ({rendered} / {len(frames)})")
+    return True
 
 
 
@@ -951,19 +4003,23 @@ Format: Layer,Start,End,Style,Name,MarginL,MarginR,MarginV,Effect,Text
 
 
 
- events = ""
- if float(speed) != 1.0:
-   print(f"[DEBUG] 字幕タイミングを再生速度 {speed}x に合わせて調整します。")
- for s in segs:
-     text = s["text"].strip().replace("\n", " ")
-     if wrap > 0 and len(text) > wrap:
-          text = r"\N".join(textwrap.wrap(text, int(wrap)))
-     start_time = s['start'] / float(speed)
-     end_time = s['end'] / float(speed)
-     if float(speed) != 1.0:
-         print(f"  [DEBUG] ASSタイムコード調整: original=({s['start']:.2f}s, {s['end']:.2f}s) -> adjusted=({start_time:.2f}s, {end_time:.2f}s)")
-     events += f"Dialogue: 0,{tc(start_time)},{tc(end_time)},DEF,,0,0,0,,{text}\n"
- return header + "\n" + events
+def subtitler_create_ass_content(
+segs, w, h,
+font, fs_pct, txt_col, txt_alpha,
+bold, italic, ul, strike,
+align, margin_pct, wrap, char_spacing,
+use_out, out_w, use_shad, shad_d, out_col,
+use_bg, bg_col, bg_alpha,
+speed=1.0
+) -> str:
+ """ASSファイルのテキスト内容を生成する (動画字幕付け用)"""
+ buf = io.StringIO()
+ write_ass_document(buf, segs, w, h,
+                    font, fs_pct, txt_col, txt_alpha, bold, italic, ul, strike,
+                    align, margin_pct, wrap, char_spacing,
+                    use_out, out_w, use_shad, shad_d, out_col, use_bg, bg_col, bg_alpha,
+                    speed=speed, flatten_text=True)
+ return buf.getvalue()
 
 
 
@@ -983,20 +4039,11 @@ use_bg, bg_col, bg_alpha
  print("--- [DEBUG] 動画字幕付け用プレビュー生成を開始 ---")
  temp_files = []
  try:
-     bg_tmp = tempfile.NamedTemporaryFile(suffix=".png", delete=False)
-     bg_path = bg_tmp.name
-     temp_files.append(bg_path)
      if video_file and os.path.exists(video_file):
-         w, h = subtitler_get_video_size(video_file)
-         cmd_extract = ["ffmpeg","-y","-ss","00:00:01","-i",video_file,"-frames:v","1", "-loglevel", "error", bg_path]
-         run_chk(cmd_extract)
-         print(f"[DEBUG] 動画ファイルからフレームを抽出: {video_file} ({w}x{h})")
+         bg_path, w, h = get_preview_background_frame(video_file)
      else:
-         w, h = 1920, 1080
-         cmd_create_black = ["ffmpeg","-y","-f","lavfi","-i",f"color=c=black:s={w}x{h}","-frames:v","1", "-loglevel", "error", bg_path]
-         run_chk(cmd_create_black)
-         print(f"[DEBUG] デフォルトの黒背景を生成: {bg_path}")
-     bg_tmp.close()
+         bg_path, w, h = get_black_frame(1920, 1080)
+         print(f"[DEBUG] デフォルトの黒背景を使用: {bg_path}")
 
 
 
@@ -1012,11 +4059,17 @@ use_bg, bg_col, bg_alpha
          use_out, out_w, use_shad, shad_d, out_col,
          use_bg, bg_col, bg_alpha
      )
-     ass_tmp = tempfile.NamedTemporaryFile(suffix=".ass", delete=False, mode='w', encoding='utf-8')
-     ass_tmp.write(ass_content)
-     ass_tmp.close()
-     temp_files.append(ass_tmp.name)
-     print(f"[DEBUG] 一時ASSファイルを作成: {ass_tmp.name}")
+     if PREVIEW_RENDERER == "pillow":
+         try:
+             image = render_ass_preview(ass_content, load_background_array(bg_path))
+             print("--- [DEBUG] 動画字幕付け用プレビュー生成に成功 (インプロセス描画) ---")
+             return image
+         except Exception as e:
+             print(f"[WARN] インプロセス描画に失敗したため、ffmpegで描画します: {e}")
+     ass_tmp = SCRATCH.new_path("previews", ".ass")
+     ass_tmp.write_text(ass_content, encoding='utf-8')
+     temp_files.append(str(ass_tmp))
+     print(f"[DEBUG] 一時ASSファイルを作成: {ass_tmp}")
 
 
 
@@ -1025,9 +4078,7 @@ use_bg, bg_col, bg_alpha
 
 
 
-     out_png_tmp = tempfile.NamedTemporaryFile(suffix=".png", delete=False)
-     out_png = out_png_tmp.name
-     out_png_tmp.close()
+     out_png = str(SCRATCH.new_path("previews", ".png"))
 
 
 
@@ -1036,13 +4087,13 @@ use_bg, bg_col, bg_alpha
 
 
 
-     safe_ass_path = ass_tmp.name.replace("\\", "/").replace(":", "\\:")
+     safe_ass_path = str(ass_tmp).replace("\\", "/").replace(":", "\\:")
      vf_option = f"ass='{safe_ass_path}'"
      cmd_burn = ["ffmpeg", "-y", "-i", bg_path, "-vf", vf_option, "-frames:v", "1", "-loglevel", "error", out_png]
      print(f"[DEBUG] FFmpegコマンド実行: {' '.join(cmd_burn)}")
      run_chk(cmd_burn)
      print("--- [DEBUG] 動画字幕付け用プレビュー生成に成功 ---")
-     return out_png
+     return SCRATCH.add(out_png)
 
 
 
@@ -1070,51 +4121,93 @@ use_bg, bg_col, bg_alpha
 
 
 
+subtitler_preview_coalescer = PreviewCoalescer(subtitler_generate_preview)
+
+
+def subtitler_live_preview(request: gr.Request, *values):
+    """スタイル変更イベント用。連続した要求は最新のものだけを描画する"""
+    return subtitler_preview_coalescer(preview_session_key(request), *values)
+
+
+
+
+
+
+
+
 def subtitler_generate_speed_preview(video_file, speed):
    """動画から音声を抽出し、指定された速度で音声プレビューを生成する"""
    print(f"--- [DEBUG] 動画字幕付け用音声速度プレビュー生成を開始 (速度: {speed}x) ---")
-   if not video_file:
+   video_path = _file_path(video_file)
+   if not video_path:
        print("[WARN] 動画ファイルがアップロードされていないため、プレビューをスキップします。")
        return None
 
 
-   temp_audio_in = None
-   temp_audio_out = None
    try:
-# --- MODIFICATION START ---
-       # 1. 動画から音声の冒頭30秒のみを高速に抽出
+       # 動画の冒頭30秒の音声だけを、抽出と速度変更を1回のFFmpegでまとめて処理する
        print("[DEBUG] プレビューのため、動画の冒頭30秒から音声を抽出します...")
-       temp_audio_in = tempfile.NamedTemporaryFile(suffix=".wav", delete=False).name
-       cmd_extract = ["ffmpeg", "-y", "-i", video_file, "-t", "30", "-vn", "-ac", "1", "-ar", "16000", "-loglevel", "error", temp_audio_in]
-       print(f"[DEBUG] FFmpeg 音声抽出コマンド実行: {' '.join(cmd_extract)}")
-       run_chk(cmd_extract)
-
-
-       # 2. 抽出した30秒の音声の速度を変更
-       temp_audio_out = tempfile.NamedTemporaryFile(suffix=".wav", delete=False).name
-       safe_speed = max(0.5, min(2.0, float(speed)))
-       cmd_tempo = [
-           "ffmpeg", "-y", "-i", temp_audio_in,
-           "-af", f"atempo={safe_speed}",
-           "-loglevel", "error",
-           temp_audio_out
-       ]
-# --- MODIFICATION END ---
-       print(f"[DEBUG] FFmpeg 音声速度変更コマンド実行: {' '.join(cmd_tempo)}")
-       run_chk(cmd_tempo)
-      
+       preview_path = get_speed_preview(video_path, speed)
        print("--- [DEBUG] 音声速度プレビュー生成に成功 ---")
-       return temp_audio_out
+       return preview_path
    except Exception as e:
        print(f"❌ 音声速度プレビュー生成中にエラーが発生しました。", file=sys.stderr)
        traceback.print_exc()
        return None
-   finally:
-       # 一時ファイルをクリーンアップ
-       if temp_audio_in and os.path.exists(temp_audio_in):
-           os.remove(temp_audio_in)
-       # temp_audio_outはGradioが再生後に処理するため、ここでは削除しない
-       print("[DEBUG] 一時音声抽出ファイルをクリーンアップしました。")
+
+
+
+
+
+
+
+
+def subtitler_render_video(video: str, ass_path: str, speed: float, output_mode: str, mp4_out: str,
+                           render_progress: Optional[RenderProgress] = None) -> str:
+    """作成済みのASSを動画に焼き付ける (soft_* なら字幕トラックとして多重化する)。出力先のパスを返す"""
+    speed_changed = float(speed) != 1.0
+    # 速度変更が無ければ音声は再エンコードせずにそのままコピーする
+    if speed_changed:
+        audio_opts = ["-af", f"atempo={speed}", "-c:a", "aac", "-b:a", "192k"]
+    elif output_mode == "soft_mkv" or probe_media(video).audio_codec in MP4_COPYABLE_AUDIO_CODECS:
+        audio_opts = ["-c:a", "copy"]
+    else:
+        audio_opts = ["-c:a", "aac", "-b:a", "192k"]
+    if output_mode in ("soft_mkv", "soft_mp4"):
+        # 字幕を焼き付けず字幕トラックとして多重化する。映像は速度変更が無く、出力先に格納できるコーデックならストリームコピー
+        if output_mode == "soft_mkv":
+            mp4_out = str(Path(mp4_out).with_suffix(".mkv"))
+        video_codec = probe_media(video).video_codec
+        video_copyable = output_mode == "soft_mkv" or video_codec in MP4_COPYABLE_VIDEO_CODECS
+        if not speed_changed and not video_copyable:
+            print(f"[WARN] 映像コーデック {video_codec} はMP4にそのまま格納できないため、H.264に再エンコードします。")
+        video_opts = ["-vf", f"setpts=PTS/{speed}", "-c:v","libx264","-preset","ultrafast","-crf","23"] if speed_changed else \
+                     ["-c:v", "copy"] if video_copyable else ["-c:v","libx264","-preset","ultrafast","-crf","23"]
+        cmd_burn = ["ffmpeg","-y","-i",video,"-i",ass_path,
+                    "-map","0:v:0","-map","0:a?","-map","1:0"] + video_opts + audio_opts + \
+                   ["-c:s", "ass" if output_mode == "soft_mkv" else "mov_text", "-metadata:s:s:0", "language=jpn"] + \
+                   encode_thread_opts() + ["-loglevel", "warning", mp4_out]
+    else:
+        safe_ass_path_main = ass_path.replace("\\", "/").replace(":", "\\:")
+        # fontsdirオプションを追加してColab環境でのフォントパスを明示
+        # 速度変更のため、映像と音声にフィルタを適用。
+        video_filters_main = f"setpts=PTS/{speed},ass='{safe_ass_path_main}':fontsdir='/usr/share/fonts/'"
+        cmd_burn = ["ffmpeg","-y","-i",video,
+                    "-vf", video_filters_main,
+                    "-c:v","libx264","-preset","ultrafast","-crf","23"] + audio_opts + \
+                   encode_thread_opts() + ["-loglevel", "warning", mp4_out]
+    sharded = False
+    if output_mode == "burn" and SHARD_MAX_WORKERS > 1:
+        try:
+            sharded = subtitler_burn_sharded(video, ass_path, speed, audio_opts, mp4_out, render_progress)
+        except Exception as e:
+            print(f"[WARN] 分割並列レンダリングに失敗したため、単一プロセスで再試行します: {e}")
+            if render_progress is not None:
+                render_progress.reset()
+    if not sharded:
+        print(f"[DEBUG] FFmpeg Render Command: {' '.join(cmd_burn)}")
+        run_chk(cmd_burn, on_progress=render_progress)
+    return mp4_out
 
 
 
@@ -1130,20 +4223,30 @@ bold, italic, ul, strike,
 align, margin_pct, wrap, char_spacing,
 speed,
 use_out, out_w, use_shad, shad_d, out_col,
-use_bg, bg_col, bg_alpha
+use_bg, bg_col, bg_alpha,
+output_mode="burn",
+aligner_backend=None, aligner_model=None, aligner_threads=0,
+progress=gr.Progress(),
+*, run_dir=None
 ):
  """動画に字幕を焼き付ける (動画字幕付け用)"""
  print("\n--- 🎬 動画字幕付け処理を開始します ---")
+ manifest = None
  try:
      if not video or not script:
          raise gr.Error("必須ファイル（動画、台本）が指定されていません。")
      print(f"[INFO] 再生速度 {speed}x を適用して動画を生成します。")
 
 
-     run_dir = Path.cwd() / "runs" / datetime.datetime.now().strftime("%Y%m%d_%H%M%S_subtitler")
+     run_dir = Path(run_dir) if run_dir else new_run_dir("subtitler")
      run_dir.mkdir(parents=True, exist_ok=True)
      print(f"📂 作業ディレクトリを作成しました: {run_dir}")
      mp4_out, ass_out, json_out = str(run_dir/"final.mp4"), str(run_dir/"sub.ass"), str(run_dir/"align.json")
+     manifest = RunManifest(run_dir, "subtitler", {"video": video, "script": script},
+                            {**dict(zip(STYLE_FIELD_ORDER, [font, fs_pct, txt_col, txt_alpha, bold, italic, ul, strike,
+                                 align, margin_pct, wrap, char_spacing, speed,
+                                 use_out, out_w, use_shad, shad_d, out_col, use_bg, bg_col, bg_alpha])),
+                             "output_mode": output_mode})
 
 
 
@@ -1152,11 +4255,15 @@ use_bg, bg_col, bg_alpha
 
 
 
-     print("⏳ [1/4] 動画から音声を抽出中...")
-     tmp_audio = tempfile.NamedTemporaryFile(suffix=".wav", delete=False).name
-     cmd_extract = ["ffmpeg","-y","-i",video,"-vn","-ac","1","-ar","16000", "-loglevel", "error", tmp_audio]
-     run_chk(cmd_extract)
-     print("✅ [1/4] 音声の抽出が完了しました。")
+     def extract_audio() -> np.ndarray:
+         print("⏳ [1/4] 動画から音声を抽出中...")
+         progress(0, desc="[1/4] 動画から音声を抽出中...")
+         with manifest.stage("extract"):
+             pcm = decode_audio_pcm(video)
+         print(f"✅ [1/4] 音声の抽出が完了しました。({len(pcm) / ALIGN_SAMPLE_RATE:.1f}秒)")
+         print("⏳ [2/4] AIによるアラインメントを実行中...")
+         progress(0, desc="[2/4] AIによるアラインメントを実行中...")
+         return pcm
 
 
 
@@ -1165,19 +4272,13 @@ use_bg, bg_col, bg_alpha
 
 
 
-     segs = []
-     try:
-         print("⏳ [2/4] AIによるアラインメントを実行中...")
-         import stable_whisper
-         model = stable_whisper.load_model('small')
-         result = model.align(tmp_audio, Path(script).read_text(encoding='utf-8'), language='ja')
-         result.save_as_json(json_out)
-         segs = [s for s in result.to_dict()['segments'] if s['text'].strip()]
-         print("✅ [2/4] AIアラインメントが完了しました。")
-     finally:
-         if os.path.exists(tmp_audio):
-             os.remove(tmp_audio)
-             print("[DEBUG] 一時音声ファイルを削除しました。")
+     aligner, aligner_model = resolve_aligner(aligner_backend, aligner_model)
+     with manifest.stage("align") as stage:
+         stage["aligner"] = {"backend": aligner.name, "model": aligner_model, "threads": int(aligner_threads or 0)}
+         segs = cached_align(video, Path(script).read_text(encoding='utf-8'), json_out, extract_audio, progress=progress,
+                             model_name=aligner_model, backend=aligner.name, threads=int(aligner_threads or 0))
+         stage["outputs"].append(json_out)
+     print("✅ [2/4] AIアラインメントが完了しました。")
 
 
 
@@ -1187,15 +4288,18 @@ use_bg, bg_col, bg_alpha
 
 
      print("⏳ [3/4] 字幕ファイルを作成中...")
-     w, h = subtitler_get_video_size(video)
-     ass_text = subtitler_create_ass_content(
-        segs, w, h, font, fs_pct, txt_col, txt_alpha,
-        bold, italic, ul, strike, align, margin_pct, wrap, char_spacing,
-        use_out, out_w, use_shad, shad_d, out_col,
-        use_bg, bg_col, bg_alpha,
-        speed=speed
-     )
-     with open(ass_out, "w", encoding="utf-8") as f: f.write(ass_text)
+     progress(0, desc="[3/4] 字幕ファイルを作成中...")
+     with manifest.stage("ass") as stage:
+         w, h = subtitler_get_video_size(video)
+         with open(ass_out, "w", encoding="utf-8") as f:
+             write_ass_document(
+                f, segs, w, h, font, fs_pct, txt_col, txt_alpha,
+                bold, italic, ul, strike, align, margin_pct, wrap, char_spacing,
+                use_out, out_w, use_shad, shad_d, out_col,
+                use_bg, bg_col, bg_alpha,
+                speed=speed, flatten_text=True
+             )
+         stage["outputs"].append(ass_out)
      print("✅ [3/4] 字幕ファイルを作成しました。")
 
 
@@ -1206,19 +4310,10 @@ use_bg, bg_col, bg_alpha
 
 
      print("⏳ [4/4] 動画に字幕をレンダリング中...")
-     safe_ass_path_main = ass_out.replace("\\", "/").replace(":", "\\:")
-     # fontsdirオプションを追加してColab環境でのフォントパスを明示
-     # 速度変更のため、映像と音声にフィルタを適用。音声は再エンコードする。
-     video_filters_main = f"setpts=PTS/{speed},ass='{safe_ass_path_main}':fontsdir='/usr/share/fonts/'"
-     audio_filters_main = f"atempo={speed}"
-     cmd_burn = ["ffmpeg","-y","-i",video,
-                 "-vf", video_filters_main,
-                 "-af", audio_filters_main,
-                 "-c:v","libx264","-preset","ultrafast","-crf","23",
-                 "-c:a", "aac", "-b:a", "192k",
-                 "-loglevel", "warning", mp4_out]
-     print(f"[DEBUG] FFmpeg Render Command: {' '.join(cmd_burn)}")
-     run_chk(cmd_burn)
+     with JOB_SCHEDULER.admit("encode", "エンコード", progress), manifest.stage("render") as stage:
+         render_progress = RenderProgress(progress, (probe_media(video).duration or 0.0) / float(speed), "[4/4] レンダリング中")
+         mp4_out = subtitler_render_video(video, ass_out, speed, output_mode, mp4_out, render_progress)
+         stage["outputs"].append(mp4_out)
      print("✅ [4/4] 字幕のレンダリングが完了しました。")
 
 
@@ -1228,8 +4323,10 @@ use_bg, bg_col, bg_alpha
 
 
 
+     manifest.finish({"video": mp4_out, "ass": ass_out, "json": json_out})
      print(f"🎉 全工程完了！ 出力先: {run_dir}")
-     return mp4_out, ass_out, json_out
+     # MKVはブラウザで再生できないため、プレーヤーには渡さずファイルとしてのみ返す
+     return (None if output_mode == "soft_mkv" else mp4_out), ass_out, json_out, mp4_out
 
 
 
@@ -1241,6 +4338,8 @@ use_bg, bg_col, bg_alpha
  except Exception as e:
      print(f"❌ 動画字幕付け処理中に致命的なエラーが発生しました。", file=sys.stderr)
      traceback.print_exc()
+     if manifest:
+         manifest.finish({}, error=e)
      raise gr.Error(f"エラーが発生しました: {e}")
 
 
@@ -1258,6 +4357,556 @@ use_bg, bg_col, bg_alpha
 
 
 
+# ------------------------------------------------------------------------------
+# 2-3. バッチ処理 (CLI)
+# ------------------------------------------------------------------------------
+# マニフェスト (CSV/JSONL) に列挙した素材をUIを介さずにまとめて処理する。
+# ffmpegは子プロセスで動くため、ワーカーはスレッドで十分並列化でき、
+# アラインメントモデルもレジストリ経由で全ワーカーが共有する。
+BATCH_RESULTS_NAME = "results.jsonl"
+
+
+def parse_cli_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="字幕作成ツール (引数なしでGradio UIを起動)")
+    parser.add_argument("--batch", metavar="MANIFEST", help="CSVまたはJSONLのマニフェストを非対話で一括処理する")
+    parser.add_argument("--workers", type=int, default=2, help="同時に処理する項目数")
+    parser.add_argument("--out-dir", default="batch_out", help="項目ごとの出力と results.jsonl の保存先")
+    parser.add_argument("--force", action="store_true", help="完了済みの項目も再処理する")
+    parser.add_argument("--preview-parity", action="store_true", help="インプロセス描画とlibass描画のプレビュー差分を確認する")
+    parser.add_argument("--self-test", action="store_true", help="UIハンドラの引数の並びなどを検査する")
+    parser.add_argument("--bench", nargs="?", const="bench_report.json", metavar="REPORT", help="合成素材でパイプラインを段階ごとに計測し、JSONレポートを保存する")
+    parser.add_argument("--bench-cases", default="small", help=f"計測するケース (カンマ区切り: {', '.join(BENCH_CASES)})")
+    parser.add_argument("--bench-aligner", default=STUB_ALIGN_MODEL_NAME, help="アラインメントの指定 (\"方式:モデル\" またはモデル名。stub はモデルを使わない)")
+    parser.add_argument("--bench-baseline", metavar="REPORT", help="比較対象とする以前のベンチマークレポート")
+    parser.add_argument("--longform-workers", action="store_true", help=f"長時間モード用のワーカープロセス ({LONGFORM_MAX_WORKERS}個) を起動する")
+    # ノートブックのカーネルは独自の引数 (-f ...) で起動されるため、カーネル上ではコマンドライン引数を読まない
+    if argv is None and IN_NOTEBOOK:
+        argv = []
+    return parser.parse_args(argv)
+
+
+def load_batch_manifest(manifest_path: str) -> List[Dict[str, Any]]:
+    """マニフェストを読み込み、相対パスをマニフェストの場所基準で解決した項目リストを返す"""
+    path = Path(manifest_path)
+    if path.suffix.lower() in {".jsonl", ".ndjson"}:
+        with path.open("r", encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+    else:
+        import csv
+        with path.open("r", encoding="utf-8-sig", newline="") as f:
+            rows = [dict(row) for row in csv.DictReader(f)]
+    items = []
+    for index, row in enumerate(rows, start=1):
+        row = {k.strip(): (v.strip() if isinstance(v, str) else v) for k, v in row.items() if k}
+        for key in ("audio", "video", "script", "background", "preset"):
+            if row.get(key):
+                row[key] = str((path.parent / row[key]).resolve())
+            else:
+                row[key] = None
+        mode = row.get("mode") or ("subtitler" if row["video"] else "podcast")
+        if mode not in PRESET_TYPES:
+            raise ValueError(f"{index}件目: 不明なmodeです: {mode}")
+        media = row["video"] if mode == "subtitler" else row["audio"]
+        if not media or not row["script"]:
+            raise ValueError(f"{index}件目: {'video' if mode == 'subtitler' else 'audio'} と script は必須です。")
+        row["mode"] = mode
+        try:
+            row["aligner_backend"], row["aligner_model"] = parse_aligner_spec(row.get("aligner"))
+            row["aligner_threads"] = int(row.get("aligner_threads") or 0)
+        except ValueError as e:
+            raise ValueError(f"{index}件目: {e}")
+        row["id"] = sanitize_filename(str(row.get("id") or f"{index:04d}_{Path(media).stem}"))
+        items.append(row)
+    return items
+
+
+def load_batch_style(preset_path: Optional[str], preset_type: str) -> Dict[str, Any]:
+    """プリセットJSON (エクスポート形式または設定のみ) をデフォルト値に重ねて検証する"""
+    settings = dict(DEFAULT_STYLE_SETTINGS)
+    if preset_path:
+        with open(preset_path, "r", encoding="utf-8") as f:
+            payload = json.load(f)
+        if "settings" in payload:
+            if payload.get("type") not in (None, preset_type):
+                raise ValueError("プリセットの種類が処理モードと一致しません。")
+            payload = payload["settings"]
+        settings.update(payload)
+    ok, message = validate_style_settings(settings, preset_type)
+    if not ok:
+        raise ValueError(message or "設定が不正です。")
+    return settings
+
+
+def _read_batch_results(results_path: Path) -> Dict[str, Dict[str, Any]]:
+    results = {}
+    if results_path.exists():
+        with results_path.open("r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    results[record["id"]] = record
+    return results
+
+
+def run_batch_item(item: Dict[str, Any], out_dir: Path) -> Dict[str, Any]:
+    started = time.monotonic()
+    record = {"id": item["id"], "mode": item["mode"]}
+    try:
+        settings = load_batch_style(item.get("preset"), item["mode"])
+        style_args = [settings[key] for key in STYLE_FIELD_ORDER]
+        item_dir = out_dir / item["id"]
+        aligner_args = {key: item[key] for key in ("aligner_backend", "aligner_model", "aligner_threads")}
+        if item["mode"] == "podcast":
+            mp4_out, ass_out, json_out, _ = podcast_create_video(
+                item["audio"], item.get("background"), item["script"], *style_args, **aligner_args, run_dir=item_dir)
+        else:
+            _, ass_out, json_out, mp4_out = subtitler_create_video_with_subs(
+                item["video"], item["script"], *style_args, item.get("output_mode") or "burn", **aligner_args, run_dir=item_dir)
+        record.update(status="ok", outputs={"video": mp4_out, "ass": ass_out, "json": json_out,
+                                            "manifest": str(item_dir / RUN_MANIFEST_NAME)})
+    except Exception as e:
+        record.update(status="error", error=str(e))
+    record["elapsed_sec"] = round(time.monotonic() - started, 2)
+    record["finished_at"] = datetime.datetime.now().isoformat(timespec="seconds")
+    return record
+
+
+# プレビューの一致判定の許容値 (1920x1080)。PillowとlibassはFreeTypeのアンチエイリアスが異なるため、
+# 同じフォントでも画素単位では一致しない。送り幅をヒンティングなしに揃えた後、同じラテン文字フォントで
+# 下の各ケースを測った実測は外接矩形のずれ 1-2px (縦方向のベースラインの丸め)、インク比 1.006-1.023
+# (背景ボックスありが最大) だった
+PREVIEW_PARITY_MAX_OFFSET_PX = 3
+PREVIEW_PARITY_INK_RANGE = (0.9, 1.1)
+# 黒背景で縁取り・影・背景ボックスが見えるよう、既定 (灰色と黒) ではなく目立つ色で比べる
+PREVIEW_PARITY_BASE_STYLE = {"use_out": False, "out_col": "#FF3030", "bg_col": "#30A0FF"}
+PREVIEW_PARITY_CASES = {
+    "plain": {},
+    "outline": {"use_out": True, "out_w": 3},
+    "shadow": {"use_shad": True, "shad_d": 3},
+    "box": {"use_bg": True, "bg_alpha": 80},
+    "align_top_left": {"align": 7},
+    "align_middle": {"align": 5},
+    "align_bottom_right": {"align": 3},
+    "margin": {"margin_pct": 30},
+    "spacing": {"char_spacing": 4},
+}
+
+
+def font_family_installed(family: str) -> bool:
+    """fontconfigにそのファミリーのフォントが登録されていれば True (fc-matchは無くても代替を返すため使えない)"""
+    try:
+        return bool(subprocess.check_output(["fc-list", family, "file"], stderr=subprocess.DEVNULL).strip())
+    except (OSError, subprocess.CalledProcessError):
+        return False
+
+
+def run_preview_parity_check(max_offset_px: float = PREVIEW_PARITY_MAX_OFFSET_PX,
+                             ink_range: Tuple[float, float] = PREVIEW_PARITY_INK_RANGE) -> int:
+    """スタイルの項目ごとにインプロセス描画とlibass描画を比較し、差が大きいケース数を返す"""
+    bg_path, w, h = get_black_frame(1920, 1080)
+    dummy_segs = [{"start": 0.0, "end": 5.0, "text": "プレビュー用のサンプルテキストです"}]
+    failures = 0
+    plain_style = None
+    for name, overrides in PREVIEW_PARITY_CASES.items():
+        settings = {**DEFAULT_STYLE_SETTINGS, **PREVIEW_PARITY_BASE_STYLE, **overrides}
+        style_args = [settings[key] for key in STYLE_FIELD_ORDER if key != "speed"]
+        ass_text = podcast_create_ass_content(dummy_segs, w, h, *style_args)
+        style_line = next(line for line in ass_text.splitlines() if line.startswith("Style:"))
+        if plain_style is None:
+            plain_style = style_line
+        elif style_line == plain_style:
+            # 項目がASSに反映されていなければ、このケースは何も確かめていない
+            failures += 1
+            print(f"❌ parity/{name}: {overrides} がStyle行を変えていません")
+            continue
+        report = compare_preview_renderers(ass_text, bg_path)
+        ok = report["bbox_offset_px"] <= max_offset_px and ink_range[0] <= report["ink_ratio"] <= ink_range[1]
+        failures += 0 if ok else 1
+        print(f"{'✅' if ok else '❌'} parity/{name}: {json.dumps(report)}")
+    return failures
+
+
+def check_handler_arity(fn: Callable[..., Any], n_inputs: int) -> Optional[str]:
+    """Gradioと同じ方法で n_inputs 個の入力値と gr.Progress を並べて fn に渡し、引数のずれがあれば説明を返す"""
+    import inspect
+    values: List[Any] = [f"<input {i}>" for i in range(n_inputs)]
+    params = list(inspect.signature(fn).parameters.values())
+    # gradio.helpers.special_args は Progress を既定値に持つ引数の位置へ insert する
+    for i, param in enumerate(params):
+        if isinstance(param.default, gr.Progress):
+            values.insert(i, param.default)
+    try:
+        bound = inspect.signature(fn).bind(*values)
+    except TypeError as e:
+        return str(e)
+    for name, value in bound.arguments.items():
+        param = inspect.signature(fn).parameters[name]
+        if isinstance(param.default, gr.Progress) != isinstance(value, gr.Progress):
+            return f"引数 {name} に {value!r} が渡されます"
+    received = [value for value in bound.arguments.values() if isinstance(value, str) and value.startswith("<input ")]
+    if len(received) != n_inputs:
+        return f"入力 {n_inputs} 個のうち {len(received)} 個しか受け取れません"
+    return None
+
+
+def run_self_tests(handlers: Dict[str, Tuple[Callable[..., Any], int]]) -> int:
+    """UIハンドラの引数の並びなど、モデルや素材なしで確かめられる項目を検査し、失敗数を返す"""
+    failures = 0
+    for name, (fn, n_inputs) in handlers.items():
+        problem = check_handler_arity(fn, n_inputs)
+        failures += 1 if problem else 0
+        print(f"{'❌' if problem else '✅'} arity/{name}: {problem or f'{n_inputs}入力 + Progress'}")
+    problems = self_test_longform()
+    failures += len(problems)
+    print(f"{'❌' if problems else '✅'} longform: {' / '.join(problems) or '割り振りと統合が既知の境界と一致'}")
+    problems = self_test_ass_writer()
+    failures += len(problems)
+    print(f"{'❌' if problems else '✅'} ass_writer: {' / '.join(problems) or '以前のASS生成の出力とバイト単位で一致'}")
+    problems = self_test_segment_table()
+    failures += len(problems)
+    print(f"{'❌' if problems else '✅'} segment_table: {' / '.join(problems) or 'dictごとの処理と同じ時刻・テキスト'}")
+    problems = self_test_wrap_widths()
+    failures += len(problems)
+    print(f"{'❌' if problems else '✅'} wrap: {' / '.join(problems) or '幅基準の折り返しが全フォントで安全領域に収まる'}")
+    # プレビューの一致はlibassと既定フォントが前提。無い環境では確かめられないので失敗として数える
+    font = DEFAULT_STYLE_SETTINGS["font"]
+    if not shutil.which("ffmpeg"):
+        failures += 1
+        print("❌ parity: ffmpeg が見つからないため、libassとの比較ができません")
+    elif not font_family_installed(font):
+        failures += 1
+        print(f"❌ parity: フォント {font} が見つからないため、libassとの比較ができません")
+    else:
+        failures += run_preview_parity_check()
+    return failures
+
+
+def run_batch(manifest_path: str, out_dir: str, workers: int = 2, force: bool = False) -> int:
+    """マニフェストを一括処理し、失敗した項目数を返す"""
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    items = load_batch_manifest(manifest_path)
+    out_path = Path(out_dir).resolve()
+    out_path.mkdir(parents=True, exist_ok=True)
+    results_path = out_path / BATCH_RESULTS_NAME
+    previous = {} if force else _read_batch_results(results_path)
+    pending = []
+    for item in items:
+        done = previous.get(item["id"])
+        if done and done.get("status") == "ok" and Path(done["outputs"]["video"]).exists():
+            print(f"[INFO] 完了済みのためスキップします: {item['id']}")
+            continue
+        pending.append(item)
+    print(f"📦 バッチ処理を開始します: 全{len(items)}件中 {len(pending)}件 (並列数 {workers})")
+    write_lock = threading.Lock()
+    failures = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(run_batch_item, item, out_path): item for item in pending}
+        for future in as_completed(futures):
+            record = future.result()
+            with write_lock, results_path.open("a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            if record["status"] == "ok":
+                print(f"✅ [{record['id']}] 完了 ({record['elapsed_sec']}s)")
+            else:
+                failures += 1
+                print(f"❌ [{record['id']}] 失敗: {record['error']}", file=sys.stderr)
+    print(f"🎉 バッチ処理が終了しました: 成功 {len(pending) - failures}件 / 失敗 {failures}件 / 結果: {results_path}")
+    return failures
+
+
+# ------------------------------------------------------------------------------
+# 2-4. ベンチマーク (CLI)
+# ------------------------------------------------------------------------------
+# lavfiで生成した決定的な合成素材に対して両パイプラインを段階ごとに計測し、
+# コミット間で比較できるJSONレポートを出力する。合成素材は一度だけ生成して使い回す。
+BENCH_MEDIA_DIR = Path.cwd() / "runs" / "_bench_media"
+BENCH_CASES = {
+    # 名前: (長さ[秒], 台本の行数)
+    "small": (60, 10),
+    "medium": (1800, 1000),
+    "large": (10800, 20000),
+}
+BENCH_STAGES = ["probe", "decode", "align", "ass", "preview", "render"]
+BENCH_REPORT_VERSION = 1
+
+
+def bench_make_script(lines: int) -> str:
+    """長さの異なる行を決まった順で並べた台本テキストを返す"""
+    phrases = ["こんにちは。", "今日はベンチマーク用の台本を読み上げます。", "字幕の折り返しと描画の速さを測ります。",
+               "短い行", "これは少し長めの行で、折り返し幅を超えるように文字数を多めにしてあります。"]
+    return "\n".join(f"{i + 1}. {phrases[i % len(phrases)]}" for i in range(lines)) + "\n"
+
+
+def bench_prepare_media(case: str) -> Dict[str, str]:
+    """ケースごとの合成音声・合成動画・台本を用意してパスを返す (生成済みなら再利用)"""
+    duration, lines = BENCH_CASES[case]
+    case_dir = BENCH_MEDIA_DIR / case
+    case_dir.mkdir(parents=True, exist_ok=True)
+    paths = {"audio": case_dir / "tone.m4a", "video": case_dir / "colour.mp4", "script": case_dir / "script.txt"}
+    if not paths["script"].exists():
+        paths["script"].write_text(bench_make_script(lines), encoding="utf-8")
+    if not paths["audio"].exists():
+        print(f"⏳ 合成音声を生成中: {case} ({duration}s)")
+        tmp = case_dir / "tone.tmp.m4a"
+        run_chk(["ffmpeg","-y","-f","lavfi","-i",f"sine=frequency=440:sample_rate=44100:duration={duration}",
+                 "-c:a","aac","-b:a","96k","-loglevel","error", str(tmp)])
+        os.replace(tmp, paths["audio"])
+    if not paths["video"].exists():
+        print(f"⏳ 合成動画を生成中: {case} ({duration}s)")
+        tmp = case_dir / "colour.tmp.mp4"
+        run_chk(["ffmpeg","-y","-f","lavfi","-i",f"color=c=0x336699:s=1280x720:r=25:d={duration}",
+                 "-f","lavfi","-i",f"sine=frequency=220:sample_rate=44100:duration={duration}",
+                 "-c:v","libx264","-preset","ultrafast","-g","250","-c:a","aac","-b:a","96k","-shortest",
+                 "-loglevel","error", str(tmp)])
+        os.replace(tmp, paths["video"])
+    return {key: str(path) for key, path in paths.items()}
+
+
+def bench_git_revision() -> Dict[str, Any]:
+    repo_dir = Path(__file__).resolve().parent if "__file__" in globals() else Path.cwd()
+    try:
+        commit = subprocess.check_output(["git","rev-parse","HEAD"], cwd=repo_dir, stderr=subprocess.DEVNULL).decode().strip()
+        dirty = bool(subprocess.check_output(["git","status","--porcelain","--untracked-files=no"], cwd=repo_dir).strip())
+        return {"commit": commit, "dirty": dirty}
+    except Exception:
+        return {"commit": None, "dirty": None}
+
+
+def bench_run_case(mode: str, case: str, media: Dict[str, str], work_dir: Path) -> Dict[str, Any]:
+    """1ケース分の各段階を順に実行し、段階ごとの経過時間(秒)を返す"""
+    from contextlib import redirect_stdout
+    source = media["audio"] if mode == "podcast" else media["video"]
+    script_text = Path(media["script"]).read_text(encoding="utf-8")
+    settings = dict(DEFAULT_STYLE_SETTINGS)
+    preview_args = [settings[key] for key in STYLE_FIELD_ORDER if key != "speed"]
+    stages: Dict[str, float] = {}
+    state: Dict[str, Any] = {}
+    run_dir = work_dir / f"{mode}_{case}"
+    run_dir.mkdir(parents=True, exist_ok=True)
+
+    def probe():
+        with _media_probe_lock:
+            _media_probe_memo.clear()
+        state["size"] = probe_display_size(source) if mode == "subtitler" else (1920, 1080)
+        probe_media(source)
+
+    def decode():
+        state["pcm"] = decode_audio_pcm(source)
+
+    def align():
+        # キャッシュ未使用の状態で計測し、結果はrender段階で再利用される
+        state["segs"] = cached_align(source, script_text, str(run_dir / "align.json"), lambda: state["pcm"])
+
+    def build_ass():
+        # パイプラインと同じくファイルへ直接書き出し、render段階でそのまま使う
+        w, h = state["size"]
+        state["ass"] = str(run_dir / "sub.ass")
+        with open(state["ass"], "w", encoding="utf-8") as f:
+            write_ass_document(f, state["segs"], w, h, *preview_args, speed=settings["speed"], flatten_text=mode == "subtitler")
+
+    def preview():
+        if mode == "podcast":
+            podcast_generate_preview(None, *preview_args)
+        else:
+            subtitler_generate_preview(source, *preview_args)
+
+    def render():
+        # 作成済みのASSと音声を使い、エンコードだけを計測する (アラインメントやASS生成は含めない)
+        w, h = state["size"]
+        if mode == "podcast":
+            podcast_render_video(state["ass"], None, w, h, source, settings["speed"], str(run_dir / "out.mp4"))
+        else:
+            subtitler_render_video(source, state["ass"], settings["speed"], "burn", str(run_dir / "final.mp4"))
+
+    log_path = run_dir / "bench.log"
+    with log_path.open("w", encoding="utf-8") as log, redirect_stdout(log):
+        for name, fn in zip(BENCH_STAGES, [probe, decode, align, build_ass, preview, render]):
+            started = time.perf_counter()
+            fn()
+            stages[name] = round(time.perf_counter() - started, 4)
+    return stages
+
+
+def bench_compare(report: Dict[str, Any], baseline_path: str) -> None:
+    """基準レポートと段階ごとの所要時間を比較して表示する"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    base_results = {(r["mode"], r["case"]): r for r in baseline.get("results", [])}
+    print(f"📊 比較対象: {baseline.get('git', {}).get('commit')} → {report['git']['commit']}")
+    for result in report["results"]:
+        base = base_results.get((result["mode"], result["case"]))
+        if not base or result["status"] != "ok" or base.get("status") != "ok":
+            continue
+        cells = []
+        for stage in BENCH_STAGES:
+            now, before = result["stages"].get(stage), base["stages"].get(stage)
+            if now is not None and before:
+                cells.append(f"{stage} {now / before:.2f}x")
+        print(f"  {result['mode']}/{result['case']}: " + ", ".join(cells))
+
+
+def run_benchmark(report_path: str, cases: List[str], aligner: str = STUB_ALIGN_MODEL_NAME, baseline_path: Optional[str] = None) -> int:
+    """合成素材でベンチマークを実行してJSONレポートを保存し、失敗したケース数を返す"""
+    global ALIGN_BACKEND, ALIGN_MODEL_NAME, ALIGN_CACHE_DIR, ALIGN_CACHE_ON_DRIVE
+    unknown = [case for case in cases if case not in BENCH_CASES]
+    if unknown:
+        raise ValueError(f"不明なベンチマークケースです: {', '.join(unknown)} (選択肢: {', '.join(BENCH_CASES)})")
+    work_dir = Path(tempfile.mkdtemp(prefix="subtitle_bench_"))
+    # アラインメントは毎回キャッシュ無しの状態から計測する
+    ALIGN_BACKEND, ALIGN_MODEL_NAME = parse_aligner_spec(aligner)
+    ALIGN_CACHE_DIR, ALIGN_CACHE_ON_DRIVE = work_dir / "_align_cache", False
+    ffmpeg_version = subprocess.check_output(["ffmpeg","-version"]).decode("utf-8", errors="replace").splitlines()[0]
+    report = {
+        "version": BENCH_REPORT_VERSION,
+        "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "git": bench_git_revision(),
+        "environment": {"python": sys.version.split()[0], "platform": sys.platform, "cpu_count": os.cpu_count(), "ffmpeg": ffmpeg_version},
+        "aligner": aligner,
+        "results": [],
+    }
+    failures = 0
+    try:
+        for case in cases:
+            media = bench_prepare_media(case)
+            duration, lines = BENCH_CASES[case]
+            for mode in ("podcast", "subtitler"):
+                result = {"mode": mode, "case": case, "duration_sec": duration, "script_lines": lines}
+                print(f"⏱️ 計測中: {mode}/{case} ({duration}s, {lines}行)")
+                try:
+                    result.update(status="ok", stages=bench_run_case(mode, case, media, work_dir))
+                    print("   " + ", ".join(f"{k} {v:.3f}s" for k, v in result["stages"].items()))
+                except Exception as e:
+                    failures += 1
+                    result.update(status="error", error=str(e), stages={})
+                    print(f"❌ {mode}/{case} 失敗: {e}", file=sys.stderr)
+                report["results"].append(result)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    Path(report_path).parent.mkdir(parents=True, exist_ok=True)
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"🎉 ベンチマークが終了しました: {report_path}")
+    if baseline_path:
+        bench_compare(report, baseline_path)
+    return failures
+
+
+# --- 起動時のウォームアップ ---
+# 有効にすると、UIの起動と並行してアラインメントモデルの読み込み・短いダミー音声でのアラインメント・
+# フォント (fc-match/PIL/MeCab) の準備を済ませ、最初のジョブが2回目以降と同じ速さで動くようにする。
+# 読み込んだモデルは通常どおりレジストリに残り、MODEL_IDLE_UNLOAD_SEC 使われなければ解放される。
+WARMUP_ON_START = False
+WARMUP_STATUS_POLL_SEC = 2.0
+WARMUP_STEP_LABELS = {
+    "import": "ライブラリの読み込み",
+    "model": "モデルの読み込み",
+    "dummy_align": "試しのアラインメント",
+    "fonts": "フォントの準備",
+}
+
+
+class WarmupState:
+    """バックグラウンドのウォームアップと、その進み具合 (UIが定期的に status_markdown() を読む)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.steps: "OrderedDict[str, str]" = OrderedDict()
+        self.started: Optional[float] = None
+        self.elapsed_sec: Optional[float] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def done(self) -> bool:
+        return self.elapsed_sec is not None
+
+    def start(self, backend: Optional[str] = None, model_name: Optional[str] = None) -> None:
+        aligner, model_name = resolve_aligner(backend, model_name)
+        with self._lock:
+            if self._thread is not None:
+                return
+            steps = ["import", "model", "dummy_align", "fonts"] if aligner.uses_model else ["fonts"]
+            self.steps = OrderedDict((step, "pending") for step in steps)
+            self.started = time.monotonic()
+            self._thread = threading.Thread(target=self._run, args=(aligner, model_name), name="warmup", daemon=True)
+        print(f"[INFO] ウォームアップを開始します: {aligner.name} / {model_name}")
+        self._thread.start()
+
+    @contextmanager
+    def _step(self, name: str):
+        with self._lock:
+            self.steps[name] = "running"
+        started = time.monotonic()
+        try:
+            yield
+            status = "ok"
+        except Exception as e:
+            status = f"error: {e}"
+            print(f"[WARN] ウォームアップ ({WARMUP_STEP_LABELS[name]}) に失敗しました: {e}")
+        with self._lock:
+            self.steps[name] = status
+        print(f"[DEBUG] ウォームアップ {WARMUP_STEP_LABELS[name]}: {status} ({time.monotonic() - started:.1f}s)")
+
+    def _run(self, aligner: AlignerBackend, model_name: str) -> None:
+        if aligner.uses_model:
+            with self._step("import"):
+                import stable_whisper  # noqa: F401
+            with JOB_SCHEDULER.admit("align", "ウォームアップ") as budget:
+                model = None
+                with self._step("model"):
+                    model = MODEL_REGISTRY.acquire(model_name, backend=aligner.name, threads=ALIGN_THREADS or budget)
+                if model is not None:
+                    try:
+                        with self._step("dummy_align"), MODEL_REGISTRY.run_lock(model):
+                            t = np.arange(ALIGN_SAMPLE_RATE, dtype=np.float32) / ALIGN_SAMPLE_RATE
+                            aligner.align_loaded(model, (0.1 * np.sin(2 * np.pi * 220 * t)).astype(np.float32), "テスト", "ja")
+                    finally:
+                        MODEL_REGISTRY.release(model)
+                else:
+                    with self._lock:
+                        self.steps["dummy_align"] = "skipped"
+        with self._step("fonts"):
+            settings = dict(DEFAULT_STYLE_SETTINGS)
+            style_args = [settings[key] for key in STYLE_FIELD_ORDER if key != "speed"]
+            for bold in (False, True):
+                resolve_font_file(settings["font"], bold, False)
+            podcast_create_ass_content([{"start": 0.0, "end": 1.0, "text": "ウォームアップ用の字幕です"}], 1920, 1080, *style_args)
+        with self._lock:
+            self.elapsed_sec = time.monotonic() - self.started
+        print(f"[INFO] ウォームアップが完了しました ({self.elapsed_sec:.1f}s)")
+
+    def status_markdown(self) -> str:
+        with self._lock:
+            steps = dict(self.steps)
+            elapsed = self.elapsed_sec
+        if not steps:
+            return ""
+        failed = [WARMUP_STEP_LABELS[name] for name, status in steps.items() if status.startswith("error")]
+        if elapsed is not None:
+            if failed:
+                return f"⚠️ ウォームアップの一部に失敗しました ({', '.join(failed)})。最初のジョブで改めて準備します。"
+            return f"✅ 準備完了 ({elapsed:.1f}秒)。最初のジョブからすぐに処理できます。"
+        marks = {"ok": "✅", "running": "⏳", "pending": "・", "skipped": "－"}
+        items = " / ".join(f"{marks.get(status, '⚠️')} {WARMUP_STEP_LABELS[name]}" for name, status in steps.items())
+        return f"⏳ ウォームアップ中: {items}"
+
+
+WARMUP = WarmupState()
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
 # ==============================================================================
 # 3. UI定義 (Gradio)
 # ==============================================================================
@@ -1293,6 +4942,7 @@ with gr.Blocks(theme=gr.themes.Default(), css=CSS, title="字幕作成") as demo
      placeholder="例: MySubtitleNotebook",
      info="プリセットはノートブック名ごとに Google Drive 内へ保存されます。"
  )
+ warmup_status = gr.Markdown("", visible=WARMUP_ON_START)
 
 
 
@@ -1365,8 +5015,11 @@ with gr.Blocks(theme=gr.themes.Default(), css=CSS, title="字幕作成") as demo
                          podcast_preset_dropdown = gr.Dropdown(label="保存済みプリセット", choices=[], interactive=True)
                          podcast_preset_load_btn = gr.Button("プリセットを読み込み")
                          with gr.Row():
-                             podcast_preset_import_file = gr.File(label="プリセットJSONをインポート", file_types=[".json"], file_count="single")
+                             podcast_preset_import_file = gr.File(label="プリセットJSONをインポート (複数可)", file_types=[".json"], file_count="multiple")
                              podcast_preset_import_btn = gr.Button("インポートして保存")
+                         with gr.Row():
+                             podcast_preset_export_file = gr.File(label="エクスポートしたプリセット", interactive=False)
+                             podcast_preset_export_btn = gr.Button("すべてエクスポート")
                          podcast_preset_status = gr.Markdown("")
 
 
@@ -1379,6 +5032,12 @@ with gr.Blocks(theme=gr.themes.Default(), css=CSS, title="字幕作成") as demo
              with gr.Column(scale=2):
                  gr.Markdown("### 3. プレビュー＆生成")
                  podcast_preview_img = gr.Image(label="リアルタイム・プレビュー", elem_id="preview-image-podcast", interactive=False)
+                 with gr.Accordion("アラインメント設定", open=False):
+                     with gr.Row():
+                         podcast_aligner_backend = gr.Dropdown([(b.label, b.name) for b in available_aligner_backends()], value=ALIGN_BACKEND, label="方式")
+                         podcast_aligner_model = gr.Dropdown(ALIGN_MODEL_SIZES, value=ALIGN_MODEL_NAME, label="モデルサイズ", info="大きいほど正確で遅い")
+                         podcast_aligner_threads = gr.Slider(0, CPU_COUNT, value=ALIGN_THREADS, step=1, label="スレッド数 (0で自動)")
+                     podcast_aligner_info = gr.Markdown(ALIGNER_BACKENDS[ALIGN_BACKEND].description)
                  with gr.Row():
                      podcast_btn_run = gr.Button("動画を生成開始", variant="primary", scale=2)
                  podcast_vid_out = gr.Video(label="完成動画", elem_id="video-result-podcast")
@@ -1454,8 +5113,11 @@ with gr.Blocks(theme=gr.themes.Default(), css=CSS, title="字幕作成") as demo
                          subtitler_preset_dropdown = gr.Dropdown(label="保存済みプリセット", choices=[], interactive=True)
                          subtitler_preset_load_btn = gr.Button("プリセットを読み込み")
                          with gr.Row():
-                             subtitler_preset_import_file = gr.File(label="プリセットJSONをインポート", file_types=[".json"], file_count="single")
+                             subtitler_preset_import_file = gr.File(label="プリセットJSONをインポート (複数可)", file_types=[".json"], file_count="multiple")
                              subtitler_preset_import_btn = gr.Button("インポートして保存")
+                         with gr.Row():
+                             subtitler_preset_export_file = gr.File(label="エクスポートしたプリセット", interactive=False)
+                             subtitler_preset_export_btn = gr.Button("すべてエクスポート")
                          subtitler_preset_status = gr.Markdown("")
 
 
@@ -1468,11 +5130,18 @@ with gr.Blocks(theme=gr.themes.Default(), css=CSS, title="字幕作成") as demo
              with gr.Column(scale=2):
                  gr.Markdown("### 3. プレビュー＆生成")
                  subtitler_preview_img = gr.Image(label="リアルタイム・プレビュー", elem_id="preview-image-subtitler", interactive=False)
+                 subtitler_output_mode = gr.Radio(SUBTITLER_OUTPUT_MODES, value="burn", label="出力形式", info="字幕トラック形式は動画を再エンコードしないため高速です (速度1.0のとき)。")
+                 with gr.Accordion("アラインメント設定", open=False):
+                     with gr.Row():
+                         subtitler_aligner_backend = gr.Dropdown([(b.label, b.name) for b in available_aligner_backends()], value=ALIGN_BACKEND, label="方式")
+                         subtitler_aligner_model = gr.Dropdown(ALIGN_MODEL_SIZES, value=ALIGN_MODEL_NAME, label="モデルサイズ", info="大きいほど正確で遅い")
+                         subtitler_aligner_threads = gr.Slider(0, CPU_COUNT, value=ALIGN_THREADS, step=1, label="スレッド数 (0で自動)")
+                     subtitler_aligner_info = gr.Markdown(ALIGNER_BACKENDS[ALIGN_BACKEND].description)
                  with gr.Row():
                      subtitler_btn_run = gr.Button("動画を生成開始", variant="primary", scale=2)
                  subtitler_vid_out = gr.Video(label="完成動画", elem_id="video-result-subtitler")
                  with gr.Accordion("その他生成ファイル", open=False):
-                     subtitler_files_out = [gr.File(label=l) for l in ["字幕(ASS)","アラインメント(JSON)"]]
+                     subtitler_files_out = [gr.File(label=l) for l in ["字幕(ASS)","アラインメント(JSON)","完成動画ファイル"]]
 
 
 
@@ -1512,10 +5181,15 @@ with gr.Blocks(theme=gr.themes.Default(), css=CSS, title="字幕作成") as demo
      podcast_align, podcast_margin, podcast_wrap, podcast_char_spacing,
      podcast_speed, # new speed input
      podcast_use_out, podcast_out_w, podcast_use_shad, podcast_shad_d, podcast_out_col,
-     podcast_use_bg, podcast_bg_col, podcast_bg_alpha
+     podcast_use_bg, podcast_bg_col, podcast_bg_alpha,
+     podcast_aligner_backend, podcast_aligner_model, podcast_aligner_threads
  ]
- for inp in podcast_style_inputs:
-     inp.change(fn=podcast_generate_preview, inputs=podcast_style_inputs, outputs=podcast_preview_img)
+ # 全スタイル入力を1つのイベントにまとめ、実行中に来た変更は最後の1件だけを後追いで処理する
+ gr.on(
+     triggers=[inp.change for inp in podcast_style_inputs],
+     fn=podcast_live_preview, inputs=podcast_style_inputs, outputs=podcast_preview_img,
+     trigger_mode="always_last", concurrency_limit=PREVIEW_CONCURRENCY_LIMIT, concurrency_id="style_preview"
+ )
 
 
 
@@ -1530,12 +5204,15 @@ with gr.Blocks(theme=gr.themes.Default(), css=CSS, title="字幕作成") as demo
  ).then(
      fn=podcast_create_video,
      inputs=podcast_main_inputs,
-     outputs=[podcast_vid_out, podcast_files_out[0], podcast_files_out[1], podcast_mp4_path_state]
+     outputs=[podcast_vid_out, podcast_files_out[0], podcast_files_out[1], podcast_mp4_path_state],
+     # 重い段階はJOB_SCHEDULERが順番を管理するため、Gradio側では両タブ合わせて一定数まで受け付ける
+     concurrency_limit=JOB_MAX_ACTIVE, concurrency_id="pipeline_jobs"
  ).then(
      fn=lambda: gr.update(interactive=True, value="動画を生成開始"),
      outputs=[podcast_btn_run]
  )
  podcast_advanced.change(fn=lambda x: gr.update(visible=x), inputs=podcast_advanced, outputs=podcast_style_group)
+ podcast_aligner_backend.change(fn=lambda name: get_aligner_backend(name).description, inputs=podcast_aligner_backend, outputs=podcast_aligner_info)
 
 
 
@@ -1578,7 +5255,7 @@ with gr.Blocks(theme=gr.themes.Default(), css=CSS, title="字幕作成") as demo
      outputs=[podcast_preset_dropdown, podcast_preset_status, podcast_preset_name]
  )
  podcast_preset_refresh_btn.click(
-     fn=lambda notebook_name: handle_preset_refresh(notebook_name, "podcast"),
+     fn=lambda notebook_name: handle_preset_refresh(notebook_name, "podcast", force=True),
      inputs=[notebook_name_input],
      outputs=[podcast_preset_dropdown]
  )
@@ -1592,6 +5269,11 @@ with gr.Blocks(theme=gr.themes.Default(), css=CSS, title="字幕作成") as demo
      inputs=[podcast_preset_import_file, notebook_name_input],
      outputs=[podcast_preset_dropdown, podcast_preset_status, podcast_preset_import_file]
  )
+ podcast_preset_export_btn.click(
+     fn=lambda notebook_name: handle_preset_export(notebook_name, "podcast"),
+     inputs=[notebook_name_input],
+     outputs=[podcast_preset_export_file, podcast_preset_status]
+ )
 
 
 
@@ -1624,10 +5306,15 @@ with gr.Blocks(theme=gr.themes.Default(), css=CSS, title="字幕作成") as demo
      subtitler_align, subtitler_margin, subtitler_wrap, subtitler_char_spacing,
      subtitler_speed, # new speed input
      subtitler_use_out, subtitler_out_w, subtitler_use_shad, subtitler_shad_d, subtitler_out_col,
-     subtitler_use_bg, subtitler_bg_col, subtitler_bg_alpha
+     subtitler_use_bg, subtitler_bg_col, subtitler_bg_alpha,
+     subtitler_output_mode,
+     subtitler_aligner_backend, subtitler_aligner_model, subtitler_aligner_threads
  ]
- for inp in subtitler_style_inputs:
-     inp.change(fn=subtitler_generate_preview, inputs=subtitler_style_inputs, outputs=subtitler_preview_img, show_progress="hidden")
+ gr.on(
+     triggers=[inp.change for inp in subtitler_style_inputs],
+     fn=subtitler_live_preview, inputs=subtitler_style_inputs, outputs=subtitler_preview_img, show_progress="hidden",
+     trigger_mode="always_last", concurrency_limit=PREVIEW_CONCURRENCY_LIMIT, concurrency_id="style_preview"
+ )
 
 
 
@@ -1642,12 +5329,14 @@ with gr.Blocks(theme=gr.themes.Default(), css=CSS, title="字幕作成") as demo
  ).then(
     fn=subtitler_create_video_with_subs,
     inputs=subtitler_main_inputs,
-    outputs=[subtitler_vid_out, subtitler_files_out[0], subtitler_files_out[1]]
+    outputs=[subtitler_vid_out, subtitler_files_out[0], subtitler_files_out[1], subtitler_files_out[2]],
+    concurrency_limit=JOB_MAX_ACTIVE, concurrency_id="pipeline_jobs"
  ).then(
     fn=lambda: gr.update(interactive=True, value="動画を生成開始"),
     outputs=[subtitler_btn_run]
  )
  subtitler_advanced.change(fn=lambda x: gr.update(visible=x), inputs=subtitler_advanced, outputs=subtitler_style_group)
+ subtitler_aligner_backend.change(fn=lambda name: get_aligner_backend(name).description, inputs=subtitler_aligner_backend, outputs=subtitler_aligner_info)
 
 
 
@@ -1670,7 +5359,7 @@ with gr.Blocks(theme=gr.themes.Default(), css=CSS, title="字幕作成") as demo
      outputs=[subtitler_preset_dropdown, subtitler_preset_status, subtitler_preset_name]
  )
  subtitler_preset_refresh_btn.click(
-     fn=lambda notebook_name: handle_preset_refresh(notebook_name, "subtitler"),
+     fn=lambda notebook_name: handle_preset_refresh(notebook_name, "subtitler", force=True),
      inputs=[notebook_name_input],
      outputs=[subtitler_preset_dropdown]
  )
@@ -1684,6 +5373,11 @@ with gr.Blocks(theme=gr.themes.Default(), css=CSS, title="字幕作成") as demo
      inputs=[subtitler_preset_import_file, notebook_name_input],
      outputs=[subtitler_preset_dropdown, subtitler_preset_status, subtitler_preset_import_file]
  )
+ subtitler_preset_export_btn.click(
+     fn=lambda notebook_name: handle_preset_export(notebook_name, "subtitler"),
+     inputs=[notebook_name_input],
+     outputs=[subtitler_preset_export_file, subtitler_preset_status]
+ )
 
 
 
@@ -1692,22 +5386,17 @@ with gr.Blocks(theme=gr.themes.Default(), css=CSS, title="字幕作成") as demo
 
 
 
-    # [リスナー] 初期プレビュー生成
-    demo.load(fn=podcast_generate_preview, inputs=podcast_style_inputs, outputs=podcast_preview_img)
-    demo.load(fn=subtitler_generate_preview, inputs=subtitler_style_inputs, outputs=subtitler_preview_img)
-    demo.load(fn=lambda notebook_name: handle_preset_refresh(notebook_name, "podcast"), inputs=[notebook_name_input], outputs=[podcast_preset_dropdown])
-    demo.load(fn=lambda notebook_name: handle_preset_refresh(notebook_name, "subtitler"), inputs=[notebook_name_input], outputs=[subtitler_preset_dropdown])
-
-    notebook_name_input.change(fn=lambda notebook_name: handle_preset_refresh(notebook_name, "podcast"), inputs=[notebook_name_input], outputs=[podcast_preset_dropdown])
-    notebook_name_input.change(fn=lambda notebook_name: handle_preset_refresh(notebook_name, "subtitler"), inputs=[notebook_name_input], outputs=[subtitler_preset_dropdown])
  # [リスナー] 初期プレビュー生成
-demo.load(fn=podcast_generate_preview, inputs=podcast_style_inputs, outputs=podcast_preview_img)
-demo.load(fn=subtitler_generate_preview, inputs=subtitler_style_inputs, outputs=subtitler_preview_img)
-demo.load(fn=lambda notebook_name: handle_preset_refresh(notebook_name, "podcast"), inputs=[notebook_name_input], outputs=[podcast_preset_dropdown])
-demo.load(fn=lambda notebook_name: handle_preset_refresh(notebook_name, "subtitler"), inputs=[notebook_name_input], outputs=[subtitler_preset_dropdown])
+ demo.load(fn=podcast_generate_preview, inputs=podcast_style_inputs, outputs=podcast_preview_img)
+ demo.load(fn=subtitler_generate_preview, inputs=subtitler_style_inputs, outputs=subtitler_preview_img)
+ demo.load(fn=lambda notebook_name: handle_preset_refresh(notebook_name, "podcast"), inputs=[notebook_name_input], outputs=[podcast_preset_dropdown])
+ demo.load(fn=lambda notebook_name: handle_preset_refresh(notebook_name, "subtitler"), inputs=[notebook_name_input], outputs=[subtitler_preset_dropdown])
+
+ if WARMUP_ON_START:
+     demo.load(fn=WARMUP.status_markdown, outputs=warmup_status, every=WARMUP_STATUS_POLL_SEC, show_progress="hidden")
 
-notebook_name_input.change(fn=lambda notebook_name: handle_preset_refresh(notebook_name, "podcast"), inputs=[notebook_name_input], outputs=[podcast_preset_dropdown])
-notebook_name_input.change(fn=lambda notebook_name: handle_preset_refresh(notebook_name, "subtitler"), inputs=[notebook_name_input], outputs=[subtitler_preset_dropdown])
+ notebook_name_input.change(fn=handle_notebook_name_change, inputs=[notebook_name_input], outputs=[podcast_preset_dropdown, subtitler_preset_dropdown],
+                            trigger_mode="always_last")
 
 
 
@@ -1728,7 +5417,29 @@ print("✅ UIの定義とイベント登録が完了しました。")
 # ==============================================================================
 # 4. UI起動
 # ==============================================================================
-print("\n🎉 UIを起動します... Public URLが表示されるまでしばらくお待ちください。")
-demo.queue()
-demo.launch(share=True, debug=True)
-
+# import時はUIを定義するだけで、起動やCLIの実行はしない
+if __name__ == "__main__":
+    CLI_ARGS = parse_cli_args()
+    if CLI_ARGS.preview_parity:
+        sys.exit(run_preview_parity_check())
+    if CLI_ARGS.self_test:
+        sys.exit(run_self_tests({
+            "podcast_create_video": (podcast_create_video, len(podcast_main_inputs)),
+            "subtitler_create_video_with_subs": (subtitler_create_video_with_subs, len(subtitler_main_inputs)),
+        }))
+    # 有効にしたときだけ、ベンチマーク・バッチ・UIのどれもtorchを読み込む前に長時間モードのワーカーを起動しておく
+    if LONGFORM_WORKER_POOL or CLI_ARGS.longform_workers:
+        start_longform_pool()
+    if CLI_ARGS.bench:
+        sys.exit(1 if run_benchmark(CLI_ARGS.bench, CLI_ARGS.bench_cases.split(","), CLI_ARGS.bench_aligner, CLI_ARGS.bench_baseline) else 0)
+    if CLI_ARGS.batch:
+        sys.exit(1 if run_batch(CLI_ARGS.batch, CLI_ARGS.out_dir, CLI_ARGS.workers, CLI_ARGS.force) else 0)
+    print("\n🎉 UIを起動します... Public URLが表示されるまでしばらくお待ちください。")
+    print(f"[INFO] ジョブ同時実行数: アラインメント {ALIGN_MAX_CONCURRENT} / エンコード {ENCODE_MAX_CONCURRENT} (CPU {CPU_COUNT}コア)")
+    prune_runs()
+    scratch_usage = SCRATCH.usage()
+    print(f"[INFO] スクラッチ領域: {SCRATCH.root} ({scratch_usage['files']}ファイル, {scratch_usage['mb']}/{scratch_usage['max_mb']}MB)")
+    if WARMUP_ON_START:
+        WARMUP.start()
+    demo.queue()
+    demo.launch(share=True, debug=True)